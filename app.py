@@ -1,7 +1,9 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, status, WebSocket, WebSocketDisconnect
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
 from typing import Optional, List, Union
 import jwt
@@ -9,26 +11,39 @@ from passlib.context import CryptContext
 import os
 import re
 import json
+import asyncio
 from urllib.parse import urlparse
 from github import Github, GithubException
 
 # Import database models and schemas
-from database.database import get_db, User, Repository, LearningPlan, get_user_by_username
+from database.database import (
+    get_db, AsyncSessionLocal, User, Repository, LearningPlan, get_user_by_username, get_latest_learning_plan,
+    LearningPlanStep, StepProgress, get_exercises_by_ids, save_exercises, get_plan_step, with_plan_relations,
+    keyset_page
+)
 
 # Import services
 from services.learning_plan_service import LearningPlanService
 from services.code_validator import code_validator
 from services.exercise_generator import exercise_generator
+from services.exercise_registry import exercise_registry
+from services.validation_queue import validation_queue, QueueFullError
+from services.batch_validation import batch_validator, BatchSubmission, BatchStats
+from services.validation_jobs import VALIDATION_BACKEND, validation_jobs, ValidationJobTimeout
 from database.schemas import (
     User as UserSchema, UserCreate, UserUpdate,
-    Repository as RepositorySchema, RepositoryCreate, RepositoryUpdate,
-    LearningPlan as LearningPlanSchema, LearningPlanCreate, LearningPlanUpdate,
+    Repository as RepositorySchema, RepositoryCreate, RepositoryUpdate, RepositoryPage,
+    LearningPlan as LearningPlanSchema, LearningPlanCreate, LearningPlanUpdate, LearningPlanPage,
+    StepProgress as StepProgressSchema, StepProgressUpdate,
     Token, TokenData, UserLogin, LearningStep,
     GitHubRepositoryInfo, SearchRequest, SearchResponse,
-    GeneratedLearningPlan, GeneratePlanRequest, GeneratePlanResponse, EnhancedLearningStepDetail,
-    CodingExercise, CodingExerciseSubmission, CodingExerciseValidation
+    GeneratedLearningPlan, GeneratePlanRequest, GeneratePlanResponse, EnhancedLearningStepDetail, RegenerationMode,
+    CodingExercise, CodingExerciseSubmission, CodingExerciseValidation, BatchValidationRequest
 )
 
+# Validates submissions in this process, or hands them to validation workers (VALIDATION_BACKEND=queue)
+validator = validation_jobs if VALIDATION_BACKEND == "queue" else code_validator
+
 # Create FastAPI app instance
 app = FastAPI(
     title="CodeLap Lean API",
@@ -60,6 +75,10 @@ security = HTTPBearer()
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
 github_client = Github(GITHUB_TOKEN) if GITHUB_TOKEN else Github()
 
+# List endpoints return pages of this many rows by default
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "20"))
+MAX_PAGE_SIZE = 100
+
 # Learning Plan Service
 learning_plan_service = LearningPlanService()
 
@@ -70,8 +89,8 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = get_user_by_username(db, username)
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = await get_user_by_username(db, username)
     if not user:
         return False
     if not verify_password(password, user.hashed_password):
@@ -265,6 +284,195 @@ def generate_ai_prerequisites(repo_info: dict) -> List[str]:
     
     return list(set(prerequisites))  # Remove duplicates
 
+# Learning plan persistence helpers
+def build_generated_plan(generated_plan: dict) -> GeneratedLearningPlan:
+    """Convert a generated plan dictionary to the response format"""
+    learning_steps = []
+    for step in generated_plan.get("learning_steps", []):
+        # Convert coding_exercises from dict to CodingExercise objects
+        if "coding_exercises" in step:
+            step["coding_exercises"] = [CodingExercise(**ex) for ex in step["coding_exercises"]]
+        learning_steps.append(EnhancedLearningStepDetail(**step))
+    
+    return GeneratedLearningPlan(
+        title=generated_plan.get("title", ""),
+        description=generated_plan.get("description", ""),
+        difficulty_level=generated_plan.get("difficulty_level", "intermediate"),
+        estimated_duration=generated_plan.get("estimated_duration", "20 hours"),
+        learning_steps=learning_steps,
+        prerequisites=generated_plan.get("prerequisites", []),
+        learning_objectives=generated_plan.get("learning_objectives", []),
+        technologies_covered=generated_plan.get("technologies_covered", [])
+    )
+
+async def stored_learning_plan(db: AsyncSession, db_learning_plan: LearningPlan) -> dict:
+    """Rebuild a generated plan dictionary from a stored learning plan (steps and progress loaded)"""
+    learning_steps = db_learning_plan.learning_steps
+    
+    # Steps reference exercises by id, resolve them all with one query
+    exercise_ids = [
+        exercise_id for step in learning_steps for exercise_id in step.get("coding_exercise_ids", [])
+    ]
+    exercises = await get_exercises_by_ids(db, exercise_ids)
+    for step in learning_steps:
+        if "coding_exercise_ids" in step:
+            step["coding_exercises"] = [
+                {**exercises[exercise_id], "id": exercise_id}
+                for exercise_id in step.pop("coding_exercise_ids") if exercise_id in exercises
+            ]
+    
+    metadata = db_learning_plan.plan_metadata or {}
+    
+    return {
+        "title": db_learning_plan.title,
+        "description": db_learning_plan.description or "",
+        "difficulty_level": db_learning_plan.difficulty_level or "intermediate",
+        "estimated_duration": metadata.get("estimated_duration", f"{db_learning_plan.estimated_duration or 20} hours"),
+        "learning_steps": learning_steps,
+        "prerequisites": metadata.get("prerequisites", []),
+        "learning_objectives": metadata.get("learning_objectives", []),
+        "technologies_covered": metadata.get("technologies_covered", [])
+    }
+
+async def save_learning_plan(
+    db: AsyncSession,
+    user_id: int,
+    repository_id: Optional[int],
+    response_plan: GeneratedLearningPlan,
+    fingerprint: Optional[str],
+    digests: Optional[dict],
+    db_learning_plan: Optional[LearningPlan] = None
+) -> LearningPlan:
+    """Insert a generated plan, or update db_learning_plan in place when refreshing it"""
+    if db_learning_plan is None:
+        db_learning_plan = LearningPlan(
+            user_id=user_id, repository_id=repository_id, status="active", steps=[], progress=[]
+        )
+        db.add(db_learning_plan)
+    
+    duration = response_plan.estimated_duration.split()[0]
+    db_learning_plan.title = response_plan.title
+    db_learning_plan.description = response_plan.description
+    # Steps are rows keyed by step number: a refresh updates them in place and leaves progress rows alone
+    steps_by_number = {db_step.step_number: db_step for db_step in db_learning_plan.steps}
+    progress_by_number = {progress.step_number: progress for progress in db_learning_plan.progress}
+    for step in response_plan.learning_steps:
+        # Exercises are stored once in the exercises table, steps only keep their ids
+        coding_exercises = [exercise.dict() for exercise in step.coding_exercises]
+        await save_exercises(db, coding_exercises)
+        for exercise in coding_exercises:
+            # Exercises of a fresh plan are validated soon, keep them warm
+            exercise_registry.remember(exercise)
+        
+        db_step = steps_by_number.pop(step.step, None)
+        if db_step is None:
+            db_step = LearningPlanStep(step_number=step.step)
+            db_learning_plan.steps.append(db_step)
+        db_step.title = step.title
+        db_step.description = step.description
+        db_step.duration = step.duration
+        db_step.resources = step.resources
+        db_step.exercises = step.exercises
+        coding_exercise_ids = [exercise["id"] for exercise in coding_exercises]
+        progress = progress_by_number.get(step.step)
+        if progress is not None and db_step.coding_exercise_ids != coding_exercise_ids:
+            # A rewritten step keeps its completed flag, but its exercises are new
+            progress.exercises_completed = 0
+        db_step.coding_exercise_ids = coding_exercise_ids
+        db_step.total_exercises = len(coding_exercises)
+    for db_step in steps_by_number.values():
+        db_learning_plan.steps.remove(db_step)
+    # Progress of steps the plan no longer has would come back if a later save reuses the number
+    step_numbers = {step.step for step in response_plan.learning_steps}
+    for step_number, progress in progress_by_number.items():
+        if step_number not in step_numbers:
+            db_learning_plan.progress.remove(progress)
+    
+    db_learning_plan.difficulty_level = response_plan.difficulty_level
+    db_learning_plan.estimated_duration = int(duration) if duration.isdigit() else 20
+    db_learning_plan.plan_metadata = {
+        "estimated_duration": response_plan.estimated_duration,
+        "prerequisites": response_plan.prerequisites,
+        "learning_objectives": response_plan.learning_objectives,
+        "technologies_covered": response_plan.technologies_covered
+    }
+    db_learning_plan.source_fingerprint = fingerprint
+    db_learning_plan.source_digests = digests
+    
+    await db.commit()
+    await db.refresh(db_learning_plan, ["created_at", "updated_at"])
+    return db_learning_plan
+
+def repository_to_repo_info(db_repo: Repository) -> dict:
+    """Build the repository information used for plan generation from a stored repository"""
+    return {
+        "id": db_repo.id,
+        "name": db_repo.name,
+        "description": db_repo.description,
+        "html_url": db_repo.repo_url,
+        "language": db_repo.language,
+        "stars": db_repo.stars,
+        "forks": db_repo.forks,
+        "topics": json.loads(db_repo.ai_prerequisites) if db_repo.ai_prerequisites else [],
+        "size": 0,
+        "created_at": db_repo.created_at.isoformat() if db_repo.created_at else None,
+        "updated_at": db_repo.updated_at.isoformat() if db_repo.updated_at else None,
+        "readme_preview": ""
+    }
+
+async def generate_or_refresh_plan(
+    db: AsyncSession,
+    user_id: int,
+    repository_id: Optional[int],
+    repo_info: dict,
+    regeneration_mode: RegenerationMode = "incremental"
+) -> tuple:
+    """
+    Generate and store a plan, reusing or incrementally refreshing the user's previous plan
+    
+    Returns:
+        Tuple of (GeneratedLearningPlan, generation mode, changed input fields)
+    """
+    fingerprint, digests = learning_plan_service.fingerprint_inputs(repo_info)
+    
+    existing_plan = None
+    if repository_id and regeneration_mode != "full":
+        existing_plan = await get_latest_learning_plan(db, user_id, repository_id)
+    
+    changed_fields = []
+    if existing_plan is not None and existing_plan.source_fingerprint == fingerprint:
+        # Nothing the prompt depends on has changed, reuse the stored plan
+        return build_generated_plan(await stored_learning_plan(db, existing_plan)), "unchanged", changed_fields
+    
+    # LLM calls are blocking, so they run off the event loop
+    generated_plan = None
+    if existing_plan is not None and existing_plan.source_digests:
+        # Only rewrite the steps affected by the changed inputs
+        generation_mode = "incremental"
+        changed_fields = learning_plan_service.changed_inputs(existing_plan.source_digests, digests)
+        generated_plan = await asyncio.to_thread(
+            learning_plan_service.refresh_learning_plan,
+            await stored_learning_plan(db, existing_plan), repo_info, changed_fields
+        )
+    if generated_plan is None:
+        # No previous plan to refresh, or the model's update was unusable
+        generation_mode = "full"
+        existing_plan = None
+        generated_plan = await asyncio.to_thread(learning_plan_service.generate_learning_plan, repo_info)
+    
+    response_plan = build_generated_plan(generated_plan)
+    if generated_plan.get("is_fallback"):
+        # The model failed and this is a placeholder; stored without the inputs'
+        # fingerprint, the next request generates the plan again instead of reusing it
+        fingerprint, digests = None, None
+    
+    # Store the learning plan in the database
+    await save_learning_plan(
+        db, user_id, repository_id, response_plan,
+        fingerprint, digests, db_learning_plan=existing_plan
+    )
+    return response_plan, generation_mode, changed_fields
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -275,23 +483,26 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+async def user_from_token(db: AsyncSession, token: str) -> Optional[User]:
+    """The user a JWT access token belongs to, or None if the token is invalid"""
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
-            raise credentials_exception
+            return None
         token_data = TokenData(username=username)
     except jwt.PyJWTError:
-        raise credentials_exception
-    user = get_user_by_username(db, username=token_data.username)
+        return None
+    return await get_user_by_username(db, username=token_data.username)
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: AsyncSession = Depends(get_db)):
+    user = await user_from_token(db, credentials.credentials)
     if user is None:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
 
 async def get_current_active_user(current_user: User = Depends(get_current_user)):
@@ -310,10 +521,27 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy"}
 
+@app.get("/metrics/plan-generation")
+async def plan_generation_metrics(current_user: User = Depends(get_current_active_user)):
+    """Per-route latency and cost of learning plan generation"""
+    return learning_plan_service.router.get_stats()
+
+@app.get("/metrics/validation")
+async def validation_metrics(current_user: User = Depends(get_current_active_user)):
+    """Queue depth, wait times and cache hit rates of code validation"""
+    metrics = {
+        "queue": validation_queue.stats(),
+        "submission_cache": code_validator.cache.stats(),
+        "exercise_registry": exercise_registry.stats()
+    }
+    if VALIDATION_BACKEND == "queue":
+        metrics["validation_jobs"] = validation_jobs.stats()
+    return metrics
+
 @app.post("/login", response_model=Token)
-async def login_for_access_token(user_credentials: UserLogin, db: Session = Depends(get_db)):
+async def login_for_access_token(user_credentials: UserLogin, db: AsyncSession = Depends(get_db)):
     """Login endpoint that returns JWT token"""
-    user = authenticate_user(db, user_credentials.username, user_credentials.password)
+    user = await authenticate_user(db, user_credentials.username, user_credentials.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -341,10 +569,10 @@ async def protected_endpoint(current_user: User = Depends(get_current_active_use
     }
 
 @app.post("/register", response_model=UserSchema)
-async def register_user(user_credentials: UserCreate, db: Session = Depends(get_db)):
+async def register_user(user_credentials: UserCreate, db: AsyncSession = Depends(get_db)):
     """Register a new user"""
     # Check if username already exists
-    existing_user = get_user_by_username(db, user_credentials.username)
+    existing_user = await get_user_by_username(db, user_credentials.username)
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -361,38 +589,41 @@ async def register_user(user_credentials: UserCreate, db: Session = Depends(get_
         disabled=False
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 # Repository endpoints
 @app.post("/repositories/", response_model=RepositorySchema)
 async def create_repository(
     repository: RepositoryCreate, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Create a new repository"""
     db_repository = Repository(**repository.dict())
     db.add(db_repository)
-    db.commit()
-    db.refresh(db_repository)
+    await db.commit()
+    await db.refresh(db_repository)
     return db_repository
 
-@app.get("/repositories/", response_model=List[RepositorySchema])
+@app.get("/repositories/", response_model=RepositoryPage)
 async def get_repositories(
-    skip: int = 0, 
-    limit: int = 100, 
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get all repositories"""
-    repositories = db.query(Repository).offset(skip).limit(limit).all()
-    return repositories
+    """Get repositories, newest first; pass next_cursor back as cursor for the next page"""
+    try:
+        repositories, next_cursor = await keyset_page(db, select(Repository), Repository, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": repositories, "next_cursor": next_cursor}
 
 @app.get("/repositories/{repository_id}", response_model=RepositorySchema)
-async def get_repository(repository_id: int, db: Session = Depends(get_db)):
+async def get_repository(repository_id: int, db: AsyncSession = Depends(get_db)):
     """Get a specific repository"""
-    repository = db.query(Repository).filter(Repository.id == repository_id).first()
+    repository = await db.get(Repository, repository_id)
     if repository is None:
         raise HTTPException(status_code=404, detail="Repository not found")
     return repository
@@ -401,47 +632,84 @@ async def get_repository(repository_id: int, db: Session = Depends(get_db)):
 @app.post("/learning-plans/", response_model=LearningPlanSchema)
 async def create_learning_plan(
     learning_plan: LearningPlanCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Create a new learning plan"""
     db_learning_plan = LearningPlan(
-        **learning_plan.dict(),
-        user_id=current_user.id
+        **learning_plan.dict(exclude={"learning_steps"}),
+        user_id=current_user.id,
+        steps=[
+            LearningPlanStep(step_number=step.step, title=step.title, description=step.description)
+            for step in learning_plan.learning_steps
+        ],
+        progress=[
+            StepProgress(step_number=step.step, completed=True)
+            for step in learning_plan.learning_steps if step.completed
+        ]
     )
     db.add(db_learning_plan)
-    db.commit()
-    db.refresh(db_learning_plan)
+    await db.commit()
+    # The response includes the user and repository
+    await db.refresh(db_learning_plan, ["created_at", "user", "repository"])
     return db_learning_plan
 
-@app.get("/learning-plans/", response_model=List[LearningPlanSchema])
+@app.get("/learning-plans/", response_model=LearningPlanPage)
 async def get_learning_plans(
-    skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    """Get learning plans for current user"""
-    learning_plans = db.query(LearningPlan).filter(
-        LearningPlan.user_id == current_user.id
-    ).offset(skip).limit(limit).all()
-    return learning_plans
+    """Get learning plans for current user, newest first; pass next_cursor back as cursor for the next page"""
+    statement = with_plan_relations(select(LearningPlan).where(LearningPlan.user_id == current_user.id))
+    try:
+        learning_plans, next_cursor = await keyset_page(db, statement, LearningPlan, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": learning_plans, "next_cursor": next_cursor}
 
 @app.get("/learning-plans/{learning_plan_id}", response_model=LearningPlanSchema)
 async def get_learning_plan(
     learning_plan_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Get a specific learning plan"""
-    learning_plan = db.query(LearningPlan).filter(
-        LearningPlan.id == learning_plan_id,
-        LearningPlan.user_id == current_user.id
-    ).first()
+    learning_plan = await db.scalar(with_plan_relations(
+        select(LearningPlan).where(
+            LearningPlan.id == learning_plan_id,
+            LearningPlan.user_id == current_user.id
+        )
+    ))
     if learning_plan is None:
         raise HTTPException(status_code=404, detail="Learning plan not found")
     return learning_plan
 
+@app.put("/learning-plans/{learning_plan_id}/steps/{step_number}/progress", response_model=StepProgressSchema)
+async def update_step_progress(
+    learning_plan_id: int,
+    step_number: int,
+    progress_update: StepProgressUpdate,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Mark a step (or some of its exercises) complete, writing only that step's progress row"""
+    step = await get_plan_step(db, current_user.id, learning_plan_id, step_number)
+    if step is None:
+        raise HTTPException(status_code=404, detail="Learning step not found")
+    
+    progress = await db.get(StepProgress, (learning_plan_id, step_number))
+    if progress is None:
+        progress = StepProgress(plan_id=learning_plan_id, step_number=step_number, completed=False, exercises_completed=0)
+        db.add(progress)
+    if progress_update.completed is not None:
+        progress.completed = progress_update.completed
+    if progress_update.exercises_completed is not None:
+        progress.exercises_completed = max(0, min(progress_update.exercises_completed, step.total_exercises or 0))
+    await db.commit()
+    return progress
+
 # GitHub Search endpoint
 @app.post("/search-repo", response_model=SearchResponse)
 async def search_repository(
@@ -506,7 +774,7 @@ async def search_repository(
 @app.post("/generate-plan", response_model=GeneratePlanResponse)
 async def generate_learning_plan(
     request: GeneratePlanRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -519,24 +787,11 @@ async def generate_learning_plan(
         # Get repository information from different sources
         if request.repository_id:
             # Get repository from database
-            db_repo = db.query(Repository).filter(Repository.id == request.repository_id).first()
+            db_repo = await db.get(Repository, request.repository_id)
             if not db_repo:
                 raise HTTPException(status_code=404, detail="Repository not found in database")
             
-            repo_info = {
-                "id": db_repo.id,
-                "name": db_repo.name,
-                "description": db_repo.description,
-                "html_url": db_repo.repo_url,
-                "language": db_repo.language,
-                "stars": db_repo.stars,
-                "forks": db_repo.forks,
-                "topics": json.loads(db_repo.ai_prerequisites) if db_repo.ai_prerequisites else [],
-                "size": 0,
-                "created_at": db_repo.created_at.isoformat() if db_repo.created_at else None,
-                "updated_at": db_repo.updated_at.isoformat() if db_repo.updated_at else None,
-                "readme_preview": ""
-            }
+            repo_info = repository_to_repo_info(db_repo)
             
         elif request.repository_url:
             # Fetch repository from GitHub
@@ -545,7 +800,7 @@ async def generate_learning_plan(
             
             try:
                 owner, repo_name = extract_repo_info_from_url(request.repository_url)
-                repo_info = get_repository_details(owner, repo_name)
+                repo_info = await asyncio.to_thread(get_repository_details, owner, repo_name)
             except Exception as e:
                 raise HTTPException(status_code=400, detail=f"Error fetching repository: {str(e)}")
                 
@@ -556,48 +811,17 @@ async def generate_learning_plan(
         else:
             raise HTTPException(status_code=400, detail="Must provide repository_id, repository_url, or repository_info")
         
-        # Generate learning plan using the service
-        generated_plan = learning_plan_service.generate_learning_plan(repo_info)
-        
-        # Convert the generated plan to the response format
-        learning_steps = []
-        for step in generated_plan.get("learning_steps", []):
-            # Convert coding_exercises from dict to CodingExercise objects
-            if "coding_exercises" in step:
-                step["coding_exercises"] = [CodingExercise(**ex) for ex in step["coding_exercises"]]
-            learning_steps.append(EnhancedLearningStepDetail(**step))
-        
-        response_plan = GeneratedLearningPlan(
-            title=generated_plan.get("title", ""),
-            description=generated_plan.get("description", ""),
-            difficulty_level=generated_plan.get("difficulty_level", "intermediate"),
-            estimated_duration=generated_plan.get("estimated_duration", "20 hours"),
-            learning_steps=learning_steps,
-            prerequisites=generated_plan.get("prerequisites", []),
-            learning_objectives=generated_plan.get("learning_objectives", []),
-            technologies_covered=generated_plan.get("technologies_covered", [])
+        repository_id = repo_info.get("id") if repo_info.get("id") else None
+        response_plan, generation_mode, changed_fields = await generate_or_refresh_plan(
+            db, current_user.id, repository_id, repo_info, request.regeneration_mode
         )
         
-        # Store the learning plan in the database
-        db_learning_plan = LearningPlan(
-            user_id=current_user.id,
-            repository_id=repo_info.get("id") if repo_info.get("id") else None,
-            title=response_plan.title,
-            description=response_plan.description,
-            learning_steps=json.dumps([step.dict() for step in response_plan.learning_steps]),
-            status="active",
-            difficulty_level=response_plan.difficulty_level,
-            estimated_duration=int(response_plan.estimated_duration.split()[0]) if response_plan.estimated_duration.split()[0].isdigit() else 20
-        )
-        
-        db.add(db_learning_plan)
-        db.commit()
-        db.refresh(db_learning_plan)
-        
         return GeneratePlanResponse(
             success=True,
             learning_plan=response_plan,
-            repository_info=GitHubRepositoryInfo(**repo_info) if repo_info else None
+            repository_info=GitHubRepositoryInfo(**repo_info) if repo_info else None,
+            generation_mode=generation_mode,
+            changed_fields=changed_fields
         )
         
     except HTTPException:
@@ -609,46 +833,196 @@ async def generate_learning_plan(
             error_message=f"Error generating learning plan: {str(e)}"
         )
 
+def validation_response(exercise_id: str, validation_result) -> CodingExerciseValidation:
+    """API representation of a ValidationResult"""
+    return CodingExerciseValidation(
+        exercise_id=exercise_id,
+        is_correct=validation_result.is_valid,
+        feedback=validation_result.feedback,
+        hints=validation_result.hints or [],
+        score=validation_result.score,
+        execution_result=validation_result.execution_result,
+        error_message=validation_result.error_message,
+        findings=[finding.to_dict() for finding in validation_result.findings or []],
+        test_results=[test.to_dict() for test in validation_result.test_results or []],
+        performance=validation_result.performance.to_dict() if validation_result.performance else None
+    )
+
 @app.post("/validate-code", response_model=CodingExerciseValidation)
 async def validate_code(
     submission: CodingExerciseSubmission,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Validate user code submission for a coding exercise"""
     try:
-        # Get the exercise details (in a real app, you'd fetch this from database)
-        # For now, we'll use a simple validation approach
+        # Resolve the exercise definition (cached in-process, otherwise one primary key lookup)
+        exercise = await exercise_registry.get(db, submission.exercise_id)
+        if exercise is None:
+            raise HTTPException(status_code=404, detail="Exercise not found")
         
-        # Get the exercise details (in a real app, you'd fetch this from database)
-        # For now, we'll use a simple validation approach
+        test_cases = exercise.get("test_cases")
+        validation_result = code_validator.cached_result(submission.user_code, exercise, test_cases)
+        if validation_result is None:
+            # Queued fairly per user; runs off the event loop so a slow submission doesn't hold up other requests
+            validation_result = await validation_queue.run(
+                current_user.id,
+                lambda: validator.validate_exercise_async(
+                    user_code=submission.user_code,
+                    exercise=exercise,
+                    test_cases=test_cases
+                )
+            )
         
-        # Basic validation using the code validator
-        validation_result = code_validator.validate_exercise(
-            user_code=submission.user_code,
-            exercise={
-                "solution": "",  # We don't expose the solution
-                "validation_rules": [
-                    "contains:print",  # Basic validation rules
-                    "contains:def"
-                ],
-                "blanks": []  # Add blanks if available
-            }
-        )
+        return validation_response(submission.exercise_id, validation_result)
         
-        return CodingExerciseValidation(
-            exercise_id=submission.exercise_id,
-            is_correct=validation_result.is_valid,
-            feedback=validation_result.feedback,
-            hints=validation_result.hints or [],
-            score=validation_result.score,
-            execution_result=validation_result.execution_result,
-            error_message=validation_result.error_message
+    except HTTPException:
+        raise
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
         )
-        
+    except ValidationJobTimeout as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error validating code: {str(e)}")
 
+@app.websocket("/ws/validate-code")
+async def validate_code_live(websocket: WebSocket, token: str):
+    """
+    Validate a submission while streaming its progress
+
+    Connect with `?token=<access token>` and send one submission
+    ({"exercise_id", "user_code", "step_number"}). The server sends
+    {"type": "stage", ...} as each stage starts and ends, {"type": "output", ...}
+    for every line the code prints, then {"type": "result", "result": ...}
+    and closes. Sending {"type": "cancel"} or closing the socket stops the
+    run and kills its sandbox process.
+    """
+    async with AsyncSessionLocal() as db:
+        user = await user_from_token(db, token)
+        if user is None or user.disabled:
+            await websocket.close(code=1008, reason="Could not validate credentials")
+            return
+        await websocket.accept()
+        try:
+            submission = CodingExerciseSubmission(**await websocket.receive_json())
+        except (ValueError, TypeError) as e:
+            await websocket.send_json({"type": "error", "detail": f"Invalid submission: {e}"})
+            await websocket.close(code=1003)
+            return
+        exercise = await exercise_registry.get(db, submission.exercise_id)
+    if exercise is None:
+        await websocket.send_json({"type": "error", "detail": "Exercise not found"})
+        await websocket.close(code=1008)
+        return
+
+    # Live output needs a direct pipe to the sandbox, so this always validates in this process
+    events: asyncio.Queue = asyncio.Queue()
+    test_cases = exercise.get("test_cases")
+    validation = asyncio.create_task(validation_queue.run(
+        user.id,
+        lambda: code_validator.validate_exercise_async(
+            user_code=submission.user_code,
+            exercise=exercise,
+            test_cases=test_cases,
+            progress=events.put_nowait
+        )
+    ))
+    validation.add_done_callback(lambda _: events.put_nowait(None))
+
+    async def watch_client():
+        # Anything the client sends now (or its going away) cancels the run
+        try:
+            while (await websocket.receive_json()).get("type") != "cancel":
+                pass
+        except (WebSocketDisconnect, ValueError):
+            pass
+
+    watcher = asyncio.create_task(watch_client())
+    try:
+        while True:
+            next_event = asyncio.ensure_future(events.get())
+            await asyncio.wait({next_event, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_event.done():
+                next_event.cancel()
+                validation.cancel()
+                try:
+                    await websocket.send_json({"type": "cancelled"})
+                    await websocket.close()
+                except (WebSocketDisconnect, RuntimeError):
+                    pass
+                return
+            event = next_event.result()
+            if event is None:
+                break
+            await websocket.send_json(event)
+
+        try:
+            result = validation.result()
+        except QueueFullError as e:
+            await websocket.send_json({"type": "error", "detail": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            await websocket.send_json({"type": "error", "detail": f"Error validating code: {str(e)}"})
+        else:
+            await websocket.send_json({
+                "type": "result",
+                "result": validation_response(submission.exercise_id, result).model_dump()
+            })
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        watcher.cancel()
+        validation.cancel()
+
+@app.post("/validate-code/batch")
+async def validate_code_batch(
+    request: BatchValidationRequest,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Validate many submissions at once, e.g. to re-grade a cohort after an exercise changes
+
+    Streams newline-delimited JSON: one line per submission as it completes
+    (in completion order, with its batch `index`), then a final `summary`
+    line with counts and throughput. Submissions share the validation queue
+    with the caller's other validations, so a batch doesn't hold up other users.
+    """
+    if len(request.submissions) > batch_validator.max_size:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {batch_validator.max_size} submissions per batch"
+        )
+
+    # Resolve each exercise once up front; the stream doesn't hold the database session
+    exercise_ids = {item.exercise_id for item in request.submissions}
+    exercises = {exercise_id: await exercise_registry.get(db, exercise_id) for exercise_id in exercise_ids}
+    submissions = [
+        BatchSubmission(item.exercise_id, item.user_code, item.submission_id)
+        for item in request.submissions
+    ]
+
+    async def stream():
+        stats = BatchStats()
+        async for item in batch_validator.validate(submissions, exercises, stats, current_user.id):
+            line = {
+                "index": item.index,
+                "submission_id": item.submission.submission_id,
+                "exercise_id": item.submission.exercise_id
+            }
+            if item.error is not None:
+                line["error"] = item.error
+            else:
+                line["result"] = validation_response(item.submission.exercise_id, item.result).model_dump()
+            yield json.dumps(line) + "\n"
+        yield json.dumps({"summary": stats.to_dict()}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
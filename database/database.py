@@ -1,14 +1,34 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Boolean, ForeignKey, JSON
+from sqlalchemy import create_engine, select, tuple_, literal, Column, Integer, String, Text, DateTime, Boolean, ForeignKey, JSON, Index
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, joinedload, selectinload
 from sqlalchemy.sql import func
 from datetime import datetime
+from typing import Optional
+import base64
+import binascii
+import json
 import os
 
 # Database configuration
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./codelap_lean.db")
 
-# Create SQLAlchemy engine
+
+def async_database_url(url: str) -> str:
+    """The same database through an asyncio driver: aiosqlite for SQLite, asyncpg for PostgreSQL"""
+    scheme, separator, rest = url.partition("://")
+    dialect = scheme.split("+")[0]
+    if dialect == "sqlite":
+        return f"sqlite+aiosqlite{separator}{rest}"
+    if dialect in ("postgresql", "postgres"):
+        return f"postgresql+asyncpg{separator}{rest}"
+    return url
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_database_url(DATABASE_URL)
+
+# Synchronous engine, for scripts, table creation and the validation job queue (used from threads)
 engine = create_engine(
     DATABASE_URL,
     connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
@@ -17,6 +37,12 @@ engine = create_engine(
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine for the API, so waiting on the database never blocks the event loop
+async_engine = create_async_engine(ASYNC_DATABASE_URL)
+
+# Objects stay usable after commit; anything not loaded must be loaded explicitly (no lazy loads under asyncio)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
 # Create Base class
 Base = declarative_base()
 
@@ -42,6 +68,8 @@ class User(Base):
 
 class Repository(Base):
     __tablename__ = "repositories"
+    # Keyset pagination, newest first
+    __table_args__ = (Index("ix_repositories_created_at_id", "created_at", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     repo_url = Column(String(500), unique=True, index=True, nullable=False)
@@ -63,34 +91,132 @@ class Repository(Base):
 
 class LearningPlan(Base):
     __tablename__ = "learning_plans"
+    # Keyset pagination of a user's plans, newest first
+    __table_args__ = (Index("ix_learning_plans_user_created_at_id", "user_id", "created_at", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     repository_id = Column(Integer, ForeignKey("repositories.id"), nullable=False)
     title = Column(String(200), nullable=False)
     description = Column(Text, nullable=True)
-    learning_steps = Column(JSON, nullable=False)  # Store learning steps as JSON array
     status = Column(String(20), default="active")  # active, completed, paused
     difficulty_level = Column(String(20), nullable=True)  # beginner, intermediate, advanced
     estimated_duration = Column(Integer, nullable=True)  # in hours
+    plan_metadata = Column(JSON, nullable=True)  # Prerequisites, objectives, technologies and duration text
+    source_fingerprint = Column(String(64), nullable=True, index=True)  # Hash of the repository inputs the plan was built from
+    source_digests = Column(JSON, nullable=True)  # Per-field hashes, used to tell which inputs changed
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
-    # Relationships
-    user = relationship("User", back_populates="learning_plans")
-    repository = relationship("Repository", back_populates="learning_plans")
+    # Relationships. Plan responses include all of these, so queries load them up front
+    # (see with_plan_relations); a lazy load would be one query per plan and raises instead
+    user = relationship("User", back_populates="learning_plans", lazy="raise")
+    repository = relationship("Repository", back_populates="learning_plans", lazy="raise")
+    steps = relationship(
+        "LearningPlanStep", back_populates="plan", order_by="LearningPlanStep.step_number",
+        cascade="all, delete-orphan", lazy="raise"
+    )
+    progress = relationship("StepProgress", cascade="all, delete-orphan", lazy="raise")
+
+    @property
+    def learning_steps(self):
+        """Steps in order, each with its progress (steps and progress must be loaded)"""
+        progress = {row.step_number: row for row in self.progress}
+        return [step.to_dict(progress.get(step.step_number)) for step in self.steps]
 
     def __repr__(self):
         return f"<LearningPlan(id={self.id}, title='{self.title}', user_id={self.user_id})>"
 
 
+class LearningPlanStep(Base):
+    __tablename__ = "learning_steps"
+    __table_args__ = (Index("ix_learning_steps_plan_step", "plan_id", "step_number", unique=True),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    plan_id = Column(Integer, ForeignKey("learning_plans.id", ondelete="CASCADE"), nullable=False)
+    step_number = Column(Integer, nullable=False)
+    title = Column(String(200), nullable=False)
+    description = Column(Text, nullable=True)
+    duration = Column(String(50), nullable=True)
+    resources = Column(JSON, nullable=True)
+    exercises = Column(JSON, nullable=True)  # Exercise descriptions written by the model
+    coding_exercise_ids = Column(JSON, nullable=True)  # Ids in the exercises table
+    total_exercises = Column(Integer, default=0)
+
+    plan = relationship("LearningPlan", back_populates="steps")
+
+    def to_dict(self, progress: Optional["StepProgress"] = None) -> dict:
+        """The step as stored in generated plans, with progress from its step_progress row if any"""
+        return {
+            "step": self.step_number,
+            "title": self.title,
+            "description": self.description or "",
+            "duration": self.duration or "",
+            "resources": self.resources or [],
+            "exercises": self.exercises or [],
+            "coding_exercise_ids": list(self.coding_exercise_ids or []),
+            "completed": bool(progress and progress.completed),
+            "exercises_completed": progress.exercises_completed if progress else 0,
+            "total_exercises": self.total_exercises or 0
+        }
+
+    def __repr__(self):
+        return f"<LearningPlanStep(plan_id={self.plan_id}, step_number={self.step_number}, title='{self.title}')>"
+
+
+class StepProgress(Base):
+    __tablename__ = "step_progress"
+    # Kept apart from the step's content so marking progress writes one small row
+
+    plan_id = Column(Integer, ForeignKey("learning_plans.id", ondelete="CASCADE"), primary_key=True)
+    step_number = Column(Integer, primary_key=True)
+    completed = Column(Boolean, default=False, nullable=False)
+    exercises_completed = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<StepProgress(plan_id={self.plan_id}, step_number={self.step_number}, completed={self.completed})>"
+
+
+class Exercise(Base):
+    __tablename__ = "exercises"
+
+    id = Column(String(64), primary_key=True)  # Content hash, see services.exercise_generator.compute_exercise_id
+    title = Column(String(200), nullable=False)
+    difficulty = Column(String(20), nullable=True)
+    content = Column(JSON, nullable=False)  # Full CodingExercise data
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<Exercise(id='{self.id}', title='{self.title}')>"
+
+
+class ValidationJob(Base):
+    __tablename__ = "validation_jobs"
+    # Workers claim the oldest queued job
+    __table_args__ = (Index("ix_validation_jobs_status_id", "status", "id"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    status = Column(String(20), nullable=False, default="queued")  # queued, running, done, failed
+    source_key = Column(String(64), nullable=False, index=True)  # Exercise and exact code, see SubmissionCache.source_key
+    payload = Column(JSON, nullable=False)  # user_code, exercise and test_cases
+    result = Column(JSON, nullable=True)  # Serialized ValidationResult
+    error = Column(Text, nullable=True)
+    transient = Column(Boolean, default=False)  # Result depends on load, don't reuse it for other submissions
+    attempts = Column(Integer, default=0)
+    worker_id = Column(String(100), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<ValidationJob(id={self.id}, status='{self.status}')>"
+
+
 # Database dependency
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 # Create all tables
@@ -105,29 +231,142 @@ def init_db():
     print("Database tables created successfully!")
 
 
-def get_user_by_username(db, username: str):
+async def get_user_by_username(db: AsyncSession, username: str):
     """Get user by username"""
-    return db.query(User).filter(User.username == username).first()
+    return await db.scalar(select(User).where(User.username == username))
 
 
-def get_user_by_email(db, email: str):
+async def get_user_by_email(db: AsyncSession, email: str):
     """Get user by email"""
-    return db.query(User).filter(User.email == email).first()
+    return await db.scalar(select(User).where(User.email == email))
 
 
-def get_repository_by_url(db, repo_url: str):
+async def get_repository_by_url(db: AsyncSession, repo_url: str):
     """Get repository by URL"""
-    return db.query(Repository).filter(Repository.repo_url == repo_url).first()
+    return await db.scalar(select(Repository).where(Repository.repo_url == repo_url))
 
 
-def get_learning_plans_by_user(db, user_id: int):
+async def get_learning_plans_by_user(db: AsyncSession, user_id: int):
     """Get all learning plans for a user"""
-    return db.query(LearningPlan).filter(LearningPlan.user_id == user_id).all()
+    result = await db.scalars(select(LearningPlan).where(LearningPlan.user_id == user_id))
+    return result.all()
 
 
-def get_learning_plans_by_repository(db, repository_id: int):
+async def get_learning_plans_by_repository(db: AsyncSession, repository_id: int):
     """Get all learning plans for a repository"""
-    return db.query(LearningPlan).filter(LearningPlan.repository_id == repository_id).all()
+    result = await db.scalars(select(LearningPlan).where(LearningPlan.repository_id == repository_id))
+    return result.all()
+
+
+async def get_latest_learning_plan(db: AsyncSession, user_id: int, repository_id: int):
+    """Get the most recent learning plan a user has for a repository"""
+    return await db.scalar(with_plan_steps(
+        select(LearningPlan).where(
+            LearningPlan.user_id == user_id,
+            LearningPlan.repository_id == repository_id
+        ).order_by(LearningPlan.id.desc()).limit(1)
+    ))
+
+
+async def get_plan_step(db: AsyncSession, user_id: int, plan_id: int, step_number: int):
+    """Get one step of a user's learning plan, or None"""
+    return await db.scalar(
+        select(LearningPlanStep).join(LearningPlan).where(
+            LearningPlanStep.plan_id == plan_id,
+            LearningPlanStep.step_number == step_number,
+            LearningPlan.user_id == user_id
+        )
+    )
+
+
+async def get_exercises_by_ids(db: AsyncSession, exercise_ids):
+    """Get exercise content for many ids in one query, keyed by id"""
+    if not exercise_ids:
+        return {}
+    exercises = await db.scalars(select(Exercise).where(Exercise.id.in_(set(exercise_ids))))
+    return {exercise.id: exercise.content for exercise in exercises}
+
+
+async def save_exercises(db: AsyncSession, exercises):
+    """Store exercise dicts that are not in the exercises table yet (does not commit)"""
+    rows = [
+        {
+            "id": exercise["id"],
+            "title": exercise.get("title", ""),
+            "difficulty": exercise.get("difficulty"),
+            "content": exercise
+        }
+        for exercise in {exercise["id"]: exercise for exercise in exercises}.values()
+    ]
+    if not rows:
+        return
+    # Ids are content hashes, so a row another request inserted first is the same exercise;
+    # skipping conflicts avoids a check-then-insert race on the primary key
+    dialect = db.get_bind().dialect.name
+    insert = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}[dialect]
+    await db.execute(insert(Exercise).values(rows).on_conflict_do_nothing(index_elements=["id"]))
+
+
+# created_at comes from CURRENT_TIMESTAMP, which SQLite stores to the second; cursor values must
+# be bound in the same text format or equal timestamps wouldn't compare equal
+CURSOR_TIMESTAMP = DateTime(timezone=True).with_variant(
+    sqlite.DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite"
+)
+
+
+def encode_cursor(row) -> str:
+    """Opaque cursor pointing just past a row in (created_at, id) order"""
+    position = [row.created_at.isoformat() if row.created_at else None, row.id]
+    return base64.urlsafe_b64encode(json.dumps(position).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """The (created_at, id) position in a cursor; raises ValueError for anything else"""
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+async def keyset_page(db: AsyncSession, statement, model, limit: int, cursor: Optional[str] = None):
+    """
+    One page of a query, newest first, continuing after a cursor
+
+    Rows are ordered by (created_at, id) descending and the cursor's position
+    is a WHERE condition, so every page costs an index range scan of `limit`
+    rows however deep it is.
+
+    Returns:
+        Tuple of (rows, cursor for the next page or None on the last page)
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        statement = statement.where(
+            tuple_(model.created_at, model.id) < tuple_(literal(created_at, CURSOR_TIMESTAMP), row_id)
+        )
+    statement = statement.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1)
+    rows = (await db.scalars(statement)).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1])
+
+
+def with_plan_steps(statement):
+    """Load a learning plan query's steps and their progress up front"""
+    return statement.options(selectinload(LearningPlan.steps), selectinload(LearningPlan.progress))
+
+
+def with_plan_relations(statement):
+    """
+    Load everything the learning plan API responses include
+
+    User and repository are joined into the plan query; steps and progress
+    take one more query each, however many plans there are.
+    """
+    return with_plan_steps(statement).options(joinedload(LearningPlan.user), joinedload(LearningPlan.repository))
 
 
 # Example usage and initialization
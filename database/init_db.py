@@ -8,7 +8,7 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from database import init_db, SessionLocal, User, Repository, LearningPlan
+from database import init_db, SessionLocal, User, Repository, LearningPlan, LearningPlanStep
 from passlib.context import CryptContext
 import json
 
@@ -92,13 +92,13 @@ def seed_initial_data():
                 repository_id=1,  # FastAPI Tutorial
                 title="Master FastAPI Development",
                 description="Complete learning plan to become proficient in FastAPI",
-                learning_steps=json.dumps([
-                    {"step": 1, "title": "Setup Development Environment", "description": "Install Python and FastAPI", "completed": False},
-                    {"step": 2, "title": "Basic FastAPI Concepts", "description": "Learn about routes, requests, and responses", "completed": False},
-                    {"step": 3, "title": "Database Integration", "description": "Connect FastAPI with SQLAlchemy", "completed": False},
-                    {"step": 4, "title": "Authentication & Authorization", "description": "Implement JWT authentication", "completed": False},
-                    {"step": 5, "title": "Testing", "description": "Write tests for your FastAPI application", "completed": False}
-                ]),
+                steps=[
+                    LearningPlanStep(step_number=1, title="Setup Development Environment", description="Install Python and FastAPI"),
+                    LearningPlanStep(step_number=2, title="Basic FastAPI Concepts", description="Learn about routes, requests, and responses"),
+                    LearningPlanStep(step_number=3, title="Database Integration", description="Connect FastAPI with SQLAlchemy"),
+                    LearningPlanStep(step_number=4, title="Authentication & Authorization", description="Implement JWT authentication"),
+                    LearningPlanStep(step_number=5, title="Testing", description="Write tests for your FastAPI application")
+                ],
                 status="active",
                 difficulty_level="intermediate",
                 estimated_duration=20
@@ -108,13 +108,13 @@ def seed_initial_data():
                 repository_id=2,  # React Learning Path
                 title="React Fundamentals",
                 description="Learn React from scratch to advanced concepts",
-                learning_steps=json.dumps([
-                    {"step": 1, "title": "React Basics", "description": "Components, JSX, and props", "completed": False},
-                    {"step": 2, "title": "State Management", "description": "useState and useEffect hooks", "completed": False},
-                    {"step": 3, "title": "Routing", "description": "React Router implementation", "completed": False},
-                    {"step": 4, "title": "State Management Libraries", "description": "Redux or Context API", "completed": False},
-                    {"step": 5, "title": "Testing", "description": "Testing React components", "completed": False}
-                ]),
+                steps=[
+                    LearningPlanStep(step_number=1, title="React Basics", description="Components, JSX, and props"),
+                    LearningPlanStep(step_number=2, title="State Management", description="useState and useEffect hooks"),
+                    LearningPlanStep(step_number=3, title="Routing", description="React Router implementation"),
+                    LearningPlanStep(step_number=4, title="State Management Libraries", description="Redux or Context API"),
+                    LearningPlanStep(step_number=5, title="Testing", description="Testing React components")
+                ],
                 status="active",
                 difficulty_level="beginner",
                 estimated_duration=25
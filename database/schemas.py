@@ -1,5 +1,5 @@
 from pydantic import BaseModel, HttpUrl
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Literal
 from datetime import datetime
 
 # User schemas
@@ -56,6 +56,10 @@ class Repository(RepositoryBase):
     class Config:
         from_attributes = True
 
+class RepositoryPage(BaseModel):
+    items: List[Repository]
+    next_cursor: Optional[str] = None  # Pass as `cursor` for the next page; None on the last page
+
 # Learning Plan schemas
 class LearningStep(BaseModel):
     step: int
@@ -63,6 +67,19 @@ class LearningStep(BaseModel):
     description: str
     completed: bool = False
 
+class StepProgressUpdate(BaseModel):
+    completed: Optional[bool] = None
+    exercises_completed: Optional[int] = None
+
+class StepProgress(BaseModel):
+    plan_id: int
+    step_number: int
+    completed: bool
+    exercises_completed: int
+
+    class Config:
+        from_attributes = True
+
 class LearningPlanBase(BaseModel):
     title: str
     description: Optional[str] = None
@@ -95,6 +112,10 @@ class LearningPlan(LearningPlanBase):
     class Config:
         from_attributes = True
 
+class LearningPlanPage(BaseModel):
+    items: List[LearningPlan]
+    next_cursor: Optional[str] = None  # Pass as `cursor` for the next page; None on the last page
+
 # Authentication schemas
 class Token(BaseModel):
     access_token: str
@@ -181,7 +202,10 @@ class CodingExercise(BaseModel):
     hints: List[str]
     validation_rules: List[str]  # Rules for validation
     expected_output: Optional[str] = None
+    runner: str = "script"  # "script": stdout is checked against expected_output; "fastapi": an app, not run as a script
+    performance: Optional[Dict[str, Any]] = None  # Budgets relative to the solution, e.g. {"time_factor": 3}
     test_cases: List[dict] = []  # Test cases for validation
+    route_checks: List[dict] = []  # Requests for "fastapi" exercises, e.g. {"path": "/hello", "expected": {...}}
     blanks: List[Dict[str, str]] = []  # Fill-in-the-blank definitions
 
 class CodingExerciseSubmission(BaseModel):
@@ -190,6 +214,42 @@ class CodingExerciseSubmission(BaseModel):
     user_code: str
     step_number: int
 
+class CodeFinding(BaseModel):
+    """A problem found in a submission, with its location when known"""
+    rule: str  # e.g. "security:eval", "function:greet", "syntax"
+    message: str
+    line: Optional[int] = None
+    column: Optional[int] = None
+    severity: str = "error"
+
+class TestCaseOutcome(BaseModel):
+    """Result of one test case run against a submission"""
+    name: str
+    passed: bool
+    duration: float  # seconds
+    expected: Optional[str] = None
+    actual: Optional[str] = None
+    stdout: str = ""
+    error: Optional[str] = None
+    timed_out: bool = False
+
+class PerformanceMetrics(BaseModel):
+    """Cost of running one program in the sandbox"""
+    cpu_seconds: Optional[float] = None
+    wall_seconds: Optional[float] = None
+    peak_memory_bytes: Optional[int] = None
+    retained_blocks: Optional[int] = None
+    error: Optional[str] = None
+    timed_out: bool = False
+
+class PerformanceOutcome(BaseModel):
+    """A submission's measurements against budgets calibrated from the reference solution"""
+    submission: PerformanceMetrics
+    reference: PerformanceMetrics
+    budgets: Dict[str, float]
+    exceeded: List[str] = []
+    within_budget: bool
+
 class CodingExerciseValidation(BaseModel):
     """Validation result for coding exercise"""
     exercise_id: str
@@ -199,6 +259,19 @@ class CodingExerciseValidation(BaseModel):
     score: int  # 0-100
     execution_result: Optional[str] = None
     error_message: Optional[str] = None
+    findings: List[CodeFinding] = []
+    test_results: List[TestCaseOutcome] = []
+    performance: Optional[PerformanceOutcome] = None
+
+class BatchSubmissionItem(BaseModel):
+    """One submission in a batch validation"""
+    exercise_id: str
+    user_code: str
+    submission_id: Optional[str] = None  # Echoed back so results can be matched to students
+
+class BatchValidationRequest(BaseModel):
+    """Many submissions to validate at once"""
+    submissions: List[BatchSubmissionItem]
 
 class EnhancedLearningStepDetail(BaseModel):
     """Enhanced learning step with coding exercises"""
@@ -224,15 +297,21 @@ class GeneratedLearningPlan(BaseModel):
     learning_objectives: List[str]
     technologies_covered: List[str]
 
+# "incremental" reuses unchanged plans and steps, "full" always regenerates
+RegenerationMode = Literal["incremental", "full"]
+
 class GeneratePlanRequest(BaseModel):
     """Request model for learning plan generation"""
     repository_id: Optional[int] = None
     repository_url: Optional[str] = None
     repository_info: Optional[GitHubRepositoryInfo] = None
+    regeneration_mode: RegenerationMode = "incremental"
 
 class GeneratePlanResponse(BaseModel):
     """Response model for learning plan generation"""
     success: bool
     learning_plan: Optional[GeneratedLearningPlan] = None
     repository_info: Optional[GitHubRepositoryInfo] = None
+    generation_mode: Optional[str] = None  # "full", "incremental" or "unchanged"
+    changed_fields: List[str] = []
     error_message: Optional[str] = None
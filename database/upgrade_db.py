@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Database upgrade script
+Brings a database created by an earlier version up to the current models
+
+create_all only creates missing tables, it doesn't change existing ones.
+This adds the learning plan columns and indexes introduced since (including
+the ones keyset pagination relies on), and moves the steps each plan kept
+in its learning_steps JSON column into learning_steps and step_progress rows
+(with their exercises in the exercises table), then drops the old column. Every step checks the current schema first, so running it
+again does nothing. Changes to existing tables run in one transaction.
+"""
+
+import sys
+import os
+# Ahead of this directory, so "database" is the package (exercise ids come from services)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.database import engine, Base, LearningPlanStep, StepProgress, Exercise
+from services.exercise_generator import compute_exercise_id
+from sqlalchemy import inspect, select, text, JSON, String
+from sqlalchemy.dialects import postgresql, sqlite
+import json
+
+# Learning plan columns added after the first release, in the order they were added
+NEW_PLAN_COLUMNS = [
+    ("source_fingerprint", String(64)),
+    ("source_digests", JSON()),
+    ("plan_metadata", JSON())
+]
+
+# Indexes added to existing tables, which create_all won't add: the plan fingerprint lookup, the
+# (created_at, id) keyset pagination indexes, and the composite indexes of the newer tables
+NEW_INDEXES = [
+    "ix_learning_plans_source_fingerprint",
+    "ix_repositories_created_at_id",
+    "ix_learning_plans_user_created_at_id",
+    "ix_learning_steps_plan_step",
+    "ix_validation_jobs_status_id"
+]
+
+
+def _load_steps(value) -> list:
+    """Steps from the old column; some rows hold the JSON encoded a second time"""
+    while isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            return []
+    return value if isinstance(value, list) else []
+
+
+def _step_number(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number > 0 else None
+
+
+def _copy_plan_steps(conn, plan_id: int, steps: list) -> int:
+    """Insert one plan's steps, progress and exercises; returns the number of steps"""
+    step_rows, progress_rows, exercises = [], [], {}
+    for index, step in enumerate(steps):
+        if not isinstance(step, dict):
+            continue
+        step_number = _step_number(step.get("step")) or index + 1
+        if any(row["step_number"] == step_number for row in step_rows):
+            continue
+        exercise_ids = list(step.get("coding_exercise_ids") or [])
+        for exercise in step.get("coding_exercises") or []:
+            # Embedded copies carried a random id; stored exercises are keyed by content
+            exercise = dict(exercise, id=compute_exercise_id(exercise))
+            exercises[exercise["id"]] = exercise
+            exercise_ids.append(exercise["id"])
+        step_rows.append({
+            "plan_id": plan_id,
+            "step_number": step_number,
+            "title": str(step.get("title") or f"Step {step_number}")[:200],
+            "description": step.get("description"),
+            "duration": step.get("duration"),
+            "resources": step.get("resources"),
+            "exercises": step.get("exercises"),
+            "coding_exercise_ids": exercise_ids,
+            "total_exercises": step.get("total_exercises") or len(exercise_ids)
+        })
+        if step.get("completed") or step.get("exercises_completed"):
+            progress_rows.append({
+                "plan_id": plan_id,
+                "step_number": step_number,
+                "completed": bool(step.get("completed")),
+                "exercises_completed": int(step.get("exercises_completed") or 0)
+            })
+
+    if exercises:
+        insert = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}[conn.dialect.name]
+        conn.execute(insert(Exercise).values([
+            {"id": exercise_id, "title": exercise.get("title", ""), "difficulty": exercise.get("difficulty"),
+             "content": exercise}
+            for exercise_id, exercise in exercises.items()
+        ]).on_conflict_do_nothing(index_elements=["id"]))
+    if step_rows:
+        conn.execute(LearningPlanStep.__table__.insert(), step_rows)
+    if progress_rows:
+        conn.execute(StepProgress.__table__.insert(), progress_rows)
+    return len(step_rows)
+
+
+def upgrade_db(bind=engine):
+    """Upgrade the schema and data in place"""
+    # New tables (learning_steps, step_progress, exercises, ...) are created as usual
+    Base.metadata.create_all(bind=bind)
+
+    with bind.begin() as conn:
+        inspector = inspect(conn)
+        columns = {column["name"] for column in inspector.get_columns("learning_plans")}
+        for name, column_type in NEW_PLAN_COLUMNS:
+            if name not in columns:
+                conn.execute(text(
+                    f"ALTER TABLE learning_plans ADD COLUMN {name} {column_type.compile(dialect=conn.dialect)}"
+                ))
+                print(f"Added learning_plans.{name}")
+
+        existing = {
+            index["name"]
+            for table in inspector.get_table_names()
+            for index in inspector.get_indexes(table)
+        }
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name in NEW_INDEXES and index.name not in existing:
+                    index.create(conn)
+                    print(f"Created index {index.name}")
+
+        if "learning_steps" in columns:
+            planned = set(conn.scalars(select(LearningPlanStep.plan_id).distinct()))
+            copied = 0
+            for plan_id, steps in conn.execute(text("SELECT id, learning_steps FROM learning_plans")):
+                if plan_id not in planned:
+                    copied += _copy_plan_steps(conn, plan_id, _load_steps(steps))
+            conn.execute(text("ALTER TABLE learning_plans DROP COLUMN learning_steps"))
+            print(f"Moved {copied} learning steps into the learning_steps table")
+
+    print("Database upgrade complete!")
+
+
+if __name__ == "__main__":
+    print("Upgrading database...")
+    upgrade_db()
@@ -1,6 +1,334 @@
-def main():
-    print("Hello from codelap-lean!")
+#!/usr/bin/env python3
+"""
+CodeLap Lean command line tools
+
+Usage:
+    python main.py generate-plans repos.txt --user johndoe --concurrency 8
+    python main.py validate-batch submissions.jsonl --output results.jsonl
+    python main.py validation-worker --concurrency 8
+
+For generate-plans the input file holds one GitHub URL or stored Repository
+id per line. Blank lines and lines starting with # are ignored.
+
+For validate-batch each line is a JSON object with "exercise_id" and
+"user_code", and optionally a "submission_id" that is copied to the result.
+
+validation-worker validates the jobs an API started with VALIDATION_BACKEND=queue
+enqueues in the shared database. Run one or more per machine; stop with Ctrl-C.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Optional
+
+
+def read_batch_items(path: str) -> List[str]:
+    """Read repository URLs or ids from a file, one per line"""
+    items = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                items.append(line)
+    # Keep the first occurrence of each item so reruns are stable
+    return list(dict.fromkeys(items))
+
+
+def load_checkpoint(path: str) -> Dict[str, dict]:
+    """Load finished items from a checkpoint file written by a previous run"""
+    finished = {}
+    if not os.path.exists(path):
+        return finished
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A run killed mid-write can leave a truncated last line
+                continue
+            if record.get("status") == "done":
+                finished[record["item"]] = record
+    return finished
+
+
+async def generate_plan_for_item(item: str, user_id: int, regeneration_mode: str) -> dict:
+    """Fetch repository metadata and generate a stored plan for one batch item"""
+    from app import (
+        is_github_url, extract_repo_info_from_url, get_repository_details,
+        repository_to_repo_info, generate_or_refresh_plan
+    )
+    from database.database import AsyncSessionLocal, Repository, get_repository_by_url
+
+    # Each item needs its own session, they run concurrently
+    async with AsyncSessionLocal() as db:
+        if item.isdigit():
+            db_repo = await db.get(Repository, int(item))
+            if db_repo is None:
+                raise ValueError(f"Repository {item} not found in database")
+            repo_info = repository_to_repo_info(db_repo)
+        elif is_github_url(item):
+            owner, repo_name = extract_repo_info_from_url(item)
+            # GitHub calls are blocking, so run them off the event loop
+            details = await asyncio.to_thread(get_repository_details, owner, repo_name)
+            db_repo = await get_repository_by_url(db, details["html_url"])
+            if db_repo is None:
+                db_repo = Repository(repo_url=details["html_url"])
+                db.add(db_repo)
+            db_repo.name = details["name"]
+            db_repo.description = details["description"]
+            db_repo.language = details["language"]
+            db_repo.stars = details["stars"]
+            db_repo.forks = details["forks"]
+            db_repo.ai_prerequisites = json.dumps(details.get("topics") or [])
+            await db.commit()
+            await db.refresh(db_repo)
+            # Keep the richer GitHub metadata for the prompt, but link the plan to the stored repository
+            repo_info = {**details, "id": db_repo.id}
+        else:
+            raise ValueError("Expected a GitHub URL or a repository id")
+
+        response_plan, generation_mode, changed_fields = await generate_or_refresh_plan(
+            db, user_id, db_repo.id, repo_info, regeneration_mode
+        )
+        return {
+            "repository_id": db_repo.id,
+            "title": response_plan.title,
+            "mode": generation_mode,
+            "changed_fields": changed_fields
+        }
+
+
+async def run_plan_batch(
+    items: List[str],
+    user_id: int,
+    concurrency: int,
+    checkpoint_path: str,
+    regeneration_mode: str
+) -> Dict[str, int]:
+    """Generate plans for items with bounded parallelism, recording progress as it goes"""
+    semaphore = asyncio.Semaphore(concurrency)
+    counts = {"done": 0, "failed": 0}
+
+    with open(checkpoint_path, "a") as checkpoint:
+        async def process(item: str):
+            async with semaphore:
+                start = time.perf_counter()
+                record = {"item": item}
+                try:
+                    result = await generate_plan_for_item(item, user_id, regeneration_mode)
+                    record.update(status="done", **result)
+                except Exception as e:
+                    record.update(status="failed", error=str(getattr(e, "detail", e)))
+                record["seconds"] = round(time.perf_counter() - start, 2)
+
+            counts[record["status"]] += 1
+            checkpoint.write(json.dumps(record) + "\n")
+            checkpoint.flush()
+            print(f"[{counts['done'] + counts['failed']}/{len(items)}] {record['status']}: {item}")
+
+        await asyncio.gather(*(process(item) for item in items))
+
+    return counts
+
+
+async def generate_plans(args) -> Optional[Dict[str, int]]:
+    """Look up the plans' owner and generate every pending plan; None if the user doesn't exist"""
+    from database.database import AsyncSessionLocal, async_engine, get_user_by_username
+
+    try:
+        async with AsyncSessionLocal() as db:
+            user = await get_user_by_username(db, args.user)
+        if user is None:
+            print(f"User '{args.user}' not found")
+            return None
+
+        items = read_batch_items(args.input)
+        checkpoint_path = args.checkpoint or f"{args.input}.checkpoint.jsonl"
+        finished = load_checkpoint(checkpoint_path)
+        pending = [item for item in items if item not in finished]
+        print(f"{len(items)} repositories, {len(finished)} already done, {len(pending)} to generate")
+
+        return await run_plan_batch(
+            pending, user.id, max(1, args.concurrency), checkpoint_path, args.regeneration_mode
+        )
+    finally:
+        # Connections belong to this event loop
+        await async_engine.dispose()
+
+
+def generate_plans_command(args) -> int:
+    from database.database import create_tables
+
+    create_tables()
+    start = time.perf_counter()
+    counts = asyncio.run(generate_plans(args))
+    if counts is None:
+        return 1
+    checkpoint_path = args.checkpoint or f"{args.input}.checkpoint.jsonl"
+    elapsed = time.perf_counter() - start
+    print(f"Finished in {elapsed:.1f}s: {counts['done']} generated, {counts['failed']} failed")
+    print(f"Checkpoint: {checkpoint_path} (rerun the same command to retry failures)")
+    return 0 if counts["failed"] == 0 else 2
+
+
+def read_submissions(path: str) -> list:
+    """Read batch submissions from a JSON lines file"""
+    from services.batch_validation import BatchSubmission
+
+    submissions = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                submissions.append(BatchSubmission(
+                    exercise_id=record["exercise_id"],
+                    user_code=record["user_code"],
+                    submission_id=record.get("submission_id")
+                ))
+            except (json.JSONDecodeError, KeyError) as e:
+                raise ValueError(f"{path}:{number}: invalid submission ({e})")
+    return submissions
+
+
+async def run_validation_batch(submissions: list, exercises: Dict[str, Optional[dict]], output, concurrency: int):
+    """Validate submissions, writing each result as it completes"""
+    from app import validation_response
+    from services.batch_validation import BatchStats, BatchValidator
+    from services.code_validator import code_validator
+
+    validator = BatchValidator(code_validator, concurrency=concurrency or code_validator.sandbox.size)
+    stats = BatchStats()
+    done = 0
+    async for item in validator.validate(submissions, exercises, stats):
+        record = {
+            "index": item.index,
+            "submission_id": item.submission.submission_id,
+            "exercise_id": item.submission.exercise_id
+        }
+        if item.error is not None:
+            record["error"] = item.error
+        else:
+            record["result"] = validation_response(item.submission.exercise_id, item.result).model_dump()
+        output.write(json.dumps(record) + "\n")
+        done += 1
+        if done % 100 == 0 or done == len(submissions):
+            elapsed = time.perf_counter() - stats.started
+            print(f"[{done}/{len(submissions)}] {done / elapsed:.1f} submissions/s")
+    return stats
+
+
+async def load_exercises(exercise_ids) -> Dict[str, Optional[dict]]:
+    from database.database import AsyncSessionLocal, async_engine
+    from services.exercise_registry import exercise_registry
+
+    try:
+        async with AsyncSessionLocal() as db:
+            return {exercise_id: await exercise_registry.get(db, exercise_id) for exercise_id in exercise_ids}
+    finally:
+        await async_engine.dispose()
+
+
+def validate_batch_command(args) -> int:
+    from database.database import create_tables
+
+    try:
+        submissions = read_submissions(args.input)
+    except ValueError as e:
+        print(e)
+        return 1
+
+    create_tables()
+    exercises = asyncio.run(load_exercises({submission.exercise_id for submission in submissions}))
+
+    output_path = args.output or f"{args.input}.results.jsonl"
+    with open(output_path, "w") as output:
+        stats = asyncio.run(run_validation_batch(submissions, exercises, output, args.concurrency))
+
+    summary = stats.to_dict()
+    print(
+        f"Finished in {summary['seconds']:.1f}s: {summary['total']} submissions "
+        f"({summary['unique']} distinct), {summary['passed']} passed, {summary['failed']} failed, "
+        f"{summary['errors']} errors, {summary['submissions_per_second'] or 0} submissions/s"
+    )
+    print(f"Results: {output_path}")
+    return 0 if summary["errors"] == 0 else 2
+
+
+async def run_validation_worker(concurrency: int, retention_hours: float):
+    """Process validation jobs until interrupted"""
+    import signal
+    from datetime import timedelta
+    from services.code_validator import code_validator
+    from services.validation_jobs import ValidationWorker, validation_jobs
+
+    worker = ValidationWorker(validation_jobs, code_validator, concurrency=concurrency or None)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    print(f"Validation worker {worker.worker_id} running {worker.concurrency} jobs at a time")
+    await worker.run(stop, retention=timedelta(hours=retention_hours))
+    print(f"Stopped after {worker.processed} jobs ({worker.failed} failed)")
+    return worker
+
+
+def validation_worker_command(args) -> int:
+    from database.database import create_tables
+
+    create_tables()
+    asyncio.run(run_validation_worker(args.concurrency, args.retention_hours))
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="CodeLap Lean command line tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    plans = subparsers.add_parser("generate-plans", help="Pre-build learning plans for many repositories")
+    plans.add_argument("input", help="File with one GitHub URL or repository id per line")
+    plans.add_argument("--user", required=True, help="Username that will own the generated plans")
+    plans.add_argument("--concurrency", type=int, default=4, help="Maximum plans generated in parallel (default: 4)")
+    plans.add_argument("--checkpoint", help="Checkpoint file (default: <input>.checkpoint.jsonl)")
+    plans.add_argument(
+        "--regeneration-mode", choices=["incremental", "full"], default="incremental",
+        help="Reuse unchanged plans and only rewrite affected steps, or always regenerate"
+    )
+    plans.set_defaults(func=generate_plans_command)
+
+    batch = subparsers.add_parser("validate-batch", help="Validate many code submissions, e.g. to re-grade a cohort")
+    batch.add_argument("input", help="JSON lines file of submissions (exercise_id, user_code, submission_id)")
+    batch.add_argument("--output", help="Results file (default: <input>.results.jsonl)")
+    batch.add_argument(
+        "--concurrency", type=int, default=0,
+        help="Distinct submissions validated in parallel (default: one per sandbox worker)"
+    )
+    batch.set_defaults(func=validate_batch_command)
+
+    worker = subparsers.add_parser("validation-worker", help="Validate submissions queued by the API")
+    worker.add_argument(
+        "--concurrency", type=int, default=0,
+        help="Jobs validated in parallel (default: one per sandbox worker)"
+    )
+    worker.add_argument(
+        "--retention-hours", type=float, default=24,
+        help="Delete finished jobs older than this (default: 24)"
+    )
+    worker.set_defaults(func=validation_worker_command)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -121,6 +121,50 @@ Return a JSON object with the following structure:
 Generate a learning plan that will transform a developer from a beginner to someone capable of understanding and contributing to this specific repository.
 """
 
+# Prompt used to rewrite only the affected steps of an existing plan
+PLAN_UPDATE_PROMPT = """
+You are an expert programming instructor maintaining an existing learning plan for a GitHub repository.
+The repository has changed since the plan was written. Update the plan as little as possible.
+
+## Repository Information:
+- Name: {repo_name}
+- Description: {repo_description}
+- Language: {repo_language}
+- Topics: {repo_topics}
+- Last Updated: {repo_updated_at}
+- README Preview: {readme_preview}
+
+## What Changed:
+{changed_fields}
+
+## Current Plan Steps:
+{current_steps}
+
+## Task:
+Return ONLY the steps that must be rewritten because of the changes above, plus any new steps that should be appended.
+Keep the step number of a rewritten step. Number new steps after the last existing step.
+Do not return steps that are still accurate. If nothing needs to change, return an empty list.
+
+## Output Format:
+```json
+{{
+    "learning_steps": [
+        {{
+            "step": 3,
+            "title": "Step Title",
+            "description": "Detailed description of what to learn and why",
+            "duration": "X hours",
+            "resources": ["resource1", "resource2"],
+            "exercises": ["exercise1", "exercise2"]
+        }}
+    ]
+}}
+```
+"""
+
+# Repository fields that shape the generated plan, used to detect when a plan is stale
+PLAN_INPUT_FIELDS = ["name", "description", "language", "topics", "updated_at", "readme_preview"]
+
 # Additional specialized prompts for different types of repositories
 WEB_FRAMEWORK_PROMPT = """
 Additional considerations for web framework repositories:
@@ -185,3 +229,22 @@ def format_learning_plan_prompt(repo_info):
         repo_updated_at=repo_info.get('updated_at', 'Unknown'),
         readme_preview=repo_info.get('readme_preview', 'No README available')[:500]
     ) + '\n\n' + specialized_prompt
+
+# Function to format the incremental update prompt for an existing plan
+def format_plan_update_prompt(repo_info, existing_plan, changed_fields):
+    """Format the plan update prompt with the changed inputs and a summary of the current steps"""
+    current_steps = '\n'.join(
+        f"{step.get('step')}. {step.get('title')}: {step.get('description')}"
+        for step in existing_plan.get('learning_steps', [])
+    )
+    
+    return PLAN_UPDATE_PROMPT.format(
+        repo_name=repo_info.get('name', 'Unknown Repository'),
+        repo_description=repo_info.get('description', 'No description available'),
+        repo_language=repo_info.get('language', 'Unknown'),
+        repo_topics=', '.join(repo_info.get('topics', [])),
+        repo_updated_at=repo_info.get('updated_at', 'Unknown'),
+        readme_preview=(repo_info.get('readme_preview') or 'No README available')[:500],
+        changed_fields=', '.join(changed_fields) or 'Unknown',
+        current_steps=current_steps or 'No steps yet'
+    )
@@ -0,0 +1,152 @@
+"""
+Validation of many submissions at once, e.g. re-grading a cohort
+"""
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Hashable, List, Optional, Tuple
+
+from services.code_validator import CodeValidator, ValidationResult, code_validator
+from services.validation_jobs import VALIDATION_BACKEND, validation_jobs
+from services.validation_queue import QueueFullError, ValidationQueue, validation_queue
+
+
+@dataclass
+class BatchSubmission:
+    exercise_id: str
+    user_code: str
+    submission_id: Optional[str] = None  # Caller's reference, e.g. a student id
+
+
+@dataclass
+class BatchItemResult:
+    """Result for one submission; submissions with the same code share `result`"""
+    index: int  # Position in the batch
+    submission: BatchSubmission
+    result: Optional[ValidationResult] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class BatchStats:
+    total: int = 0
+    unique: int = 0  # Distinct (exercise, code) pairs actually validated
+    passed: int = 0
+    failed: int = 0
+    errors: int = 0
+    started: float = field(default_factory=time.perf_counter)
+    seconds: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "total": self.total,
+            "unique": self.unique,
+            "passed": self.passed,
+            "failed": self.failed,
+            "errors": self.errors,
+            "seconds": round(self.seconds, 3),
+            "submissions_per_second": round(self.total / self.seconds, 1) if self.seconds else None
+        }
+
+
+class BatchValidator:
+    """
+    Validates a batch of submissions, yielding results as they complete
+
+    Identical code for the same exercise is validated once and its result
+    reported for every submission that sent it. The distinct submissions are
+    validated concurrently, so their test runs spread over the sandbox's
+    worker processes; `concurrency` defaults to half the workers, leaving the
+    rest for interactive validations. With a `queue`, each distinct submission
+    also waits its turn there under the caller's user id, like any other
+    validation from that user.
+    """
+
+    def __init__(
+        self,
+        validator: CodeValidator,
+        concurrency: Optional[int] = None,
+        max_size: Optional[int] = None,
+        queue: Optional[ValidationQueue] = None
+    ):
+        self.validator = validator
+        self.concurrency = (
+            concurrency
+            or int(os.getenv("BATCH_VALIDATION_CONCURRENCY", "0"))
+            or max(1, (getattr(validator, "concurrency", None) or validator.sandbox.size) // 2)
+        )
+        self.max_size = max_size or int(os.getenv("BATCH_VALIDATION_MAX", "5000"))
+        self.queue = queue
+
+    async def validate(
+        self,
+        submissions: List[BatchSubmission],
+        exercises: Dict[str, Optional[Dict]],
+        stats: Optional[BatchStats] = None,
+        user_id: Optional[Hashable] = None
+    ) -> AsyncIterator[BatchItemResult]:
+        """
+        Validate submissions against their exercises (exercise id -> definition, None if unknown)
+
+        Results are yielded in completion order, not batch order. Pass a
+        BatchStats to read the counts and throughput once iteration ends, and
+        the caller's user_id to share the validation queue fairly.
+        """
+        stats = stats if stats is not None else BatchStats()
+        stats.total = len(submissions)
+
+        # Group identical submissions so each distinct one runs once
+        groups: Dict[Tuple[str, str], List[int]] = {}
+        for index, submission in enumerate(submissions):
+            exercise = exercises.get(submission.exercise_id)
+            if exercise is None:
+                stats.errors += 1
+                yield BatchItemResult(index, submission, error="Exercise not found")
+                continue
+            groups.setdefault((submission.exercise_id, submission.user_code), []).append(index)
+        stats.unique = len(groups)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(key: Tuple[str, str]):
+            exercise_id, user_code = key
+            exercise = exercises[exercise_id]
+            job = lambda: self.validator.validate_exercise_async(user_code, exercise, exercise.get("test_cases"))
+            async with semaphore:
+                try:
+                    if self.queue is None or user_id is None:
+                        return key, await job(), None
+                    while True:
+                        try:
+                            return key, await self.queue.run(user_id, job), None
+                        except QueueFullError as e:
+                            # A batch waits for room rather than failing its submissions
+                            await asyncio.sleep(e.retry_after)
+                except Exception as e:
+                    return key, None, str(e)
+
+        tasks = [asyncio.ensure_future(run(key)) for key in groups]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                key, result, error = await next_done
+                for index in groups[key]:
+                    if error is not None:
+                        stats.errors += 1
+                    elif result.is_valid:
+                        stats.passed += 1
+                    else:
+                        stats.failed += 1
+                    yield BatchItemResult(index, submissions[index], result, error)
+        finally:
+            # Stop outstanding validations if the consumer goes away (e.g. the client disconnects)
+            for task in tasks:
+                task.cancel()
+            stats.seconds = time.perf_counter() - stats.started
+
+
+# Global batch validator instance
+batch_validator = BatchValidator(
+    validation_jobs if VALIDATION_BACKEND == "queue" else code_validator, queue=validation_queue
+)
@@ -0,0 +1,303 @@
+"""
+Single-pass static analysis of code submissions
+
+The submission is parsed once and walked once. The walk records security
+findings and a vocabulary of what the code contains (keywords, operators,
+names, imports, defined functions, string literals), which is then used to
+evaluate the exercise's validation rules without looking at the source text.
+"""
+
+import ast
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+# Builtins that run arbitrary code, reach the filesystem or inspect the interpreter
+DANGEROUS_CALLS = {
+    "__import__", "eval", "exec", "open", "input", "file", "compile",
+    "globals", "locals", "vars", "dir", "help", "breakpoint"
+}
+
+# Builtins that are dangerous even when only referenced, e.g. `run = eval`
+DANGEROUS_REFERENCES = {"__import__", "eval", "exec", "compile", "open"}
+
+# Functions that run commands or reach the filesystem, not allowed as a method of anything
+DANGEROUS_METHODS = {
+    "system", "popen", "listdir", "scandir", "unlink", "rmdir", "rmtree",
+    "fork", "kill", "spawnv", "execv", "execve"
+}
+
+# Attribute calls with a dangerous name that are known to be harmless
+SAFE_ATTRIBUTE_CALLS = {"re.compile"}
+
+# Modules that reach the operating system, the filesystem or raw memory
+DANGEROUS_MODULES = {"os", "subprocess", "io", "shutil", "socket", "ctypes", "importlib", "posix", "pty"}
+
+# Attributes used to escape to the interpreter internals
+DANGEROUS_ATTRIBUTES = {
+    "__globals__", "__builtins__", "__subclasses__", "__code__",
+    "__closure__", "__mro__", "__bases__", "__getattribute__"
+}
+
+KEYWORD_NODES = {
+    ast.If: "if", ast.For: "for", ast.AsyncFor: "for", ast.While: "while",
+    ast.Return: "return", ast.FunctionDef: "def", ast.AsyncFunctionDef: "def",
+    ast.ClassDef: "class", ast.Lambda: "lambda", ast.With: "with", ast.AsyncWith: "with",
+    ast.Try: "try", ast.Raise: "raise", ast.Assert: "assert", ast.Delete: "del",
+    ast.Pass: "pass", ast.Break: "break", ast.Continue: "continue",
+    ast.Global: "global", ast.Nonlocal: "nonlocal", ast.Yield: "yield",
+    ast.YieldFrom: "yield", ast.Await: "await", ast.Import: "import",
+    ast.ImportFrom: "from", ast.IfExp: "if", ast.comprehension: "for"
+}
+
+OPERATOR_SYMBOLS = {
+    ast.Add: "+", ast.Sub: "-", ast.Mult: "*", ast.Div: "/", ast.FloorDiv: "//",
+    ast.Mod: "%", ast.Pow: "**", ast.MatMult: "@", ast.LShift: "<<", ast.RShift: ">>",
+    ast.BitOr: "|", ast.BitXor: "^", ast.BitAnd: "&", ast.Invert: "~",
+    ast.USub: "-", ast.UAdd: "+", ast.Not: "not", ast.And: "and", ast.Or: "or",
+    ast.Eq: "==", ast.NotEq: "!=", ast.Lt: "<", ast.LtE: "<=", ast.Gt: ">", ast.GtE: ">=",
+    ast.Is: "is", ast.IsNot: "is not", ast.In: "in", ast.NotIn: "not in"
+}
+
+BRACKET_NODES = {
+    ast.List: "[", ast.ListComp: "[", ast.Subscript: "[",
+    ast.Dict: "{", ast.Set: "{", ast.DictComp: "{", ast.SetComp: "{",
+    ast.Call: "(", ast.Tuple: "(", ast.GeneratorExp: "("
+}
+
+
+@dataclass
+class Finding:
+    """A problem found in a submission"""
+    rule: str  # e.g. "security:eval", "function:greet"
+    message: str
+    line: Optional[int] = None
+    column: Optional[int] = None
+    severity: str = "error"  # "error" or "warning"
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Finding":
+        return cls(**data)
+
+    def to_dict(self) -> Dict:
+        return {
+            "rule": self.rule,
+            "message": self.message,
+            "line": self.line,
+            "column": self.column,
+            "severity": self.severity
+        }
+
+
+@dataclass
+class CodeAnalysis:
+    """Everything the validator needs to know about a parsed submission"""
+    tree: ast.Module
+    security_findings: List[Finding] = field(default_factory=list)
+    tokens: Set[str] = field(default_factory=set)
+    functions: Set[str] = field(default_factory=set)
+    imports: Set[str] = field(default_factory=set)
+    strings: List[str] = field(default_factory=list)
+    _source: Optional[str] = None
+
+    def check_rule(self, rule: str) -> Optional[Finding]:
+        """Evaluate a validation rule, returning a finding if it isn't met"""
+        kind, _, target = rule.partition(":")
+        if kind == "function":
+            if target not in self.functions:
+                return Finding(rule, f"Missing required function: {target}")
+        elif kind == "import":
+            if not self._imports(target):
+                return Finding(rule, f"Missing required import: {target}")
+        elif kind == "contains":
+            if not self._contains(target):
+                return Finding(rule, f"Missing required pattern: {target}")
+        return None
+
+    def _imports(self, module: str) -> bool:
+        # import:fastapi is met by "import fastapi.routing" or "from fastapi import FastAPI"
+        return any(name == module or name.startswith(module + ".") for name in self.imports)
+
+    def _contains(self, pattern: str) -> bool:
+        pattern = pattern.strip()
+        if pattern in self.tokens:
+            return True
+        if _is_single_token(pattern):
+            # Keywords, names and operators must appear as code, not inside strings, comments or longer names
+            return False
+        if any(pattern in value for value in self.strings):
+            return True
+        # Longer snippets (e.g. "x + y") are matched against the normalized source
+        if self._source is None:
+            self._source = ast.unparse(self.tree)
+        return pattern in self._source
+
+
+def _is_single_token(pattern: str) -> bool:
+    """A name/keyword, or an operator or bracket made only of punctuation"""
+    return pattern.isidentifier() or not any(c.isalnum() or c.isspace() for c in pattern)
+
+
+def _dotted_name(node: ast.expr) -> Optional[str]:
+    """'app.get' for an attribute chain on a plain name, otherwise None"""
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return ".".join(reversed(parts))
+
+
+class _AnalysisVisitor(ast.NodeVisitor):
+    def __init__(self, analysis: CodeAnalysis):
+        self.analysis = analysis
+
+    def _add(self, token: str):
+        self.analysis.tokens.add(token)
+
+    def _security(self, rule: str, message: str, node: ast.AST):
+        self.analysis.security_findings.append(
+            Finding(rule, message, getattr(node, "lineno", None), getattr(node, "col_offset", None))
+        )
+
+    def generic_visit(self, node: ast.AST):
+        node_type = type(node)
+        if node_type in KEYWORD_NODES:
+            self._add(KEYWORD_NODES[node_type])
+        if node_type in OPERATOR_SYMBOLS:
+            self._add(OPERATOR_SYMBOLS[node_type])
+        if node_type in BRACKET_NODES:
+            self._add(BRACKET_NODES[node_type])
+        super().generic_visit(node)
+
+    def visit_If(self, node: ast.If):
+        if node.orelse:
+            # An elif is an If that is the only statement of the else branch
+            is_elif = len(node.orelse) == 1 and isinstance(node.orelse[0], ast.If)
+            self._add("elif" if is_elif else "else")
+        self.generic_visit(node)
+
+    def _visit_loop(self, node):
+        if node.orelse:
+            self._add("else")
+        self.generic_visit(node)
+
+    visit_For = visit_While = visit_AsyncFor = _visit_loop
+
+    def visit_Try(self, node: ast.Try):
+        if node.handlers:
+            self._add("except")
+        if node.orelse:
+            self._add("else")
+        if node.finalbody:
+            self._add("finally")
+        self.generic_visit(node)
+
+    def _visit_function(self, node):
+        self.analysis.functions.add(node.name)
+        self._add(node.name)
+        for decorator in node.decorator_list:
+            self._add_decorator(decorator)
+        self.generic_visit(node)
+
+    visit_FunctionDef = visit_AsyncFunctionDef = _visit_function
+
+    def visit_ClassDef(self, node: ast.ClassDef):
+        self._add(node.name)
+        for decorator in node.decorator_list:
+            self._add_decorator(decorator)
+        self.generic_visit(node)
+
+    def _add_decorator(self, decorator: ast.expr):
+        # "@app.get('/')" is recorded as "@app.get"
+        name = _dotted_name(decorator.func if isinstance(decorator, ast.Call) else decorator)
+        if name:
+            self._add("@" + name)
+
+    def visit_arg(self, node: ast.arg):
+        self._add(node.arg)
+        self.generic_visit(node)
+
+    def _check_module(self, module: str, node: ast.AST):
+        if module.split(".")[0] in DANGEROUS_MODULES:
+            self._security(f"security:import:{module}", f"Importing {module} is not allowed", node)
+
+    def visit_Import(self, node: ast.Import):
+        for alias in node.names:
+            self._check_module(alias.name, node)
+            self.analysis.imports.add(alias.name)
+            self._add(alias.name)
+            if alias.asname:
+                self._add(alias.asname)
+        self.generic_visit(node)
+
+    def visit_ImportFrom(self, node: ast.ImportFrom):
+        if node.module:
+            self._check_module(node.module, node)
+            self.analysis.imports.add(node.module)
+            self._add(node.module)
+        self._add("import")
+        for alias in node.names:
+            self._add(alias.asname or alias.name)
+        self.generic_visit(node)
+
+    def visit_Assign(self, node: ast.Assign):
+        self._add("=")
+        self.generic_visit(node)
+
+    def visit_AnnAssign(self, node: ast.AnnAssign):
+        if node.value is not None:
+            self._add("=")
+        self.generic_visit(node)
+
+    def visit_AugAssign(self, node: ast.AugAssign):
+        self._add(OPERATOR_SYMBOLS[type(node.op)] + "=")
+        self.generic_visit(node)
+
+    def visit_keyword(self, node: ast.keyword):
+        if node.arg:
+            self._add(node.arg)
+        self._add("=")
+        self.generic_visit(node)
+
+    def visit_Name(self, node: ast.Name):
+        self._add(node.id)
+        if isinstance(node.ctx, ast.Load) and node.id in DANGEROUS_REFERENCES:
+            self._security(f"security:{node.id}", f"Use of {node.id}() is not allowed", node)
+        elif node.id == "__builtins__":
+            self._security("security:__builtins__", "Access to __builtins__ is not allowed", node)
+
+    def visit_Attribute(self, node: ast.Attribute):
+        self._add(node.attr)
+        dotted = _dotted_name(node)
+        if dotted:
+            self._add(dotted)
+        if node.attr in DANGEROUS_ATTRIBUTES:
+            self._security(f"security:{node.attr}", f"Access to {node.attr} is not allowed", node)
+        self.generic_visit(node)
+
+    def visit_Call(self, node: ast.Call):
+        func = node.func
+        if isinstance(func, ast.Name):
+            # Dangerous references are already reported by visit_Name
+            if func.id in DANGEROUS_CALLS and func.id not in DANGEROUS_REFERENCES:
+                self._security(f"security:{func.id}", f"Use of {func.id}() is not allowed", node)
+        elif isinstance(func, ast.Attribute) and (func.attr in DANGEROUS_CALLS or func.attr in DANGEROUS_METHODS):
+            # On any receiver: builtins.open, os.popen, sys.modules["io"].open
+            if _dotted_name(func) not in SAFE_ATTRIBUTE_CALLS:
+                self._security(f"security:{func.attr}", f"Use of {func.attr}() is not allowed", node)
+        self.generic_visit(node)
+
+    def visit_Constant(self, node: ast.Constant):
+        if isinstance(node.value, str):
+            self.analysis.strings.append(node.value)
+        else:
+            self._add(repr(node.value))
+
+
+def analyze_code(code: str) -> CodeAnalysis:
+    """Parse and analyze a submission in one pass (raises SyntaxError)"""
+    analysis = CodeAnalysis(tree=ast.parse(code))
+    _AnalysisVisitor(analysis).visit(analysis.tree)
+    return analysis
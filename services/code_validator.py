@@ -1,11 +1,29 @@
 import ast
-import subprocess
-import tempfile
+import asyncio
 import os
-import re
-import json
-from typing import Dict, List, Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple, Optional
 from dataclasses import dataclass
+from services.code_analyzer import CodeAnalysis, Finding, analyze_code
+from services.exercise_generator import compute_exercise_id
+from services.performance import (
+    BUDGET_PENALTY, PerformanceMetrics, PerformanceReport, grade, measurement_spec, measurement_timeout
+)
+from services.submission_cache import SubmissionCache
+from services.sandbox import SandboxPool, SandboxResult
+from services.template_matcher import answers_match, compile_template
+
+TEST_TIMEOUT_SECONDS = 10
+
+# Preloaded in the sandbox workers too, so web app exercises don't pay for importing them per run
+FRAMEWORK_MODULES = {"fastapi", "fastapi.testclient"}
+
+# Score penalty and hint for each kind of unmet validation rule
+RULE_PENALTIES = {
+    "contains": (20, "Make sure your code includes: {}"),
+    "function": (30, "Define a function named: {}"),
+    "import": (15, "Import the {} module")
+}
 
 @dataclass
 class ValidationResult:
@@ -15,6 +33,90 @@ class ValidationResult:
     execution_result: Optional[str] = None
     error_message: Optional[str] = None
     hints: List[str] = None
+    findings: List[Finding] = None  # Structured problems with line numbers, where known
+    test_results: List["TestCaseResult"] = None
+    performance: Optional[PerformanceReport] = None  # For exercises graded on efficiency
+    transient: bool = False  # Depends on load (timeouts, sandbox failures), so never cached
+    
+    def to_dict(self) -> Dict:
+        """Plain data, e.g. to hand a result from a validation worker to the API"""
+        return {
+            "is_valid": self.is_valid,
+            "feedback": self.feedback,
+            "score": self.score,
+            "execution_result": self.execution_result,
+            "error_message": self.error_message,
+            "hints": self.hints,
+            "findings": [finding.to_dict() for finding in self.findings] if self.findings is not None else None,
+            "test_results": [test.to_dict() for test in self.test_results] if self.test_results is not None else None,
+            "performance": self.performance.to_dict() if self.performance else None,
+            "transient": self.transient
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ValidationResult":
+        findings, test_results, performance = data.get("findings"), data.get("test_results"), data.get("performance")
+        return cls(
+            is_valid=data["is_valid"],
+            feedback=data["feedback"],
+            score=data["score"],
+            execution_result=data.get("execution_result"),
+            error_message=data.get("error_message"),
+            hints=data.get("hints"),
+            findings=[Finding.from_dict(finding) for finding in findings] if findings is not None else None,
+            test_results=[TestCaseResult(**test) for test in test_results] if test_results is not None else None,
+            performance=PerformanceReport.from_dict(performance) if performance else None,
+            transient=data.get("transient", False)
+        )
+
+@dataclass
+class TestCaseResult:
+    """Outcome of one test case"""
+    name: str
+    passed: bool
+    duration: float  # seconds
+    expected: Optional[str] = None
+    actual: Optional[str] = None
+    stdout: str = ""
+    error: Optional[str] = None
+    timed_out: bool = False
+    
+    @classmethod
+    def from_dict(cls, data: Dict, case: Dict, index: int) -> "TestCaseResult":
+        """Build from a sandbox result and the test case it ran"""
+        if "expected" in case:
+            expected, actual = repr(case["expected"]), repr(data.get("actual"))
+        elif "expected_output" in case:
+            expected, actual = str(case["expected_output"]).strip(), data.get("stdout", "").strip()
+        else:
+            expected = actual = None
+        return cls(
+            name=data.get("name") or case.get("name") or f"Test {index}",
+            passed=data.get("passed", False),
+            duration=data.get("duration", 0.0),
+            expected=expected,
+            actual=actual,
+            stdout=data.get("stdout", ""),
+            error=data.get("error"),
+            timed_out=data.get("timed_out", False)
+        )
+    
+    def hint(self) -> str:
+        if self.error:
+            return f"{self.name}: {self.error}"
+        return f"{self.name}: expected {self.expected}, got {self.actual}"
+    
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "passed": self.passed,
+            "duration": self.duration,
+            "expected": self.expected,
+            "actual": self.actual,
+            "stdout": self.stdout,
+            "error": self.error,
+            "timed_out": self.timed_out
+        }
 
 class CodeValidator:
     """Validates Python code submissions for coding exercises"""
@@ -22,8 +124,21 @@ class CodeValidator:
     def __init__(self):
         self.safe_modules = {
             'math', 'random', 'datetime', 'collections', 'itertools',
-            'functools', 'operator', 're', 'json', 'os', 'sys'
+            'functools', 'operator', 're', 'json', 'sys'
         }
+        # Warm workers with the allowed modules already imported, started on first use
+        self.sandbox = SandboxPool(preload=self.safe_modules | FRAMEWORK_MODULES)
+        # Limits for validate_exercise_async (parsing/analysis threads, validations in flight)
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("VALIDATION_THREADS", "4")),
+            thread_name_prefix="validation"
+        )
+        self.max_concurrency = int(os.getenv("VALIDATION_CONCURRENCY", "16"))
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # Results of earlier submissions, so resubmitting the same code skips every stage
+        self.cache = SubmissionCache()
+        # Latest reference solution measurement per exercise, used to size measurement time limits
+        self._calibration: Dict[str, PerformanceMetrics] = {}
     
     def validate_exercise(
         self, 
@@ -33,79 +148,275 @@ class CodeValidator:
     ) -> ValidationResult:
         """Validate user code against exercise requirements"""
         
-        # Basic syntax validation
-        syntax_result = self._validate_syntax(user_code)
-        if not syntax_result.is_valid:
-            return syntax_result
+        # Exact resubmissions are answered from the cache without parsing
+        exercise_key = self._exercise_key(exercise, test_cases)
+        source_key = self.cache.source_key(exercise_key, user_code)
+        cached = self.cache.get_by_source(source_key)
+        if cached is not None:
+            return cached
         
-        # Security validation
-        security_result = self._validate_security(user_code)
-        if not security_result.is_valid:
-            return security_result
+        # Basic syntax validation (and the cache lookup for reformatted code)
+        analysis, cache_key, early_result = self._analyze(
+            user_code, exercise_key, source_key, exact=bool(exercise.get("blanks"))
+        )
+        if early_result is not None:
+            return early_result
         
-        # Fill-in-the-blank validation if blanks are provided
-        if exercise.get("blanks"):
-            blank_result = self._validate_fill_in_blanks(user_code, exercise)
-            if not blank_result.is_valid:
-                return blank_result
+        # Security and fill-in-the-blank checks
+        static_result = self._validate_static(user_code, exercise, analysis)
+        if static_result is not None:
+            return self._remember(source_key, cache_key, static_result)
         
         # Run test cases if provided
+        test_result = None
         if test_cases:
             test_result = self._run_test_cases(user_code, test_cases)
             if not test_result.is_valid:
-                return test_result
+                return self._remember(source_key, cache_key, test_result)
+        
+        # Compare the program's output with the expected output, stopping it at the first difference
+        output_result = None
+        expected_output = self._expected_output(exercise)
+        if expected_output is not None:
+            output_result = self._check_output(user_code, expected_output)
+            if not output_result.is_valid:
+                return self._remember(source_key, cache_key, output_result)
+        
+        # Request the routes of a web app exercise and check the responses
+        route_result = None
+        route_checks = self._route_checks(exercise)
+        if route_checks:
+            route_result = self._run_route_checks(user_code, route_checks)
+            if not route_result.is_valid:
+                return self._remember(source_key, cache_key, route_result)
         
         # Check against solution patterns
-        pattern_result = self._validate_patterns(user_code, exercise)
+        pattern_result = self._validate_patterns(user_code, exercise, analysis)
+        result = self._with_test_results(pattern_result, test_result, output_result, route_result)
         
-        return pattern_result
+        # Correct code for an efficiency exercise is measured against the reference solution
+        if exercise.get("performance") and result.is_valid:
+            result = self._with_performance(result, self._measure(user_code, exercise, exercise_key), exercise, exercise_key)
+        
+        return self._remember(source_key, cache_key, result)
     
-    def _validate_syntax(self, code: str) -> ValidationResult:
-        """Check if the code has valid Python syntax"""
-        try:
-            ast.parse(code)
-            return ValidationResult(
-                is_valid=True,
-                feedback="Syntax is valid",
-                score=100,
-                hints=[]
+    def cached_result(self, user_code: str, exercise: Dict, test_cases: List[Dict] = None) -> Optional[ValidationResult]:
+        """Result of an identical earlier submission, if it is still cached"""
+        exercise_key = self._exercise_key(exercise, test_cases)
+        return self.cache.get_by_source(self.cache.source_key(exercise_key, user_code))
+    
+    async def validate_exercise_async(
+        self,
+        user_code: str,
+        exercise: Dict,
+        test_cases: List[Dict] = None,
+        progress: Optional[Callable[[Dict], None]] = None
+    ) -> ValidationResult:
+        """
+        Validate user code without blocking the event loop
+        
+        Same checks as validate_exercise. The analysis stages run in a worker
+        thread and test cases wait on the sandbox pipes asynchronously. At most
+        VALIDATION_CONCURRENCY validations run at once; the rest wait their turn.
+        
+        With progress, progress(event) is called on the event loop as each stage
+        starts and ends ({"type": "stage", "stage": "tests", "status": "running"})
+        and for every line the code prints ({"type": "output", "stream": "stdout",
+        "line": ...}).
+        """
+        exercise_key = self._exercise_key(exercise, test_cases)
+        source_key = self.cache.source_key(exercise_key, user_code)
+        cached = self.cache.get_by_source(source_key)
+        if cached is not None:
+            return cached
+        
+        loop = asyncio.get_running_loop()
+        report = self._stage_reporter(loop, progress)
+        on_output = None
+        if progress is not None:
+            on_output = lambda stream, line: progress({"type": "output", "stream": stream, "line": line})
+        
+        async with self._validation_slots():
+            report("syntax", "running")
+            analysis, cache_key, early_result = await loop.run_in_executor(
+                self.executor, self._analyze, user_code, exercise_key, source_key, bool(exercise.get("blanks"))
             )
-        except SyntaxError as e:
+            report("syntax", "failed" if analysis is None else "passed")
+            if early_result is not None:
+                return early_result
+            
+            static_result = await loop.run_in_executor(
+                self.executor, self._validate_static, user_code, exercise, analysis, report
+            )
+            if static_result is not None:
+                return self._remember(source_key, cache_key, static_result)
+            
+            test_result = None
+            if test_cases:
+                report("tests", "running")
+                test_result = await self._run_test_cases_async(user_code, test_cases, on_output)
+                report("tests", self._status(test_result))
+                if not test_result.is_valid:
+                    return self._remember(source_key, cache_key, test_result)
+            
+            output_result = None
+            expected_output = self._expected_output(exercise)
+            if expected_output is not None:
+                report("output", "running")
+                output_result = await self._check_output_async(user_code, expected_output, on_output)
+                report("output", self._status(output_result))
+                if not output_result.is_valid:
+                    return self._remember(source_key, cache_key, output_result)
+            
+            route_result = None
+            route_checks = self._route_checks(exercise)
+            if route_checks:
+                report("routes", "running")
+                route_result = await self._run_route_checks_async(user_code, route_checks, on_output)
+                report("routes", self._status(route_result))
+                if not route_result.is_valid:
+                    return self._remember(source_key, cache_key, route_result)
+            
+            report("patterns", "running")
+            pattern_result = await loop.run_in_executor(
+                self.executor, self._validate_patterns, user_code, exercise, analysis
+            )
+            report("patterns", self._status(pattern_result))
+            result = self._with_test_results(pattern_result, test_result, output_result, route_result)
+            
+            if exercise.get("performance") and result.is_valid:
+                report("performance", "running")
+                measurement = await self._measure_async(user_code, exercise, exercise_key)
+                result = self._with_performance(result, measurement, exercise, exercise_key)
+                report("performance", self._status(result))
+            
+            return self._remember(source_key, cache_key, result)
+    
+    @staticmethod
+    def _stage_reporter(
+        loop: asyncio.AbstractEventLoop, progress: Optional[Callable[[Dict], None]]
+    ) -> Callable[[str, str], None]:
+        """report(stage, status) that is safe to call from the analysis threads"""
+        def report(stage: str, status: str):
+            if progress is not None:
+                loop.call_soon_threadsafe(progress, {"type": "stage", "stage": stage, "status": status})
+        return report
+    
+    @staticmethod
+    def _status(result: ValidationResult) -> str:
+        return "passed" if result.is_valid else "failed"
+    
+    def _with_test_results(
+        self,
+        result: ValidationResult,
+        test_result: Optional[ValidationResult],
+        output_result: Optional[ValidationResult] = None,
+        route_result: Optional[ValidationResult] = None
+    ) -> ValidationResult:
+        """Keep the per-case results of passing test and route runs (or the program's output) on the final result"""
+        if output_result is not None:
+            result.execution_result = output_result.execution_result
+        executions = [run for run in (test_result, route_result) if run is not None]
+        if executions:
+            result.execution_result = ", ".join(run.execution_result for run in executions)
+            result.test_results = [test for run in executions for test in run.test_results]
+        return result
+    
+    def _validation_slots(self) -> asyncio.Semaphore:
+        # Created on first use so it belongs to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+    
+    def _exercise_key(self, exercise: Dict, test_cases: Optional[List[Dict]]) -> str:
+        """Cache namespace for an exercise: its content-hashed id, plus any test cases passed separately"""
+        key = exercise.get("id") or compute_exercise_id(exercise)
+        if test_cases and test_cases is not exercise.get("test_cases"):
+            key = compute_exercise_id({"exercise": key, "test_cases": test_cases})
+        return key
+    
+    def _analyze(
+        self, user_code: str, exercise_key: str, source_key: str, exact: bool = False
+    ) -> Tuple[Optional[CodeAnalysis], str, Optional[ValidationResult]]:
+        """
+        Parse and walk the code once, then look for an equivalent earlier submission
+        
+        With exact set (fill-in-the-blank exercises, whose answers are read from
+        the formatted text) only the same text counts as equivalent.
+        Returns the analysis, its cache key and, if validation is already
+        settled (syntax error or cache hit), the result.
+        """
+        try:
+            analysis = analyze_code(user_code)
+        except (SyntaxError, ValueError) as e:
+            return None, source_key, self._remember(source_key, source_key, self._syntax_error(e))
+        
+        cache_key = self.cache.normalized_key(exercise_key, analysis.tree, user_code, exact)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            self.cache.remember_source(source_key, cache_key)
+        return analysis, cache_key, cached
+    
+    def _remember(self, source_key: str, cache_key: str, result: ValidationResult) -> ValidationResult:
+        """Cache a result unless it depends on load (timeouts, sandbox failures)"""
+        if not result.transient:
+            self.cache.put(source_key, cache_key, result)
+        return result
+    
+    def _validate_static(
+        self,
+        user_code: str,
+        exercise: Dict,
+        analysis: CodeAnalysis,
+        report: Optional[Callable[[str, str], None]] = None
+    ) -> Optional[ValidationResult]:
+        """Run the checks that don't execute code; returns the first failure, or None"""
+        report = report or (lambda stage, status: None)
+        
+        # Security validation
+        report("security", "running")
+        security_result = self._validate_security(analysis)
+        report("security", self._status(security_result))
+        if not security_result.is_valid:
+            return security_result
+        
+        # Fill-in-the-blank validation if blanks are provided
+        if exercise.get("blanks"):
+            report("blanks", "running")
+            blank_result = self._validate_fill_in_blanks(user_code, exercise)
+            report("blanks", self._status(blank_result))
+            if not blank_result.is_valid:
+                return blank_result
+        
+        return None
+    
+    def _syntax_error(self, error: Exception) -> ValidationResult:
+        """Result for code that doesn't parse"""
+        return ValidationResult(
+            is_valid=False,
+            feedback=f"Syntax error: {str(error)}",
+            score=0,
+            error_message=str(error),
+            hints=["Check your Python syntax", "Make sure all parentheses and brackets are properly closed"],
+            findings=[Finding(
+                rule="syntax",
+                message=getattr(error, "msg", str(error)),
+                line=getattr(error, "lineno", None),
+                column=getattr(error, "offset", None)
+            )]
+        )
+    
+    def _validate_security(self, analysis: CodeAnalysis) -> ValidationResult:
+        """Check for potentially dangerous code"""
+        if analysis.security_findings:
             return ValidationResult(
                 is_valid=False,
-                feedback=f"Syntax error: {str(e)}",
+                feedback="This code contains potentially unsafe operations",
                 score=0,
-                error_message=str(e),
-                hints=["Check your Python syntax", "Make sure all parentheses and brackets are properly closed"]
+                error_message="Security violation detected",
+                hints=["Avoid using eval(), exec(), or other potentially dangerous functions"],
+                findings=analysis.security_findings
             )
-    
-    def _validate_security(self, code: str) -> ValidationResult:
-        """Check for potentially dangerous code"""
-        dangerous_patterns = [
-            r'__import__\s*\(',
-            r'eval\s*\(',
-            r'exec\s*\(',
-            r'open\s*\(',
-            r'input\s*\(',
-            r'file\s*\(',
-            r'compile\s*\(',
-            r'globals\s*\(',
-            r'locals\s*\(',
-            r'vars\s*\(',
-            r'dir\s*\(',
-            r'help\s*\(',
-            r'breakpoint\s*\(',
-        ]
-        
-        for pattern in dangerous_patterns:
-            if re.search(pattern, code):
-                return ValidationResult(
-                    is_valid=False,
-                    feedback="This code contains potentially unsafe operations",
-                    score=0,
-                    error_message="Security violation detected",
-                    hints=["Avoid using eval(), exec(), or other potentially dangerous functions"]
-                )
         
         return ValidationResult(
             is_valid=True,
@@ -127,52 +438,62 @@ class CodeValidator:
                 hints=[]
             )
         
-        # For fill-in-the-blank exercises, we'll use pattern matching
-        # since the user code should match the expected solution pattern
         solution = exercise.get("solution", "")
+        total_blanks = len(blanks)
+        
+        # The complete solution needs no alignment
+        if self._normalize_answer(code.strip()) == self._normalize_answer(solution.strip()):
+            return ValidationResult(
+                is_valid=True,
+                feedback="Perfect! All blanks are filled correctly.",
+                score=100,
+                hints=[]
+            )
+        
+        user_answers = self._extract_user_answers(code, template, blanks)
+        if user_answers is None:
+            if self._same_program(code, solution):
+                # Reformatted around the blanks, but the same program as the solution
+                return ValidationResult(
+                    is_valid=True,
+                    feedback="Perfect! All blanks are filled correctly.",
+                    score=100,
+                    hints=[]
+                )
+            return ValidationResult(
+                is_valid=False,
+                feedback="Try again. Only fill in the blanks and keep the rest of the code as it is.",
+                score=0,
+                hints=["Start again from the exercise template if you changed the code around the blanks"]
+            )
         
-        # Validate each blank by checking if the code matches the expected pattern
+        # Grade each blank on its own answer
         correct_count = 0
-        total_blanks = len(blanks)
         feedback_parts = []
         hints = []
+        for i, (blank, answer) in enumerate(zip(blanks, user_answers)):
+            placeholder = blank.get("placeholder", "")
+            hint = blank.get("hint", "")
+            
+            if not answer or answer == placeholder:
+                feedback_parts.append(f"Blank {i+1}: Not filled")
+                hints.append(f"Hint for blank {i+1}: {hint}")
+            elif answers_match(answer, blank.get("correct_answer", "")):
+                correct_count += 1
+            else:
+                feedback_parts.append(f"Blank {i+1}: Incorrect answer")
+                hints.append(f"Hint for blank {i+1}: {hint}")
         
-        # Check if the code matches the solution pattern
-        normalized_code = self._normalize_answer(code.strip())
-        normalized_solution = self._normalize_answer(solution.strip())
+        # Calculate score
+        score = int((correct_count / total_blanks) * 100)
         
-        if normalized_code == normalized_solution:
-            correct_count = total_blanks
+        # Generate feedback
+        if correct_count == total_blanks:
             feedback = "Perfect! All blanks are filled correctly."
+        elif correct_count > 0:
+            feedback = f"Good progress! {correct_count}/{total_blanks} blanks correct. {', '.join(feedback_parts)}"
         else:
-            # Check individual blanks by comparing with template
-            for i, blank in enumerate(blanks):
-                placeholder = blank.get("placeholder", "")
-                correct_answer = blank.get("correct_answer", "")
-                hint = blank.get("hint", "")
-                
-                # Check if the placeholder is still in the code (not filled)
-                if placeholder in code:
-                    feedback_parts.append(f"Blank {i+1}: Not filled")
-                    hints.append(f"Hint for blank {i+1}: {hint}")
-                else:
-                    # Check if the code contains the correct answer pattern
-                    normalized_correct = self._normalize_answer(correct_answer)
-                    if normalized_correct in normalized_code:
-                        correct_count += 1
-                    else:
-                        feedback_parts.append(f"Blank {i+1}: Incorrect answer")
-                        hints.append(f"Hint for blank {i+1}: {hint}")
-        
-        # Calculate score
-        score = int((correct_count / total_blanks) * 100) if total_blanks > 0 else 0
-        
-        # Generate feedback if not already set
-        if correct_count != total_blanks:
-            if correct_count > 0:
-                feedback = f"Good progress! {correct_count}/{total_blanks} blanks correct. {', '.join(feedback_parts)}"
-            else:
-                feedback = f"Try again. {', '.join(feedback_parts)}"
+            feedback = f"Try again. {', '.join(feedback_parts)}"
         
         return ValidationResult(
             is_valid=correct_count == total_blanks,
@@ -181,27 +502,43 @@ class CodeValidator:
             hints=hints
         )
     
-    def _extract_user_answers(self, code: str, template: str, blanks: List[Dict]) -> Dict[str, str]:
-        """Extract user answers from the code based on the template"""
-        user_answers = {}
+    def _extract_user_answers(self, code: str, template: str, blanks: List[Dict]) -> Optional[List[str]]:
+        """
+        Extract the user's answer for each blank by aligning the code with the template
+        
+        Blanks are matched to placeholder occurrences in template order, so a
+        placeholder used twice gets two answers. Returns None if the code
+        around the blanks doesn't match the template.
+        """
+        matcher = compile_template(template)
+        occurrences = matcher.extract(code)
+        if occurrences is None:
+            return None
         
-        # For now, we'll use a simple approach: compare the code with the template
-        # and identify what the user has filled in
+        answers = []
+        next_occurrence = 0
         for blank in blanks:
             placeholder = blank.get("placeholder", "")
-            correct_answer = blank.get("correct_answer", "")
-            
-            # Check if the placeholder is still in the code (not filled)
-            if placeholder in code:
-                user_answers[placeholder] = placeholder  # Not filled
-            else:
-                # The placeholder has been replaced, try to extract the answer
-                # This is a simplified approach - in a real implementation, you'd need
-                # more sophisticated parsing
-                user_answers[placeholder] = correct_answer  # Assume correct for now
-        
-        return user_answers
+            # Next occurrence of this placeholder after the previous blank's
+            try:
+                index = matcher.placeholders.index(placeholder, next_occurrence)
+            except ValueError:
+                try:
+                    index = matcher.placeholders.index(placeholder)
+                except ValueError:
+                    answers.append("")
+                    continue
+            answers.append(occurrences[index])
+            next_occurrence = index + 1
+        return answers
     
+    @staticmethod
+    def _same_program(code: str, solution: str) -> bool:
+        try:
+            return ast.dump(ast.parse(code)) == ast.dump(ast.parse(solution))
+        except (SyntaxError, ValueError):
+            return False
+
     def _normalize_answer(self, answer: str) -> str:
         """Normalize answer for comparison"""
         # Remove extra whitespace
@@ -216,134 +553,295 @@ class CodeValidator:
         return normalized
     
     def _run_test_cases(self, code: str, test_cases: List[Dict]) -> ValidationResult:
-        """Run test cases against the user code"""
+        """Run all test cases against the user code in one sandbox run"""
         try:
-            # Create a temporary file with the user code
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-                f.write(code)
-                temp_file = f.name
-            
-            # Add test execution code
-            test_code = f"""
-{code}
-
-# Test execution
-if __name__ == "__main__":
-    results = []
-    errors = []
-    
-    try:
-        # Test case 1: Basic functionality
-        result = main()  # Assuming main() is the function to test
-        results.append(result)
-    except Exception as e:
-        errors.append(str(e))
-    
-    print(json.dumps({{"results": results, "errors": errors}}))
-"""
-            
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-                f.write(test_code)
-                test_file = f.name
-            
-            # Execute the test
-            result = subprocess.run(
-                ['python3', test_file],
-                capture_output=True,
-                text=True,
-                timeout=10
+            result = self.sandbox.run(code, timeout=TEST_TIMEOUT_SECONDS, tests=test_cases)
+            return self._test_result(result, test_cases)
+        except Exception as e:
+            return self._execution_error(e)
+    
+    async def _run_test_cases_async(
+        self, code: str, test_cases: List[Dict], on_output: Optional[Callable[[str, str], None]] = None
+    ) -> ValidationResult:
+        """Run all test cases against the user code without blocking the event loop"""
+        try:
+            result = await self.sandbox.run_async(code, timeout=TEST_TIMEOUT_SECONDS, tests=test_cases, on_output=on_output)
+            return self._test_result(result, test_cases)
+        except Exception as e:
+            return self._execution_error(e)
+    
+    def _limit_result(self, result: SandboxResult) -> Optional[ValidationResult]:
+        """Result for a run stopped by the output limit or a timeout, otherwise None"""
+        if result.limit_exceeded == "output":
+            return ValidationResult(
+                is_valid=False,
+                feedback="Your code printed too much output",
+                score=0,
+                error_message="Output limit exceeded",
+                hints=["Check for print statements inside endless loops"]
             )
-            
-            # Clean up temporary files
-            os.unlink(temp_file)
-            os.unlink(test_file)
-            
-            if result.returncode != 0:
-                return ValidationResult(
-                    is_valid=False,
-                    feedback="Code execution failed",
-                    score=0,
-                    error_message=result.stderr,
-                    hints=["Check your code logic", "Make sure all variables are defined"]
-                )
-            
-            # Parse results
-            try:
-                output = json.loads(result.stdout.strip())
-                if output.get("errors"):
-                    return ValidationResult(
-                        is_valid=False,
-                        feedback="Code produced errors during execution",
-                        score=0,
-                        error_message=", ".join(output["errors"]),
-                        hints=["Check your function implementation", "Verify all variables are properly initialized"]
-                    )
-                
-                return ValidationResult(
-                    is_valid=True,
-                    feedback="Code executed successfully",
-                    score=100,
-                    execution_result=str(output.get("results", [])),
-                    hints=[]
-                )
-                
-            except json.JSONDecodeError:
-                return ValidationResult(
-                    is_valid=True,
-                    feedback="Code executed successfully",
-                    score=100,
-                    execution_result=result.stdout,
-                    hints=[]
-                )
-                
-        except subprocess.TimeoutExpired:
+        if result.timed_out or result.limit_exceeded == "cpu":
             return ValidationResult(
                 is_valid=False,
                 feedback="Code execution timed out",
                 score=0,
                 error_message="Execution timeout",
-                hints=["Check for infinite loops", "Optimize your code"]
+                hints=["Check for infinite loops", "Optimize your code"],
+                transient=True
+            )
+        return None
+    
+    def _test_result(self, result: SandboxResult, test_cases: List[Dict], kind: str = "test cases") -> ValidationResult:
+        """Turn a sandbox test (or route) run into a validation result with per-case results"""
+        if result.tests is None:
+            limit_result = self._limit_result(result)
+            if limit_result is not None:
+                return limit_result
+            return ValidationResult(
+                is_valid=False,
+                feedback="Code execution failed",
+                score=0,
+                error_message=result.test_error or result.stderr or f"Exit code {result.returncode}",
+                hints=["Check your code logic", "Make sure all variables are defined"],
+                # Killed by a signal, e.g. when the machine ran out of memory
+                transient=result.returncode < 0
             )
+        
+        test_results = [
+            TestCaseResult.from_dict(case_result, case, index)
+            for index, (case_result, case) in enumerate(zip(result.tests, test_cases), start=1)
+        ]
+        passed = sum(1 for test in test_results if test.passed)
+        total = len(test_results)
+        hints = [test.hint() for test in test_results if not test.passed]
+        
+        if passed == total:
+            feedback = f"All {total} {kind} passed."
+        elif any(test.timed_out for test in test_results):
+            feedback = f"{passed}/{total} {kind} passed. Some {kind} timed out."
+            hints.append("Check for infinite loops")
+        else:
+            feedback = f"{passed}/{total} {kind} passed."
+        
+        errors = [f"{test.name}: {test.error}" for test in test_results if test.error]
+        return ValidationResult(
+            is_valid=passed == total,
+            feedback=feedback,
+            score=int(passed / total * 100) if total else 100,
+            execution_result=f"{passed}/{total} {kind} passed",
+            error_message="\n".join(errors) or None,
+            hints=hints,
+            test_results=test_results,
+            transient=any(test.timed_out for test in test_results)
+        )
+    
+    def _runner(self, exercise: Dict) -> str:
+        runner = exercise.get("runner")
+        if runner is None:
+            # Stored before exercises had a runner; FastAPI apps print nothing when run as a script
+            runner = "fastapi" if "import:fastapi" in exercise.get("validation_rules", []) else "script"
+        return runner
+    
+    def _expected_output(self, exercise: Dict) -> Optional[str]:
+        """The output stdout must match, or None if the exercise isn't run as a script"""
+        expected_output = exercise.get("expected_output")
+        if expected_output is None or self._runner(exercise) != "script":
+            return None
+        return expected_output
+    
+    def _route_checks(self, exercise: Dict) -> Optional[List[Dict]]:
+        """Requests to send to a web app exercise, or None"""
+        if self._runner(exercise) != "fastapi":
+            return None
+        return exercise.get("route_checks") or None
+    
+    def _run_route_checks(self, code: str, route_checks: List[Dict]) -> ValidationResult:
+        """Define the submitted app in a warm worker and request each route through a test client"""
+        try:
+            result = self.sandbox.run(code, timeout=TEST_TIMEOUT_SECONDS, routes=route_checks)
+            return self._test_result(result, route_checks, kind="route checks")
+        except Exception as e:
+            return self._execution_error(e)
+    
+    async def _run_route_checks_async(
+        self, code: str, route_checks: List[Dict], on_output: Optional[Callable[[str, str], None]] = None
+    ) -> ValidationResult:
+        try:
+            result = await self.sandbox.run_async(code, timeout=TEST_TIMEOUT_SECONDS, routes=route_checks, on_output=on_output)
+            return self._test_result(result, route_checks, kind="route checks")
+        except Exception as e:
+            return self._execution_error(e)
+    
+    def _check_output(self, code: str, expected_output: str) -> ValidationResult:
+        """Run the code once, comparing its stdout with the expected output as it is printed"""
+        try:
+            result = self.sandbox.run(code, timeout=TEST_TIMEOUT_SECONDS, expected_output=expected_output)
+            return self._output_result(result)
         except Exception as e:
+            return self._execution_error(e)
+    
+    async def _check_output_async(
+        self, code: str, expected_output: str, on_output: Optional[Callable[[str, str], None]] = None
+    ) -> ValidationResult:
+        try:
+            result = await self.sandbox.run_async(
+                code, timeout=TEST_TIMEOUT_SECONDS, expected_output=expected_output, on_output=on_output
+            )
+            return self._output_result(result)
+        except Exception as e:
+            return self._execution_error(e)
+    
+    def _output_result(self, result: SandboxResult) -> ValidationResult:
+        if result.output_matches:
+            return ValidationResult(
+                is_valid=True,
+                feedback="Output matches the expected output.",
+                score=100,
+                execution_result=result.stdout
+            )
+        limit_result = self._limit_result(result)
+        if limit_result is not None:
+            return limit_result
+        if result.returncode > 0:
             return ValidationResult(
                 is_valid=False,
-                feedback="Error during code execution",
+                feedback="Code execution failed",
                 score=0,
-                error_message=str(e),
-                hints=["Check your code structure", "Make sure all imports are correct"]
+                execution_result=result.stdout,
+                error_message=result.stderr or f"Exit code {result.returncode}",
+                hints=["Check your code logic", "Make sure all variables are defined"]
+            )
+        return ValidationResult(
+            is_valid=False,
+            feedback=f"Your output doesn't match the expected output (first difference on line {result.output_mismatch_line}).",
+            score=0,
+            # Up to the first difference; anything after it is only what was buffered before the stop
+            execution_result="\n".join(result.stdout.split("\n")[:result.output_mismatch_line or None]),
+            hints=["Compare your output with the expected output line by line"]
+        )
+    
+    def _measure(self, code: str, exercise: Dict, exercise_key: str) -> Optional[SandboxResult]:
+        """Measure the code and the exercise's solution in the same sandbox run"""
+        try:
+            return self.sandbox.run(
+                code, timeout=self._measurement_timeout(exercise, exercise_key), measure=measurement_spec(exercise, self._calibration.get(exercise_key))
+            )
+        except Exception as e:
+            print(f"Warning: Could not measure submission performance: {e}")
+            return None
+    
+    async def _measure_async(self, code: str, exercise: Dict, exercise_key: str) -> Optional[SandboxResult]:
+        try:
+            return await self.sandbox.run_async(
+                code, timeout=self._measurement_timeout(exercise, exercise_key), measure=measurement_spec(exercise, self._calibration.get(exercise_key))
+            )
+        except Exception as e:
+            print(f"Warning: Could not measure submission performance: {e}")
+            return None
+    
+    def _measurement_timeout(self, exercise: Dict, exercise_key: str) -> float:
+        reference = self._calibration.get(exercise_key)
+        if reference is None:
+            return TEST_TIMEOUT_SECONDS
+        return measurement_timeout(reference, exercise["performance"], TEST_TIMEOUT_SECONDS)
+    
+    def _with_performance(
+        self,
+        result: ValidationResult,
+        measurement: Optional[SandboxResult],
+        exercise: Dict,
+        exercise_key: str
+    ) -> ValidationResult:
+        """Grade a correct submission's measurements against budgets calibrated from the solution"""
+        if measurement is None or measurement.measurements is None:
+            if measurement is not None and (measurement.timed_out or measurement.limit_exceeded == "cpu"):
+                result.is_valid = False
+                result.score = max(0, result.score - BUDGET_PENALTY)
+                result.feedback = "Your code is correct but too slow: it ran past the time limit for this exercise."
+                result.hints = (result.hints or []) + ["Look for repeated work or a faster algorithm"]
+            # Couldn't be measured this time (or depends on load), so don't cache it
+            result.transient = True
+            return result
+        
+        report = grade(measurement.measurements, exercise["performance"])
+        if report is None:
+            # A broken reference solution shouldn't fail the student
+            print(f"Warning: Could not measure the reference solution of exercise {exercise_key}")
+            return result
+        self._calibration[exercise_key] = report.reference
+        result.performance = report
+        if report.within_budget:
+            return result
+        
+        if report.submission.error:
+            result.is_valid = False
+            result.score = max(0, result.score - BUDGET_PENALTY * len(report.exceeded))
+            result.feedback = f"Your code failed when run on the exercise's performance input: {report.submission.error}"
+            result.hints = (result.hints or []) + ["Make sure your code also works for larger inputs"]
+            return result
+        
+        problems = []
+        hints = list(result.hints or [])
+        if "cpu_seconds" in report.exceeded and report.submission.timed_out:
+            problems.append(
+                f"it was stopped after running past its CPU budget of {report.budgets['cpu_seconds']:.4f}s "
+                f"(reference solution: {report.reference.cpu_seconds:.4f}s)"
+            )
+            hints.append("Look for repeated work or a faster algorithm")
+        elif "cpu_seconds" in report.exceeded:
+            problems.append(
+                f"CPU time {report.submission.cpu_seconds:.4f}s is over the budget of "
+                f"{report.budgets['cpu_seconds']:.4f}s (reference solution: {report.reference.cpu_seconds:.4f}s)"
             )
+            hints.append("Look for repeated work or a faster algorithm")
+        if "peak_memory_bytes" in report.exceeded:
+            problems.append(
+                f"peak memory {report.submission.peak_memory_bytes / 1024:.0f} KB is over the budget of "
+                f"{report.budgets['peak_memory_bytes'] / 1024:.0f} KB "
+                f"(reference solution: {report.reference.peak_memory_bytes / 1024:.0f} KB)"
+            )
+            hints.append("Avoid building large intermediate lists; use generators or running totals")
+        
+        result.is_valid = False
+        result.score = max(0, result.score - BUDGET_PENALTY * len(report.exceeded))
+        result.feedback = f"Your code is correct but not efficient enough: {'; '.join(problems)}."
+        result.hints = hints
+        # Timings depend on machine load, so a miss is re-measured on resubmission
+        result.transient = True
+        return result
     
-    def _validate_patterns(self, code: str, exercise: Dict) -> ValidationResult:
+    def _execution_error(self, error: Exception) -> ValidationResult:
+        return ValidationResult(
+            is_valid=False,
+            feedback="Error during code execution",
+            score=0,
+            error_message=str(error),
+            hints=["Check your code structure", "Make sure all imports are correct"],
+            transient=True
+        )
+    
+    def _validate_patterns(self, code: str, exercise: Dict, analysis: Optional[CodeAnalysis] = None) -> ValidationResult:
         """Validate code against expected patterns and solution"""
-        solution = exercise.get("solution", "")
         validation_rules = exercise.get("validation_rules", [])
+        if analysis is None:
+            analysis = analyze_code(code)
         
         score = 100
         feedback_parts = []
         hints = []
+        findings = []
         
         # Check for required patterns
         for rule in validation_rules:
-            if rule.startswith("contains:"):
-                pattern = rule.split(":", 1)[1]
-                if pattern not in code:
-                    score -= 20
-                    feedback_parts.append(f"Missing required pattern: {pattern}")
-                    hints.append(f"Make sure your code includes: {pattern}")
-            
-            elif rule.startswith("function:"):
-                func_name = rule.split(":", 1)[1]
-                if f"def {func_name}" not in code:
-                    score -= 30
-                    feedback_parts.append(f"Missing required function: {func_name}")
-                    hints.append(f"Define a function named: {func_name}")
-            
-            elif rule.startswith("import:"):
-                module = rule.split(":", 1)[1]
-                if f"import {module}" not in code and f"from {module}" not in code:
-                    score -= 15
-                    feedback_parts.append(f"Missing required import: {module}")
-                    hints.append(f"Import the {module} module")
+            finding = analysis.check_rule(rule)
+            if finding is None:
+                continue
+            kind, _, target = rule.partition(":")
+            penalty, hint = RULE_PENALTIES[kind]
+            score -= penalty
+            feedback_parts.append(finding.message)
+            hints.append(hint.format(target))
+            findings.append(finding)
         
         # Check code length (basic complexity check)
         if len(code.strip()) < 10:
@@ -365,7 +863,8 @@ if __name__ == "__main__":
             is_valid=score >= 70,
             feedback=feedback,
             score=max(0, score),
-            hints=hints
+            hints=hints,
+            findings=findings
         )
 
 # Global validator instance
@@ -1,286 +1,202 @@
-import uuid
-from typing import List, Dict
+import hashlib
+import json
+import os
+from dataclasses import dataclass, replace
+from types import MappingProxyType
+from functools import cached_property, lru_cache
+from typing import List, Dict, Optional, Tuple
 from database.schemas import CodingExercise
+from services.topic_classifier import TopicClassifier
+
+# Directory holding one JSON file of templates per topic
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "exercise_templates")
+
+# Topics scoring below this are treated as noise (e.g. a lone "for" in prose)
+MIN_TOPIC_SCORE = 1.0
+
+# Extra hints added to the first (beginner) exercise of a step
+BEGINNER_HINTS = (
+    "Take your time to understand each part",
+    "Check the syntax carefully"
+)
+
+def compute_exercise_id(exercise: Dict) -> str:
+    """Stable id for an exercise, derived from its content (any existing id is ignored)"""
+    content = {key: value for key, value in exercise.items() if key != "id"}
+    canonical = json.dumps(content, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+@dataclass(frozen=True)
+class ExerciseTemplate:
+    """Immutable exercise template loaded from the template data files"""
+    topic: str
+    title: str
+    description: str
+    difficulty: str
+    code_template: str
+    solution: str
+    hints: Tuple[str, ...]
+    validation_rules: Tuple[str, ...]
+    expected_output: Optional[str] = None
+    runner: str = "script"
+    performance: Optional[MappingProxyType] = None
+    test_cases: Tuple[MappingProxyType, ...] = ()
+    route_checks: Tuple[MappingProxyType, ...] = ()
+    blanks: Tuple[MappingProxyType, ...] = ()
+    
+    @classmethod
+    def from_dict(cls, topic: str, data: Dict) -> "ExerciseTemplate":
+        return cls(
+            topic=topic,
+            title=data["title"],
+            description=data["description"],
+            difficulty=data["difficulty"],
+            code_template=data["code_template"],
+            solution=data["solution"],
+            hints=tuple(data.get("hints", [])),
+            validation_rules=tuple(data.get("validation_rules", [])),
+            expected_output=data.get("expected_output"),
+            runner=data.get("runner", "script"),
+            performance=MappingProxyType(dict(data["performance"])) if data.get("performance") else None,
+            test_cases=tuple(MappingProxyType(dict(case)) for case in data.get("test_cases", [])),
+            route_checks=tuple(MappingProxyType(dict(route)) for route in data.get("route_checks", [])),
+            blanks=tuple(MappingProxyType(dict(blank)) for blank in data.get("blanks", []))
+        )
+    
+    def to_dict(self) -> Dict:
+        """Exercise content as plain, mutable data (without an id)"""
+        return {
+            "title": self.title,
+            "description": self.description,
+            "difficulty": self.difficulty,
+            "code_template": self.code_template,
+            "solution": self.solution,
+            "hints": list(self.hints),
+            "validation_rules": list(self.validation_rules),
+            "expected_output": self.expected_output,
+            "runner": self.runner,
+            "performance": dict(self.performance) if self.performance else None,
+            "test_cases": [dict(case) for case in self.test_cases],
+            "route_checks": [dict(route) for route in self.route_checks],
+            "blanks": [dict(blank) for blank in self.blanks]
+        }
+    
+    @cached_property
+    def exercise_id(self) -> str:
+        # The same template version always gets the same id, across steps, plans and restarts
+        return compute_exercise_id(self.to_dict())
+    
+    def to_exercise(self) -> CodingExercise:
+        """Create a CodingExercise with its own mutable copies of the template data"""
+        return CodingExercise(id=self.exercise_id, **self.to_dict())
 
 class ExerciseGenerator:
     """Generates coding exercises for different programming topics"""
     
     def __init__(self):
+        # Templates are loaded once and never mutated afterwards
         self.exercise_templates = self._load_exercise_templates()
+        self._templates_by_difficulty = self._build_difficulty_index()
+        self.topic_classifier = TopicClassifier.from_file()
+        # Selections depend only on (topics, difficulty), so cache the prepared versions
+        self._select_templates = lru_cache(maxsize=1024)(self._build_selection)
     
-    def _load_exercise_templates(self) -> Dict[str, List[Dict]]:
-        """Load exercise templates for different topics"""
-        return {
-            "python_basics": [
-                {
-                    "title": "Hello World",
-                    "description": "Create a simple print statement to output 'Hello, World!'",
-                    "difficulty": "beginner",
-                    "code_template": "print({{message}})",
-                    "solution": 'print("Hello, World!")',
-                    "hints": ["Use the print() function", "Remember to use quotes for strings"],
-                    "validation_rules": ["contains:print", "contains:Hello, World!"],
-                    "expected_output": "Hello, World!",
-                    "blanks": [
-                        {"placeholder": "{{message}}", "correct_answer": '"Hello, World!"', "hint": "Use quotes around the text"}
-                    ]
-                },
-                {
-                    "title": "Variable Assignment",
-                    "description": "Create a variable named 'name' and assign it your name, then print it",
-                    "difficulty": "beginner",
-                    "code_template": "{{variable_name}} = {{value}}\nprint({{variable_name}})",
-                    "solution": 'name = "John"\nprint(name)',
-                    "hints": ["Use the = operator to assign values", "Variable names should be descriptive"],
-                    "validation_rules": ["contains:=", "contains:print", "function:name"],
-                    "expected_output": "John",
-                    "blanks": [
-                        {"placeholder": "{{variable_name}}", "correct_answer": "name", "hint": "Use a descriptive variable name"},
-                        {"placeholder": "{{value}}", "correct_answer": '"John"', "hint": "Use quotes for string values"},
-                        {"placeholder": "{{variable_name}}", "correct_answer": "name", "hint": "Use the same variable name you defined"}
-                    ]
-                },
-                {
-                    "title": "Basic Math",
-                    "description": "Calculate the sum of two numbers and store it in a variable called 'result'",
-                    "difficulty": "beginner",
-                    "code_template": "a = {{number1}}\nb = {{number2}}\nresult = {{calculation}}\nprint(result)",
-                    "solution": "a = 5\nb = 3\nresult = a + b\nprint(result)",
-                    "hints": ["Use the + operator for addition", "Make sure to assign the result to a variable"],
-                    "validation_rules": ["contains:+", "contains:result", "contains:print"],
-                    "expected_output": "8",
-                    "blanks": [
-                        {"placeholder": "{{number1}}", "correct_answer": "5", "hint": "Choose any number"},
-                        {"placeholder": "{{number2}}", "correct_answer": "3", "hint": "Choose another number"},
-                        {"placeholder": "{{calculation}}", "correct_answer": "a + b", "hint": "Add the two variables together"}
-                    ]
-                }
-            ],
-            "functions": [
-                {
-                    "title": "Simple Function",
-                    "description": "Create a function called 'greet' that takes a name parameter and returns a greeting",
-                    "difficulty": "intermediate",
-                    "code_template": "def {{function_name}}({{parameter}}):\n    return {{return_value}}\n\nprint(greet('Alice'))",
-                    "solution": 'def greet(name):\n    return f"Hello, {name}!"\n\nprint(greet("Alice"))',
-                    "hints": ["Use 'def' to define a function", "Use f-strings for string formatting"],
-                    "validation_rules": ["function:greet", "contains:def", "contains:return"],
-                    "expected_output": "Hello, Alice!",
-                    "blanks": [
-                        {"placeholder": "{{function_name}}", "correct_answer": "greet", "hint": "Use the function name 'greet'"},
-                        {"placeholder": "{{parameter}}", "correct_answer": "name", "hint": "Use 'name' as the parameter"},
-                        {"placeholder": "{{return_value}}", "correct_answer": 'f"Hello, {name}!"', "hint": "Use an f-string to format the greeting"}
-                    ]
-                },
-                {
-                    "title": "Function with Parameters",
-                    "description": "Create a function called 'add_numbers' that takes two parameters and returns their sum",
-                    "difficulty": "intermediate",
-                    "code_template": "def {{function_name}}({{param1}}, {{param2}}):\n    return {{calculation}}\n\nresult = add_numbers(10, 5)\nprint(result)",
-                    "solution": "def add_numbers(a, b):\n    return a + b\n\nresult = add_numbers(10, 5)\nprint(result)",
-                    "hints": ["Function parameters go in parentheses", "Use the return statement to send back a value"],
-                    "validation_rules": ["function:add_numbers", "contains:return", "contains:+"],
-                    "expected_output": "15",
-                    "blanks": [
-                        {"placeholder": "{{function_name}}", "correct_answer": "add_numbers", "hint": "Use the function name 'add_numbers'"},
-                        {"placeholder": "{{param1}}", "correct_answer": "a", "hint": "Use 'a' as the first parameter"},
-                        {"placeholder": "{{param2}}", "correct_answer": "b", "hint": "Use 'b' as the second parameter"},
-                        {"placeholder": "{{calculation}}", "correct_answer": "a + b", "hint": "Add the two parameters together"}
-                    ]
-                }
-            ],
-            "data_structures": [
-                {
-                    "title": "List Operations",
-                    "description": "Create a list of numbers and find the sum of all elements",
-                    "difficulty": "intermediate",
-                    "code_template": "numbers = [{{list_values}}]\ntotal = {{calculation}}\nprint(total)",
-                    "solution": "numbers = [1, 2, 3, 4, 5]\ntotal = sum(numbers)\nprint(total)",
-                    "hints": ["Use square brackets for lists", "The sum() function adds all numbers in a list"],
-                    "validation_rules": ["contains:[", "contains:sum", "contains:print"],
-                    "expected_output": "15",
-                    "blanks": [
-                        {"placeholder": "{{list_values}}", "correct_answer": "1, 2, 3, 4, 5", "hint": "Create a list with some numbers"},
-                        {"placeholder": "{{calculation}}", "correct_answer": "sum(numbers)", "hint": "Use the sum() function on the list"}
-                    ]
-                },
-                {
-                    "title": "Dictionary Creation",
-                    "description": "Create a dictionary with keys 'name' and 'age', then print the age",
-                    "difficulty": "intermediate",
-                    "code_template": "person = {{{{'name': 'John', 'age': 30}}}}\nprint(person['{{key}}'])",
-                    "solution": "person = {'name': 'John', 'age': 30}\nprint(person['age'])",
-                    "hints": ["Use curly braces for dictionaries", "Access values using square brackets"],
-                    "validation_rules": ["contains:{", "contains:print", "contains:person"],
-                    "expected_output": "30",
-                    "blanks": [
-                        {"placeholder": "{{'name': 'John', 'age': 30}}", "correct_answer": "'name': 'John', 'age': 30", "hint": "Create key-value pairs for name and age"},
-                        {"placeholder": "{{key}}", "correct_answer": "age", "hint": "Use the key 'age' to access the age value"}
-                    ]
-                }
-            ],
-            "control_flow": [
-                {
-                    "title": "If Statement",
-                    "description": "Create a function that checks if a number is positive, negative, or zero",
-                    "difficulty": "intermediate",
-                    "code_template": "def check_number({{parameter}}):\n    if {{condition1}}:\n        return {{result1}}\n    elif {{condition2}}:\n        return {{result2}}\n    else:\n        return {{result3}}\n\nprint(check_number(5))",
-                    "solution": 'def check_number(num):\n    if num > 0:\n        return "Positive"\n    elif num < 0:\n        return "Negative"\n    else:\n        return "Zero"\n\nprint(check_number(5))',
-                    "hints": ["Use if, elif, and else statements", "Compare numbers using >, <, =="],
-                    "validation_rules": ["function:check_number", "contains:if", "contains:elif", "contains:else"],
-                    "expected_output": "Positive",
-                    "blanks": [
-                        {"placeholder": "{{parameter}}", "correct_answer": "num", "hint": "Use 'num' as the parameter name"},
-                        {"placeholder": "{{condition1}}", "correct_answer": "num > 0", "hint": "Check if the number is greater than 0"},
-                        {"placeholder": "{{result1}}", "correct_answer": '"Positive"', "hint": "Return 'Positive' for positive numbers"},
-                        {"placeholder": "{{condition2}}", "correct_answer": "num < 0", "hint": "Check if the number is less than 0"},
-                        {"placeholder": "{{result2}}", "correct_answer": '"Negative"', "hint": "Return 'Negative' for negative numbers"},
-                        {"placeholder": "{{result3}}", "correct_answer": '"Zero"', "hint": "Return 'Zero' for zero"}
-                    ]
-                },
-                {
-                    "title": "For Loop",
-                    "description": "Create a function that prints all even numbers from 1 to 10",
-                    "difficulty": "intermediate",
-                    "code_template": "def print_even_numbers():\n    for {{variable}} in range({{start}}, {{end}}):\n        if {{condition}}:\n            print({{variable}})\n\nprint_even_numbers()",
-                    "solution": "def print_even_numbers():\n    for i in range(1, 11):\n        if i % 2 == 0:\n            print(i)\n\nprint_even_numbers()",
-                    "hints": ["Use range() to create a sequence", "Use % operator to check for even numbers"],
-                    "validation_rules": ["function:print_even_numbers", "contains:for", "contains:if", "contains:%"],
-                    "expected_output": "2\n4\n6\n8\n10",
-                    "blanks": [
-                        {"placeholder": "{{variable}}", "correct_answer": "i", "hint": "Use 'i' as the loop variable"},
-                        {"placeholder": "{{start}}", "correct_answer": "1", "hint": "Start from 1"},
-                        {"placeholder": "{{end}}", "correct_answer": "11", "hint": "End at 11 (exclusive)"},
-                        {"placeholder": "{{condition}}", "correct_answer": "i % 2 == 0", "hint": "Check if the number is even using modulo"},
-                        {"placeholder": "{{variable}}", "correct_answer": "i", "hint": "Print the loop variable"}
-                    ]
-                }
-            ],
-            "fastapi_basics": [
-                {
-                    "title": "Basic FastAPI Route",
-                    "description": "Create a simple FastAPI route that returns a JSON response",
-                    "difficulty": "intermediate",
-                    "code_template": "from fastapi import FastAPI\n\napp = FastAPI()\n\n@app.get('/{{route}}')\ndef {{function_name}}():\n    return {{{{'message': 'Hello from FastAPI!'}}}}\n",
-                    "solution": "from fastapi import FastAPI\n\napp = FastAPI()\n\n@app.get('/hello')\ndef hello():\n    return {'message': 'Hello from FastAPI!'}",
-                    "hints": ["Import FastAPI", "Use the @app.get decorator", "Return a dictionary for JSON response"],
-                    "validation_rules": ["import:fastapi", "contains:@app.get", "contains:return"],
-                    "expected_output": "{'message': 'Hello from FastAPI!'}",
-                    "blanks": [
-                        {"placeholder": "{{route}}", "correct_answer": "hello", "hint": "Use 'hello' as the route path"},
-                        {"placeholder": "{{function_name}}", "correct_answer": "hello", "hint": "Use 'hello' as the function name"},
-                        {"placeholder": "{{'message': 'Hello from FastAPI!'}}", "correct_answer": "'message': 'Hello from FastAPI!'", "hint": "Create a dictionary with a message key"}
-                    ]
-                },
-                {
-                    "title": "Route with Parameters",
-                    "description": "Create a FastAPI route that accepts a name parameter and returns a personalized greeting",
-                    "difficulty": "intermediate",
-                    "code_template": "from fastapi import FastAPI\n\napp = FastAPI()\n\n@app.get('/greet/{{parameter}}')\ndef greet({{parameter}}: str):\n    return {{{{'message': f'Hello, {{parameter}}!'}}}}\n",
-                    "solution": "from fastapi import FastAPI\n\napp = FastAPI()\n\n@app.get('/greet/{name}')\ndef greet(name: str):\n    return {'message': f'Hello, {name}!'}",
-                    "hints": ["Use path parameters with curly braces", "Add type hints to parameters", "Use f-strings for formatting"],
-                    "validation_rules": ["import:fastapi", "contains:@app.get", "contains:str"],
-                    "expected_output": "{'message': 'Hello, John!'}",
-                    "blanks": [
-                        {"placeholder": "{{parameter}}", "correct_answer": "{name}", "hint": "Use {name} as the path parameter"},
-                        {"placeholder": "{{parameter}}", "correct_answer": "name", "hint": "Use 'name' as the function parameter"},
-                        {"placeholder": "{{parameter}}", "correct_answer": "name", "hint": "Use 'name' in the f-string"}
-                    ]
-                }
-            ]
-        }
+    def _load_exercise_templates(self) -> Dict[str, Tuple[ExerciseTemplate, ...]]:
+        """Load exercise templates for different topics from the template data files"""
+        templates = {}
+        for file_name in sorted(os.listdir(TEMPLATES_DIR)):
+            if not file_name.endswith(".json"):
+                continue
+            topic = file_name[:-len(".json")]
+            with open(os.path.join(TEMPLATES_DIR, file_name), encoding="utf-8") as f:
+                templates[topic] = tuple(ExerciseTemplate.from_dict(topic, data) for data in json.load(f))
+        return templates
     
-    def generate_exercises_for_step(self, step_title: str, step_description: str, difficulty: str = "intermediate") -> List[CodingExercise]:
-        """Generate coding exercises for a specific learning step"""
-        exercises = []
+    def _build_difficulty_index(self) -> Dict[Tuple[str, Optional[str]], Tuple[ExerciseTemplate, ...]]:
+        """
+        Index templates by (topic, difficulty)
         
-        # Determine topic based on step content
-        topic = self._determine_topic(step_title, step_description)
-        
-        # Get exercises for the topic
-        topic_exercises = self.exercise_templates.get(topic, self.exercise_templates["python_basics"])
-        
-        # Filter by difficulty if specified
-        if difficulty:
-            topic_exercises = [ex for ex in topic_exercises if ex["difficulty"] == difficulty]
-        
-        # Generate 2-3 exercises per step with progressive difficulty
-        num_exercises = min(3, len(topic_exercises))
-        
-        for i in range(num_exercises):
-            exercise_data = topic_exercises[i]
-            
-            # Create progressive difficulty by adjusting blanks
+        The None difficulty key covers requests without a difficulty filter.
+        """
+        index = {}
+        for topic, templates in self.exercise_templates.items():
+            difficulties = {template.difficulty for template in templates}
+            for difficulty in difficulties | {None}:
+                index[(topic, difficulty)] = tuple(
+                    t for t in templates if difficulty is None or t.difficulty == difficulty
+                )
+        return index
+    
+    def _build_selection(self, topics: Tuple[str, ...], difficulty: Optional[str]) -> Tuple[ExerciseTemplate, ...]:
+        """Take up to three templates from the topics in order and prepare their progressive versions"""
+        templates = []
+        for topic in topics:
+            templates.extend(self._templates_by_difficulty.get((topic, difficulty), ()))
+        return self._progressive_versions(templates[:3])
+    
+    def _progressive_versions(self, templates: List[ExerciseTemplate]) -> Tuple[ExerciseTemplate, ...]:
+        """Create progressive difficulty by adjusting blanks and hints"""
+        versions = []
+        for i, template in enumerate(templates):
             if i == 0:  # First exercise - fewer blanks
-                exercise_data = self._create_beginner_version(exercise_data)
+                versions.append(self._create_beginner_version(template))
             elif i == 1:  # Second exercise - more blanks
-                exercise_data = self._create_intermediate_version(exercise_data)
+                versions.append(self._create_intermediate_version(template))
             else:  # Third exercise - most blanks
-                exercise_data = self._create_advanced_version(exercise_data)
-            
-            exercise = CodingExercise(
-                id=str(uuid.uuid4()),
-                title=exercise_data["title"],
-                description=exercise_data["description"],
-                difficulty=exercise_data["difficulty"],
-                code_template=exercise_data["code_template"],
-                solution=exercise_data["solution"],
-                hints=exercise_data["hints"],
-                validation_rules=exercise_data["validation_rules"],
-                expected_output=exercise_data.get("expected_output"),
-                test_cases=exercise_data.get("test_cases", []),
-                blanks=exercise_data.get("blanks", [])
-            )
-            exercises.append(exercise)
+                versions.append(self._create_advanced_version(template))
+        return tuple(versions)
+    
+    def generate_exercises_for_step(
+        self,
+        step_title: str,
+        step_description: str,
+        difficulty: str = "intermediate",
+        max_topics: int = 2
+    ) -> List[CodingExercise]:
+        """
+        Generate coding exercises for a specific learning step
+        
+        Exercises come from the best matching topic first; when it has fewer
+        than three exercises, the next matching topics (up to max_topics in
+        total) fill the remaining slots.
+        """
+        # Determine topics based on step content
+        topics = self._determine_topics(step_title, step_description)[:max_topics]
         
-        return exercises
+        # Generate 2-3 exercises per step with progressive difficulty
+        selected = self._select_templates(tuple(topics), difficulty or None)
+        return [template.to_exercise() for template in selected]
     
-    def _create_beginner_version(self, exercise_data: Dict) -> Dict:
+    def _create_beginner_version(self, template: ExerciseTemplate) -> ExerciseTemplate:
         """Create a beginner version with fewer blanks and more hints"""
-        beginner_data = exercise_data.copy()
-        if "blanks" in beginner_data:
-            # Keep only the first 2-3 blanks for beginners
-            beginner_data["blanks"] = beginner_data["blanks"][:2]
-            # Add more hints
-            beginner_data["hints"].extend([
-                "Take your time to understand each part",
-                "Check the syntax carefully"
-            ])
-        return beginner_data
+        # Keep only the first 2-3 blanks for beginners and add more hints
+        return replace(
+            template,
+            blanks=template.blanks[:2],
+            hints=template.hints + BEGINNER_HINTS
+        )
     
-    def _create_intermediate_version(self, exercise_data: Dict) -> Dict:
+    def _create_intermediate_version(self, template: ExerciseTemplate) -> ExerciseTemplate:
         """Create an intermediate version with more blanks"""
-        intermediate_data = exercise_data.copy()
-        if "blanks" in intermediate_data:
-            # Keep most blanks but not all
-            intermediate_data["blanks"] = intermediate_data["blanks"][:4]
-        return intermediate_data
+        # Keep most blanks but not all
+        return replace(template, blanks=template.blanks[:4])
     
-    def _create_advanced_version(self, exercise_data: Dict) -> Dict:
+    def _create_advanced_version(self, template: ExerciseTemplate) -> ExerciseTemplate:
         """Create an advanced version with all blanks and fewer hints"""
-        advanced_data = exercise_data.copy()
-        if "blanks" in advanced_data:
-            # Keep all blanks
-            advanced_data["blanks"] = advanced_data["blanks"]
-            # Remove some hints to make it more challenging
-            if len(advanced_data["hints"]) > 2:
-                advanced_data["hints"] = advanced_data["hints"][:2]
-        return advanced_data
+        # Keep all blanks and remove some hints to make it more challenging
+        return replace(template, hints=template.hints[:2])
+    
+    def _determine_topics(self, step_title: str, step_description: str) -> List[str]:
+        """Rank the topics with exercise templates by how well they match the step content"""
+        ranked = [
+            topic for topic, score in self.topic_classifier.classify(step_title + " " + step_description)
+            if score >= MIN_TOPIC_SCORE and topic in self.exercise_templates
+        ]
+        return ranked or ["python_basics"]
     
     def _determine_topic(self, step_title: str, step_description: str) -> str:
         """Determine the programming topic based on step content"""
-        content = (step_title + " " + step_description).lower()
-        
-        if any(word in content for word in ["fastapi", "api", "route", "endpoint"]):
-            return "fastapi_basics"
-        elif any(word in content for word in ["function", "def", "parameter"]):
-            return "functions"
-        elif any(word in content for word in ["list", "dictionary", "tuple", "set"]):
-            return "data_structures"
-        elif any(word in content for word in ["if", "else", "for", "while", "loop"]):
-            return "control_flow"
-        else:
-            return "python_basics"
+        return self._determine_topics(step_title, step_description)[0]
 
 # Global exercise generator instance
 exercise_generator = ExerciseGenerator()
@@ -0,0 +1,60 @@
+"""
+Exercise lookup by id for code validation
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from database.database import Exercise
+
+
+class ExerciseRegistry:
+    """Resolves exercise ids to their definitions, with an in-process LRU in front of the database"""
+
+    def __init__(self, max_size: Optional[int] = None):
+        self.max_size = max_size or int(os.getenv("EXERCISE_CACHE_SIZE", "4096"))
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, db, exercise_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get an exercise by id
+        
+        Returns the cached definition when possible; otherwise does a single
+        primary key lookup in the exercises table. Unknown ids return None.
+        """
+        with self._lock:
+            exercise = self._cache.get(exercise_id)
+            if exercise is not None:
+                self._cache.move_to_end(exercise_id)
+                self.hits += 1
+                return exercise
+            self.misses += 1
+
+        row = await db.get(Exercise, exercise_id)
+        if row is None:
+            return None
+
+        exercise = {**row.content, "id": row.id}
+        self.remember(exercise)
+        return exercise
+
+    def remember(self, exercise: Dict[str, Any]):
+        """Add an exercise to the cache, evicting the least recently used one if full"""
+        with self._lock:
+            self._cache[exercise["id"]] = exercise
+            self._cache.move_to_end(exercise["id"])
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._cache), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+# Global exercise registry instance
+exercise_registry = ExerciseRegistry()
@@ -2,18 +2,21 @@
 Learning Plan Generation Service using litellm
 """
 
+import hashlib
 import json
 import os
-from typing import Dict, Any, Optional
-from litellm import completion
+import time
+from typing import Dict, Any, List, Optional, Tuple
+from litellm import completion, completion_cost
 import sys
 import os
 
 # Add the parent directory to the path to import prompts
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from prompts import format_learning_plan_prompt
+from prompts import PLAN_INPUT_FIELDS, format_learning_plan_prompt, format_plan_update_prompt
 from services.exercise_generator import exercise_generator
+from services.model_router import ModelRouter
 from database.schemas import EnhancedLearningStepDetail
 
 class LearningPlanService:
@@ -24,6 +27,15 @@ class LearningPlanService:
         self.model = os.getenv("LITELLM_MODEL", "gpt-3.5-turbo")
         self.api_key = os.getenv("OPENAI_API_KEY") or os.getenv("LITELLM_API_KEY")
         
+        # Complexity thresholds used by estimate_complexity
+        self.advanced_stars = int(os.getenv("COMPLEXITY_ADVANCED_STARS", "1000"))
+        self.advanced_forks = int(os.getenv("COMPLEXITY_ADVANCED_FORKS", "100"))
+        self.intermediate_stars = int(os.getenv("COMPLEXITY_INTERMEDIATE_STARS", "100"))
+        self.intermediate_forks = int(os.getenv("COMPLEXITY_INTERMEDIATE_FORKS", "10"))
+        
+        # Route simple repositories to a cheaper model and complex ones to a stronger one
+        self.router = ModelRouter(self.model)
+        
         if not self.api_key:
             print("Warning: No API key found. Set OPENAI_API_KEY or LITELLM_API_KEY environment variable.")
     
@@ -41,9 +53,40 @@ class LearningPlanService:
             # Format the prompt with repository information
             prompt = format_learning_plan_prompt(repo_info)
             
-            # Generate the learning plan using litellm
+            # Route the request based on the repository complexity
+            complexity = self.estimate_complexity(repo_info)
+            route = self.router.select_route(repo_info, complexity)
+            content = self._complete(route, prompt)
+            
+            learning_plan = self._parse_plan(content)
+            if learning_plan is None:
+                # Cheap models occasionally return malformed JSON, retry once on a stronger one
+                stronger_route = self.router.escalate(route)
+                if stronger_route:
+                    content = self._complete(stronger_route, prompt)
+                    learning_plan = self._parse_plan(content)
+            
+            if learning_plan is None:
+                # Create a fallback plan if no usable JSON was returned
+                learning_plan = self._create_fallback_plan(repo_info, content)
+            
+            # Validate and clean the learning plan
+            learning_plan = self._validate_learning_plan(learning_plan, repo_info)
+            
+            return learning_plan
+            
+        except Exception as e:
+            print(f"Error generating learning plan: {e}")
+            # Return a basic fallback plan
+            return self._create_basic_plan(repo_info)
+    
+    def _complete(self, route: str, prompt: str) -> str:
+        """Run a completion on the given route and record its latency and cost"""
+        model = self.router.model_for(route)
+        start = time.perf_counter()
+        try:
             response = completion(
-                model=self.model,
+                model=model,
                 messages=[
                     {
                         "role": "system",
@@ -57,38 +100,36 @@ class LearningPlanService:
                 temperature=0.7,
                 max_tokens=2000
             )
+        except Exception:
+            self.router.record(route, time.perf_counter() - start, success=False)
+            raise
+        
+        latency = time.perf_counter() - start
+        try:
+            cost = completion_cost(completion_response=response)
+        except Exception:
+            # Pricing is unknown for some models
+            cost = 0.0
+        usage = getattr(response, "usage", None)
+        tokens = getattr(usage, "total_tokens", 0) if usage else 0
+        self.router.record(route, latency, cost=cost, tokens=tokens or 0)
+        
+        # Extract the content from the response
+        return response.choices[0].message.content
+    
+    def _parse_plan(self, content: str) -> Optional[Dict[str, Any]]:
+        """Parse the JSON plan out of a model response, or None if it is not usable"""
+        try:
+            # Find JSON content in the response (in case there's extra text)
+            start_idx = content.find('{')
+            end_idx = content.rfind('}') + 1
             
-            # Extract the content from the response
-            content = response.choices[0].message.content
-            
-            # Try to parse the JSON response
-            try:
-                # Find JSON content in the response (in case there's extra text)
-                start_idx = content.find('{')
-                end_idx = content.rfind('}') + 1
-                
-                if start_idx != -1 and end_idx != 0:
-                    json_content = content[start_idx:end_idx]
-                    learning_plan = json.loads(json_content)
-                else:
-                    # If no JSON found, create a structured response
-                    learning_plan = self._create_fallback_plan(repo_info, content)
-                
-            except json.JSONDecodeError as e:
-                print(f"JSON parsing error: {e}")
-                print(f"Raw content: {content}")
-                # Create a fallback plan if JSON parsing fails
-                learning_plan = self._create_fallback_plan(repo_info, content)
-            
-            # Validate and clean the learning plan
-            learning_plan = self._validate_learning_plan(learning_plan, repo_info)
-            
-            return learning_plan
-            
-        except Exception as e:
-            print(f"Error generating learning plan: {e}")
-            # Return a basic fallback plan
-            return self._create_basic_plan(repo_info)
+            if start_idx != -1 and end_idx != 0:
+                return json.loads(content[start_idx:end_idx])
+        except json.JSONDecodeError as e:
+            print(f"JSON parsing error: {e}")
+            print(f"Raw content: {content}")
+        return None
     
     def _create_fallback_plan(self, repo_info: Dict[str, Any], ai_content: str) -> Dict[str, Any]:
         """Create a fallback plan when JSON parsing fails"""
@@ -131,7 +172,9 @@ class LearningPlanService:
                 "Version control",
                 "Development tools"
             ],
-            "ai_generated_content": ai_content[:500] + "..." if len(ai_content) > 500 else ai_content
+            "ai_generated_content": ai_content[:500] + "..." if len(ai_content) > 500 else ai_content,
+            # Not built from the repository, so it must not be reused as its plan
+            "is_fallback": True
         }
     
     def _create_basic_plan(self, repo_info: Dict[str, Any]) -> Dict[str, Any]:
@@ -183,7 +226,8 @@ class LearningPlanService:
                 repo_info.get('language', 'Programming language'),
                 "Git",
                 "Development tools"
-            ]
+            ],
+            "is_fallback": True
         }
     
     def _validate_learning_plan(self, learning_plan: Dict[str, Any], repo_info: Dict[str, Any]) -> Dict[str, Any]:
@@ -221,24 +265,7 @@ class LearningPlanService:
                     "completed": False
                 }
             else:
-                # Ensure step has required fields
-                step["step"] = step.get("step", i + 1)
-                step["title"] = step.get("title", f"Step {i + 1}")
-                step["description"] = step.get("description", "Learning step description")
-                step["duration"] = step.get("duration", "2 hours")
-                step["resources"] = step.get("resources", [])
-                step["exercises"] = step.get("exercises", [])
-                step["completed"] = step.get("completed", False)
-                
-                # Generate coding exercises for this step
-                coding_exercises = exercise_generator.generate_exercises_for_step(
-                    step["title"], 
-                    step["description"], 
-                    learning_plan.get("difficulty_level", "intermediate")
-                )
-                step["coding_exercises"] = [ex.dict() for ex in coding_exercises]
-                step["exercises_completed"] = 0
-                step["total_exercises"] = len(coding_exercises)
+                self._clean_step(step, i, learning_plan.get("difficulty_level", "intermediate"))
         
         # Ensure other fields exist
         learning_plan["prerequisites"] = learning_plan.get("prerequisites", [])
@@ -247,16 +274,133 @@ class LearningPlanService:
         
         return learning_plan
     
+    def _clean_step(self, step: Dict[str, Any], index: int, difficulty_level: str) -> Dict[str, Any]:
+        """Fill in missing step fields and generate the step's coding exercises"""
+        # Ensure step has required fields
+        step["step"] = self._step_number(step.get("step")) or index + 1
+        step["title"] = step.get("title", f"Step {index + 1}")
+        step["description"] = step.get("description", "Learning step description")
+        step["duration"] = step.get("duration", "2 hours")
+        step["resources"] = step.get("resources", [])
+        step["exercises"] = step.get("exercises", [])
+        step["completed"] = step.get("completed", False)
+        
+        # Generate coding exercises for this step
+        coding_exercises = exercise_generator.generate_exercises_for_step(
+            step["title"], 
+            step["description"], 
+            difficulty_level
+        )
+        step["coding_exercises"] = [ex.dict() for ex in coding_exercises]
+        step["exercises_completed"] = 0
+        step["total_exercises"] = len(coding_exercises)
+        return step
+    
+    def _step_number(self, value: Any) -> Optional[int]:
+        """A model-supplied step number as a positive int, or None if it isn't one"""
+        if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+            return None
+        try:
+            number = int(value.strip() if isinstance(value, str) else value)
+        except (TypeError, ValueError):
+            return None
+        return number if number >= 1 else None
+    
+    def fingerprint_inputs(self, repo_info: Dict[str, Any]) -> Tuple[str, Dict[str, str]]:
+        """
+        Fingerprint the repository fields that feed the plan prompt
+        
+        Stars and forks only matter through the complexity tier they map to,
+        so day-to-day star counts don't invalidate a plan.
+        
+        Returns:
+            Tuple of (overall fingerprint, per-field digests)
+        """
+        inputs = {field: repo_info.get(field) for field in PLAN_INPUT_FIELDS}
+        inputs["topics"] = sorted(repo_info.get("topics") or [])
+        inputs["readme_preview"] = (repo_info.get("readme_preview") or "")[:500]
+        inputs["complexity"] = self.estimate_complexity(repo_info)
+        
+        digests = {
+            field: hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+            for field, value in inputs.items()
+        }
+        fingerprint = hashlib.sha256(json.dumps(digests, sort_keys=True).encode("utf-8")).hexdigest()
+        return fingerprint, digests
+    
+    def changed_inputs(self, old_digests: Optional[Dict[str, str]], new_digests: Dict[str, str]) -> List[str]:
+        """List the prompt inputs whose digest differs between two fingerprints"""
+        old_digests = old_digests or {}
+        return [field for field, digest in new_digests.items() if old_digests.get(field) != digest]
+    
+    def refresh_learning_plan(
+        self,
+        existing_plan: Dict[str, Any],
+        repo_info: Dict[str, Any],
+        changed_fields: List[str]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Rewrite only the steps of an existing plan affected by repository changes
+        
+        Steps the model does not return are kept as they are, including their
+        progress and exercises. Rewritten steps keep their completed flag.
+        
+        Args:
+            existing_plan: Previously generated plan dictionary
+            repo_info: Current repository information
+            changed_fields: Prompt inputs that changed since the plan was generated
+            
+        Returns:
+            The merged learning plan, or None if the model's update can't be used
+            (the caller regenerates the plan in full)
+        """
+        try:
+            prompt = format_plan_update_prompt(repo_info, existing_plan, changed_fields)
+            
+            complexity = self.estimate_complexity(repo_info)
+            route = self.router.select_route(repo_info, complexity)
+            update = self._parse_plan(self._complete(route, prompt))
+            if update is None or not isinstance(update.get("learning_steps"), list):
+                raise ValueError("Model did not return updated steps")
+        except Exception as e:
+            print(f"Incremental plan update failed: {e}")
+            return None
+        
+        difficulty_level = existing_plan.get("difficulty_level", "intermediate")
+        steps_by_number = {step["step"]: step for step in existing_plan.get("learning_steps", [])}
+        
+        for updated_step in update["learning_steps"]:
+            if not isinstance(updated_step, dict):
+                continue
+            if "step" in updated_step:
+                number = self._step_number(updated_step["step"])
+                if number is None:
+                    print(f"Skipping updated step with invalid number: {updated_step['step']!r}")
+                    continue
+            else:
+                number = max(steps_by_number, default=0) + 1
+            updated_step["step"] = number
+            previous = steps_by_number.get(number)
+            if previous is not None:
+                updated_step["completed"] = previous.get("completed", False)
+            steps_by_number[number] = self._clean_step(updated_step, number - 1, difficulty_level)
+        
+        merged = dict(existing_plan)
+        merged["learning_steps"] = [steps_by_number[number] for number in sorted(steps_by_number)]
+        for field in ("title", "description", "estimated_duration", "prerequisites", "learning_objectives", "technologies_covered"):
+            if update.get(field):
+                merged[field] = update[field]
+        return merged
+    
     def estimate_complexity(self, repo_info: Dict[str, Any]) -> str:
         """Estimate repository complexity based on various factors"""
         stars = repo_info.get('stars', 0)
         forks = repo_info.get('forks', 0)
-        size = repo_info.get('size', 0)
         
         # Simple complexity estimation
-        if stars > 1000 and forks > 100:
+        if stars > self.advanced_stars and forks > self.advanced_forks:
             return "advanced"
-        elif stars > 100 or forks > 10:
+        elif stars > self.intermediate_stars or forks > self.intermediate_forks:
             return "intermediate"
         else:
             return "beginner"
@@ -0,0 +1,97 @@
+"""
+Model routing for learning plan generation
+"""
+
+import math
+import os
+import statistics
+import threading
+from collections import deque
+from typing import Dict, Any, Optional
+
+
+class RouteStats:
+    """Latency and cost counters for a single model route"""
+
+    def __init__(self, window: int = 500):
+        self.requests = 0
+        self.failures = 0
+        self.total_cost = 0.0
+        self.total_tokens = 0
+        # Keep a bounded window of recent latencies for the percentiles
+        self.latencies = deque(maxlen=window)
+
+    def snapshot(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "median_latency_seconds": round(statistics.median(latencies), 3) if latencies else None,
+            "p95_latency_seconds": round(latencies[math.ceil(0.95 * len(latencies)) - 1], 3) if latencies else None,
+            "total_cost_usd": round(self.total_cost, 6),
+            "average_cost_usd": round(self.total_cost / self.requests, 6) if self.requests else None,
+            "total_tokens": self.total_tokens
+        }
+
+
+class ModelRouter:
+    """Chooses the model used for a plan based on repository complexity"""
+
+    # Complexity tier -> route name
+    TIER_ROUTES = {
+        "beginner": "fast",
+        "intermediate": "default",
+        "advanced": "strong"
+    }
+
+    def __init__(self, default_model: str):
+        self.routes = {
+            "fast": os.getenv("LITELLM_MODEL_FAST", default_model),
+            "default": default_model,
+            "strong": os.getenv("LITELLM_MODEL_STRONG", default_model)
+        }
+        # Repositories smaller than this (in KB) always take the fast route.
+        # GitHub reports size 0 when unknown, so 0 never counts as small.
+        self.small_repo_size_kb = int(os.getenv("ROUTING_SMALL_REPO_KB", "1000"))
+        self._stats = {route: RouteStats() for route in self.routes}
+        self._lock = threading.Lock()
+
+    def select_route(self, repo_info: Dict[str, Any], complexity: str) -> str:
+        """Pick a route name for a repository and its estimated complexity"""
+        route = self.TIER_ROUTES.get(complexity, "default")
+
+        size = repo_info.get("size") or 0
+        if route != "strong" and 0 < size < self.small_repo_size_kb:
+            route = "fast"
+
+        return route
+
+    def escalate(self, route: str) -> Optional[str]:
+        """Return the next stronger route, or None if there is nothing stronger"""
+        order = ["fast", "default", "strong"]
+        for candidate in order[order.index(route) + 1:]:
+            if self.routes[candidate] != self.routes[route]:
+                return candidate
+        return None
+
+    def model_for(self, route: str) -> str:
+        return self.routes[route]
+
+    def record(self, route: str, latency: float, cost: float = 0.0, tokens: int = 0, success: bool = True):
+        """Record the outcome of one completion call on a route"""
+        with self._lock:
+            stats = self._stats[route]
+            stats.requests += 1
+            stats.latencies.append(latency)
+            stats.total_cost += cost
+            stats.total_tokens += tokens
+            if not success:
+                stats.failures += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-route latency and cost summary"""
+        with self._lock:
+            return {
+                route: {"model": self.routes[route], **stats.snapshot()}
+                for route, stats in self._stats.items()
+            }
@@ -0,0 +1,142 @@
+"""
+Performance budgets for exercises graded on efficiency
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+DEFAULT_TIME_FACTOR = 3.0
+DEFAULT_MEMORY_FACTOR = 2.0
+DEFAULT_REPEAT = 3
+
+# Budgets never go below the reference plus this, so tiny programs aren't graded on timer noise
+TIME_SLACK_SECONDS = 0.005
+MEMORY_SLACK_BYTES = 64 * 1024
+
+# tracemalloc makes allocation-heavy code this many times slower
+TRACED_RUN_COST = 25
+
+# Score penalty for each budget a correct submission goes over
+BUDGET_PENALTY = 30
+
+
+@dataclass
+class PerformanceMetrics:
+    """What one program cost to run, as measured in the sandbox"""
+    cpu_seconds: Optional[float] = None  # Fastest of the timed runs
+    wall_seconds: Optional[float] = None
+    peak_memory_bytes: Optional[int] = None  # Traced by tracemalloc in a separate run
+    retained_blocks: Optional[int] = None  # Memory blocks still allocated when the run finished
+    error: Optional[str] = None
+    timed_out: bool = False  # Stopped for going over the CPU budget before it finished
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "PerformanceMetrics":
+        return cls(**{key: data[key] for key in cls.__dataclass_fields__ if key in data})
+
+    def to_dict(self) -> Dict:
+        return {
+            "cpu_seconds": self.cpu_seconds,
+            "wall_seconds": self.wall_seconds,
+            "peak_memory_bytes": self.peak_memory_bytes,
+            "retained_blocks": self.retained_blocks,
+            "error": self.error,
+            "timed_out": self.timed_out
+        }
+
+
+@dataclass
+class PerformanceReport:
+    """A submission's measurements next to the reference solution's and the budgets derived from them"""
+    submission: PerformanceMetrics
+    reference: PerformanceMetrics
+    budgets: Dict[str, float] = field(default_factory=dict)  # "cpu_seconds", "peak_memory_bytes"
+    exceeded: List[str] = field(default_factory=list)  # Budgets the submission went over
+
+    @property
+    def within_budget(self) -> bool:
+        return not self.exceeded
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "PerformanceReport":
+        return cls(
+            submission=PerformanceMetrics.from_dict(data["submission"]),
+            reference=PerformanceMetrics.from_dict(data["reference"]),
+            budgets=data.get("budgets", {}),
+            exceeded=data.get("exceeded", [])
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            "submission": self.submission.to_dict(),
+            "reference": self.reference.to_dict(),
+            "budgets": self.budgets,
+            "exceeded": self.exceeded,
+            "within_budget": self.within_budget
+        }
+
+
+def measurement_spec(exercise: Dict, reference: Optional[PerformanceMetrics] = None) -> Dict:
+    """
+    The sandbox measure job for an exercise's `performance` settings
+
+    With an earlier reference measurement, the submission is stopped once
+    it is over its CPU budget instead of being measured to the end.
+    """
+    performance = exercise.get("performance") or {}
+    spec = {"reference": exercise.get("solution", ""), "repeat": int(performance.get("repeat", DEFAULT_REPEAT))}
+    for key in ("function", "args", "kwargs"):
+        if key in performance:
+            spec[key] = performance[key]
+    if reference is not None and reference.cpu_seconds is not None:
+        spec["cpu_limit"] = budgets_for(reference, performance)["cpu_seconds"]
+    return spec
+
+
+def budgets_for(reference: PerformanceMetrics, performance: Dict) -> Dict[str, float]:
+    """Budgets scaled from the reference solution's measurements"""
+    time_factor = float(performance.get("time_factor", DEFAULT_TIME_FACTOR))
+    memory_factor = float(performance.get("memory_factor", DEFAULT_MEMORY_FACTOR))
+    return {
+        "cpu_seconds": max(reference.cpu_seconds * time_factor, reference.cpu_seconds + TIME_SLACK_SECONDS),
+        "peak_memory_bytes": max(
+            reference.peak_memory_bytes * memory_factor, reference.peak_memory_bytes + MEMORY_SLACK_BYTES
+        )
+    }
+
+
+def measurement_timeout(reference: PerformanceMetrics, performance: Dict, default: float) -> float:
+    """
+    Time limit for a measurement job, from an earlier measurement of the reference
+
+    Covers the reference's runs plus the submission's runs at the edge of its
+    time budget, counting a traced run as TRACED_RUN_COST timed runs; never
+    more than the default limit.
+    """
+    if reference.wall_seconds is None:
+        return default
+    repeat = int(performance.get("repeat", DEFAULT_REPEAT))
+    time_factor = float(performance.get("time_factor", DEFAULT_TIME_FACTOR))
+    per_run = reference.wall_seconds * (1 + max(time_factor, 1.0)) + TIME_SLACK_SECONDS
+    return min(default, 1.0 + 2 * (repeat + TRACED_RUN_COST) * per_run)
+
+
+def grade(measurements: List[Dict], performance: Dict) -> Optional[PerformanceReport]:
+    """Compare the submission (first) with the reference (second); None if the reference couldn't be measured"""
+    submission, reference = (PerformanceMetrics.from_dict(data) for data in measurements[:2])
+    if reference.error is not None or reference.cpu_seconds is None or reference.peak_memory_bytes is None:
+        return None
+    report = PerformanceReport(submission, reference, budgets_for(reference, performance))
+    if submission.error is not None:
+        report.exceeded = list(report.budgets)
+        return report
+    # Memory isn't measured for a submission stopped for going over its CPU budget
+    if (
+        submission.timed_out
+        or submission.peak_memory_bytes is None
+        or submission.cpu_seconds > report.budgets["cpu_seconds"]
+    ):
+        report.exceeded.append("cpu_seconds")
+    if submission.peak_memory_bytes is not None and submission.peak_memory_bytes > report.budgets["peak_memory_bytes"]:
+        report.exceeded.append("peak_memory_bytes")
+    return report
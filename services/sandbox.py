@@ -0,0 +1,421 @@
+"""
+Pool of pre-started sandbox workers for running code submissions
+"""
+
+import asyncio
+import atexit
+import json
+import os
+import queue
+import selectors
+import signal
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterable, List, Optional
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox_worker.py")
+
+# Extra time the pool waits for a worker reply beyond the job timeout before giving up on it
+REPLY_GRACE_SECONDS = 2.0
+
+# What a test case or route is checked against; kept in the pool, never sent to the submission
+EXPECTED_KEYS = ("expected", "expected_output", "status")
+
+
+@dataclass
+class SandboxResult:
+    returncode: int
+    stdout: str
+    stderr: str
+    timed_out: bool = False
+    duration: float = 0.0
+    tests: Optional[List[dict]] = None  # Per-case (or per-route) results for test runs (None if the run never finished)
+    test_error: Optional[str] = None
+    limit_exceeded: Optional[str] = None  # "cpu" or "output" when the run was stopped by a limit
+    output_matches: Optional[bool] = None  # Compared with expected_output, if one was given
+    output_mismatch_line: Optional[int] = None  # First line that differs (the run stops there)
+    measurements: Optional[List[dict]] = None  # Submission and reference metrics for measurement runs
+
+
+class SandboxError(Exception):
+    """Raised when a sandbox worker crashes or stops responding"""
+    pass
+
+
+class SandboxWorker:
+    """A warm worker process that runs jobs sent over its stdin pipe"""
+
+    def __init__(self, preload: Iterable[str]):
+        self.process = subprocess.Popen(
+            [sys.executable, "-u", WORKER_SCRIPT, *preload],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            # Submissions must not see API keys or other server configuration
+            env={"PATH": os.environ.get("PATH", ""), "PYTHONDONTWRITEBYTECODE": "1"},
+            cwd=os.path.dirname(WORKER_SCRIPT),
+            # Own process group, so killing the worker also kills a running child
+            start_new_session=(os.name == "posix")
+        )
+        self.runs = 0
+        self._buffer = b""
+        # The forked child running the current job, in its own process group
+        self.child_pid: Optional[int] = None
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def run(self, job: dict, reply_timeout: float, on_event: Optional[Callable[[dict], None]] = None) -> dict:
+        """Send a job and wait for its result"""
+        self._send(job)
+        deadline = time.monotonic() + reply_timeout
+        while True:
+            reply = self._parse_reply(self._read_line(deadline))
+            if not self._handle_event(reply, on_event):
+                return reply
+
+    async def run_async(
+        self, job: dict, reply_timeout: float, on_event: Optional[Callable[[dict], None]] = None
+    ) -> dict:
+        """Send a job and wait for its result without blocking the event loop"""
+        self._send(job)
+
+        async def read_reply() -> dict:
+            while True:
+                reply = self._parse_reply(await self._read_line_async())
+                if not self._handle_event(reply, on_event):
+                    return reply
+
+        try:
+            return await asyncio.wait_for(read_reply(), reply_timeout)
+        except asyncio.TimeoutError:
+            raise SandboxError("Worker did not reply in time")
+
+    def _handle_event(self, reply: dict, on_event: Optional[Callable[[dict], None]]) -> bool:
+        """Handle an event line sent before the result; False if this is the result"""
+        if "event" not in reply:
+            self.child_pid = None
+            return False
+        if reply["event"] == "started":
+            self.child_pid = reply.get("pid")
+        elif on_event is not None:
+            on_event(reply)
+        return True
+
+    def _send(self, job: dict):
+        try:
+            self.process.stdin.write(json.dumps(job).encode("utf-8") + b"\n")
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise SandboxError(f"Worker is not accepting jobs: {e}")
+        self.runs += 1
+
+    def _parse_reply(self, line: bytes) -> dict:
+        reply = json.loads(line)
+        if "error" in reply:
+            raise SandboxError(reply["error"])
+        return reply
+
+    def _read_line(self, deadline: float) -> bytes:
+        fd = self.process.stdout.fileno()
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_READ)
+            while b"\n" not in self._buffer:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not selector.select(remaining):
+                    raise SandboxError("Worker did not reply in time")
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    raise SandboxError("Worker exited unexpectedly")
+                self._buffer += chunk
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        return line
+
+    async def _read_line_async(self) -> bytes:
+        """Read one reply line, waking up only when the worker's stdout is readable"""
+        loop = asyncio.get_running_loop()
+        fd = self.process.stdout.fileno()
+        while b"\n" not in self._buffer:
+            readable = loop.create_future()
+            loop.add_reader(fd, readable.set_result, None)
+            try:
+                await readable
+            finally:
+                loop.remove_reader(fd)
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise SandboxError("Worker exited unexpectedly")
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        return line
+
+    def kill(self):
+        try:
+            if os.name == "posix":
+                if self.child_pid is not None:
+                    # The job's child has its own group and would otherwise run on until its limits
+                    try:
+                        os.killpg(self.child_pid, signal.SIGKILL)
+                    except (ProcessLookupError, PermissionError):
+                        pass
+                os.killpg(self.process.pid, signal.SIGKILL)
+            else:
+                self.process.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+        self.process.wait()
+        for stream in (self.process.stdin, self.process.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+
+class SandboxPool:
+    """
+    Fixed-size pool of warm sandbox workers
+
+    Workers import the preload modules once at startup. A worker is replaced
+    after max_runs jobs, or straight away if it crashes, times out or reports
+    that its state may be dirty. Replacements start in the background so the
+    caller never waits for interpreter startup. The pool starts on first use.
+    """
+
+    def __init__(self, preload: Iterable[str] = (), size: Optional[int] = None, max_runs: Optional[int] = None):
+        self.preload: List[str] = sorted(preload)
+        self.size = size or int(os.getenv("SANDBOX_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+        self.max_runs = max_runs or int(os.getenv("SANDBOX_MAX_RUNS", "100"))
+        # Applied with setrlimit in each job's child process
+        self.limits = {
+            "memory_bytes": int(os.getenv("SANDBOX_MEMORY_MB", "512")) * 1024 * 1024,
+            "open_files": int(os.getenv("SANDBOX_OPEN_FILES", "32")),
+            "output_bytes": int(os.getenv("SANDBOX_OUTPUT_KB", "64")) * 1024,
+            "file_size_bytes": 0
+        }
+        self._idle: "queue.Queue[SandboxWorker]" = queue.Queue()
+        self._workers: List[SandboxWorker] = []
+        self._lock = threading.Lock()
+        self._started = False
+        self._closed = False
+
+    def start(self):
+        """Start all workers (called automatically on first run)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for _ in range(self.size):
+                self._idle.put(self._spawn())
+        atexit.register(self.shutdown)
+
+    def run(
+        self,
+        code: str,
+        timeout: float = 10.0,
+        tests: Optional[List[dict]] = None,
+        expected_output: Optional[str] = None,
+        measure: Optional[dict] = None,
+        routes: Optional[List[dict]] = None,
+        on_output: Optional[Callable[[str, str], None]] = None
+    ) -> SandboxResult:
+        """
+        Run code in a pooled worker, blocking until a worker is free
+        
+        With tests, every test case runs in the same child with a fresh
+        namespace and its own time limit, and the result carries the
+        per-case results. With expected_output, stdout is compared while the
+        program runs and it is stopped at the first line that differs. With
+        measure ({"reference": code, "repeat": n, "function": ...}), the
+        reference and then the code are timed and traced, each in its own
+        child, and the result carries both measurements. With routes ({"path": "/hello",
+        "expected": {...}}), the code must define a FastAPI app; each route is
+        requested through a test client and reported in tests, with its latency
+        as the duration. With on_output, on_output(stream, line) is called for
+        each line the program prints to "stdout" or "stderr" while it runs.
+        """
+        if not self._started:
+            self.start()
+
+        worker = self._idle.get()
+        try:
+            reply = worker.run(
+                self._job(code, timeout, tests, expected_output, measure, routes, stream=on_output is not None),
+                timeout + REPLY_GRACE_SECONDS,
+                self._output_events(on_output)
+            )
+        except SandboxError:
+            reply = None
+        except BaseException:
+            self._retire(worker)
+            raise
+        return self._finish(worker, reply, timeout, tests, routes)
+
+    async def run_async(
+        self,
+        code: str,
+        timeout: float = 10.0,
+        tests: Optional[List[dict]] = None,
+        expected_output: Optional[str] = None,
+        measure: Optional[dict] = None,
+        routes: Optional[List[dict]] = None,
+        on_output: Optional[Callable[[str, str], None]] = None
+    ) -> SandboxResult:
+        """Run code in a pooled worker from async code, without blocking the event loop"""
+        if not self._started:
+            await asyncio.to_thread(self.start)
+
+        try:
+            worker = self._idle.get_nowait()
+        except queue.Empty:
+            # All workers busy or being replaced: wait in a thread rather than on the loop
+            waiting = asyncio.ensure_future(asyncio.to_thread(self._idle.get))
+            try:
+                worker = await asyncio.shield(waiting)
+            except asyncio.CancelledError:
+                # The thread still takes a worker; hand it back once it does
+                waiting.add_done_callback(lambda done: self._idle.put(done.result()))
+                raise
+        try:
+            reply = await worker.run_async(
+                self._job(code, timeout, tests, expected_output, measure, routes, stream=on_output is not None),
+                timeout + REPLY_GRACE_SECONDS,
+                self._output_events(on_output)
+            )
+        except SandboxError:
+            reply = None
+        except BaseException:
+            # Cancelled mid-job: the worker's reply would be read by the next caller
+            self._retire(worker)
+            raise
+        return self._finish(worker, reply, timeout, tests, routes)
+
+    def _job(
+        self,
+        code: str,
+        timeout: float,
+        tests: Optional[List[dict]],
+        expected_output: Optional[str] = None,
+        measure: Optional[dict] = None,
+        routes: Optional[List[dict]] = None,
+        stream: bool = False
+    ) -> dict:
+        job = {"code": code, "timeout": timeout, "limits": self.limits}
+        if stream:
+            job["stream"] = True
+        if expected_output is not None:
+            job["expected_output"] = expected_output
+        if measure is not None:
+            job["measure"] = measure
+        if routes is not None:
+            job["routes"] = [self._without_expected(route) for route in routes]
+            job["case_timeout"] = timeout * 0.9 / max(1, len(routes))
+        if tests is not None:
+            job["tests"] = [self._without_expected(case) for case in tests]
+            # Share the time budget between the cases unless a case sets its own limit, leaving
+            # some headroom so a slow case is reported on its own rather than killing the whole run
+            job["case_timeout"] = timeout * 0.9 / max(1, len(tests))
+        return job
+
+    @staticmethod
+    def _without_expected(case: dict) -> dict:
+        return {key: value for key, value in case.items() if key not in EXPECTED_KEYS}
+
+    @staticmethod
+    def _grade(cases: List[dict], results, routes: bool) -> Optional[List[dict]]:
+        """
+        Decide which test cases (or routes) passed from what the child reported
+
+        Only the outcome comes from the child, which also ran the submission;
+        anything it claims beyond that, like extra results, is dropped.
+        """
+        if not isinstance(results, list) or not all(isinstance(result, dict) for result in results):
+            return None
+        graded = []
+        for case, result in zip(cases, results):
+            result = dict(result, passed=False)
+            if result.get("error") is None and routes:
+                expected_status = int(case.get("status", 200))
+                if result.get("status") != expected_status:
+                    result["error"] = f"Responded with status {result.get('status')}, expected {expected_status}"
+            if result.get("error") is None:
+                passed = "expected" not in case or result.get("actual") == case["expected"]
+                if "expected_output" in case:
+                    passed = passed and str(result.get("stdout", "")).strip() == str(case["expected_output"]).strip()
+                result["passed"] = passed
+            graded.append(result)
+        return graded
+
+    @staticmethod
+    def _output_events(on_output: Optional[Callable[[str, str], None]]) -> Optional[Callable[[dict], None]]:
+        if on_output is None:
+            return None
+
+        def on_event(event: dict):
+            if event.get("event") == "output":
+                on_output(event["stream"], event["line"])
+        return on_event
+
+    def _finish(
+        self,
+        worker: SandboxWorker,
+        reply: Optional[dict],
+        timeout: float,
+        tests: Optional[List[dict]] = None,
+        routes: Optional[List[dict]] = None
+    ) -> SandboxResult:
+        """Return the worker to the pool (or replace it), check test results and build the result"""
+        recycle = reply is None or reply.get("recycle", False) or worker.runs >= self.max_runs
+        if recycle or not worker.alive():
+            self._retire(worker)
+        else:
+            self._idle.put(worker)
+
+        if reply is None:
+            # A worker that stopped responding is treated like a timed out submission
+            return SandboxResult(returncode=-signal.SIGKILL, stdout="", stderr="", timed_out=True, duration=timeout)
+        cases = tests if tests is not None else routes
+        results = reply.get("tests")
+        if cases is not None and results is not None:
+            results = self._grade(cases, results, routes=tests is None)
+        return SandboxResult(
+            returncode=reply["returncode"],
+            stdout=reply["stdout"],
+            stderr=reply["stderr"],
+            timed_out=reply["timed_out"],
+            duration=reply["duration"],
+            tests=results,
+            test_error=reply.get("test_error"),
+            limit_exceeded=reply.get("limit_exceeded"),
+            output_matches=reply.get("output_matches"),
+            output_mismatch_line=reply.get("output_mismatch_line"),
+            measurements=reply.get("measurements")
+        )
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.kill()
+
+    def _spawn(self) -> SandboxWorker:
+        worker = SandboxWorker(self.preload)
+        self._workers.append(worker)
+        return worker
+
+    def _retire(self, worker: SandboxWorker):
+        """Kill a worker and start its replacement in the background"""
+        def replace():
+            worker.kill()
+            with self._lock:
+                if worker in self._workers:
+                    self._workers.remove(worker)
+                if self._closed:
+                    return
+                replacement = self._spawn()
+            self._idle.put(replacement)
+
+        threading.Thread(target=replace, daemon=True).start()
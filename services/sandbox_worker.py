@@ -0,0 +1,836 @@
+#!/usr/bin/env python3
+"""
+Sandbox worker process for running code submissions
+
+Started by services.sandbox.SandboxPool, never imported by the API. The worker
+imports the preload modules given on the command line once, then reads one
+JSON job per line from stdin and writes one JSON result per line to stdout.
+
+On POSIX every job runs in a child forked from this warm interpreter, so it
+starts with the preloaded modules already imported and cannot leave state
+behind for the next job. Elsewhere the job runs in-process and the worker
+asks to be recycled afterwards.
+
+A job is either a plain run ({"code": ...}) or a test run ({"code": ...,
+"tests": [...]}), where every test case runs in the same child, each with a
+fresh namespace, its own stdin and captured stdout, and its own time limit.
+Test and route runs report what the submission did (return value, output,
+status code) without the expected values, which the pool keeps and checks:
+the submission runs in the child and could tamper with anything there.
+A plain run may carry "expected_output": stdout is then compared with it as
+it is read, and the child is killed as soon as the output diverges. A
+measurement run ({"code": ..., "measure": {"reference": ...}}) times the
+reference solution in one child, then the submission in another, and
+reports their CPU time, wall time and memory use. A route run ({"code": ...,
+"routes": [...]}) runs the submission once, then sends each request to the
+web app it defines through FastAPI's test client (preloaded by the pool)
+and reports every route's response and latency like a test case.
+
+Before a job's result the worker may write event lines ({"event": ...}):
+"started" with the child's pid once it is forked, and, for jobs with
+"stream": true, "output" for each line the program prints, as it prints it.
+"""
+
+import builtins
+import codecs
+import importlib
+import io
+import json
+import os
+import selectors
+import signal
+import sys
+import time
+import traceback
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+READ_CHUNK = 65536
+DEFAULT_OUTPUT_LIMIT = 65536
+POLL_INTERVAL = 0.05
+EXIT_POLL_INTERVAL = 0.001
+DRAIN_TIMEOUT = 1.0
+# Output allowed beyond the expected output (blank lines, a traceback) before a run is stopped
+EXPECTED_OUTPUT_SLACK = 4096
+
+# File descriptors of the pool protocol, closed in every child so submissions can't reach them
+PROTOCOL_FDS = []
+
+
+def execute_submission(code: str) -> int:
+    """Run submission code as __main__ and return its exit code"""
+    namespace = {"__name__": "__main__", "__builtins__": builtins}
+    try:
+        exec(compile(code, "<submission>", "exec"), namespace)
+        return 0
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        return e.code if isinstance(e.code, int) else 1
+    except BaseException as e:
+        # Only show the submission's own frames, not the worker's
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename != "<submission>":
+            tb = tb.tb_next
+        traceback.print_exception(type(e), e, tb)
+        return 1
+
+
+class OutputLimitExceeded(BaseException):
+    """Raised when a test case prints more than the output limit"""
+
+
+class LimitedOutput(io.StringIO):
+    """In-memory stdout for a test case that refuses to grow past a limit"""
+
+    # Set in the child of a streamed job: captured output is also copied here as it is written
+    echo = None
+
+    def __init__(self, limit: int):
+        super().__init__()
+        self.limit = limit
+        self.size = 0
+
+    def write(self, text: str) -> int:
+        self.size += len(text)
+        if self.size > self.limit:
+            raise OutputLimitExceeded()
+        if self.echo is not None:
+            self.echo.write(text)
+        return super().write(text)
+
+
+def apply_limits(limits: dict, timeout: float):
+    """Cap CPU time, memory, open files and file writes for the current (child) process"""
+    if resource is None:
+        return
+
+    def cap(kind, value):
+        _, hard = resource.getrlimit(kind)
+        if hard != resource.RLIM_INFINITY:
+            value = min(value, hard)
+        resource.setrlimit(kind, (value, value))
+
+    # CPU time can't exceed wall time, so this only catches runaway work the wall timer missed
+    cap(resource.RLIMIT_CPU, int(limits.get("cpu_seconds") or timeout) + 1)
+    if limits.get("memory_bytes"):
+        cap(resource.RLIMIT_AS, int(limits["memory_bytes"]))
+    if limits.get("open_files"):
+        cap(resource.RLIMIT_NOFILE, int(limits["open_files"]))
+    # No file writes at all; with SIGXFSZ ignored a write fails with an error instead of killing the child
+    signal.signal(signal.SIGXFSZ, signal.SIG_IGN)
+    cap(resource.RLIMIT_FSIZE, int(limits.get("file_size_bytes", 0)))
+
+
+class CaseTimeout(BaseException):
+    """Raised inside a test case when it runs past its time limit (not catchable by `except Exception`)"""
+
+
+def _on_case_timeout(signum, frame):
+    raise CaseTimeout()
+
+
+def _jsonable(value, dumps=json.dumps, loads=json.loads):
+    """Convert a return value to what it would look like in a JSON test case (tuples become lists)"""
+    return loads(dumps(value, default=repr))
+
+
+def _describe_error(error: BaseException) -> str:
+    return "".join(traceback.format_exception_only(type(error), error)).strip()
+
+
+def run_test_case(program, case: dict, case_timeout: float, output_limit: int, real_stdout) -> dict:
+    """Run one test case against the compiled submission; the pool decides whether it passed"""
+    result = {"name": case.get("name"), "error": None, "timed_out": False}
+    stdout = LimitedOutput(output_limit)
+    call_stdout = LimitedOutput(output_limit)
+    sys.stdin = io.StringIO(case.get("input", ""))
+    namespace = {"__name__": "__main__", "__builtins__": builtins}
+    use_timer = hasattr(signal, "setitimer")
+    start = time.perf_counter()
+    try:
+        if use_timer:
+            signal.setitimer(signal.ITIMER_REAL, float(case.get("timeout", case_timeout)))
+        sys.stdout = stdout
+        exec(program, namespace)
+        if case.get("function"):
+            # Only the call's own output counts for expected_output
+            sys.stdout = call_stdout
+            actual = namespace[case["function"]](*case.get("args", []), **case.get("kwargs", {}))
+            result["actual"] = _jsonable(actual)
+            stdout = call_stdout
+    except CaseTimeout:
+        result["timed_out"] = True
+        result["error"] = "Test case timed out"
+    except OutputLimitExceeded:
+        result["error"] = f"Output limit exceeded ({output_limit} characters)"
+    except MemoryError:
+        result["error"] = "Memory limit exceeded"
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            result["error"] = f"SystemExit: {e.code}"
+    except KeyError as e:
+        if case.get("function") and case["function"] not in namespace:
+            result["error"] = f"Function {case['function']}() is not defined"
+        else:
+            result["error"] = _describe_error(e)
+    except BaseException as e:
+        result["error"] = _describe_error(e)
+    finally:
+        if use_timer:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        sys.stdout = real_stdout
+    result["duration"] = time.perf_counter() - start
+    result["stdout"] = stdout.getvalue()
+    return result
+
+
+def run_test_cases(
+    code: str, tests: list, case_timeout: float, output_limit: int, send, run_case=run_test_case
+) -> int:
+    """Run all test cases in this process and send their results"""
+    real_stdout = sys.stdout
+    try:
+        program = compile(code, "<submission>", "exec")
+    except SyntaxError as e:
+        send({"error": _describe_error(e)})
+        return 1
+    if hasattr(signal, "SIGALRM"):
+        signal.signal(signal.SIGALRM, _on_case_timeout)
+    # run_case is bound before the submission runs, which could replace the global
+    results = [run_case(program, case, case_timeout, output_limit, real_stdout) for case in tests]
+    send({"tests": results})
+    return 0
+
+
+def _find_app(namespace: dict, name: str):
+    """The ASGI app a submission defines: the given name, else the only FastAPI instance"""
+    if callable(namespace.get(name)):
+        return namespace[name]
+    fastapi = sys.modules.get("fastapi")
+    if fastapi is not None:
+        apps = [value for value in namespace.values() if isinstance(value, fastapi.FastAPI)]
+        if len(apps) == 1:
+            return apps[0]
+    return None
+
+
+def run_route_check(client, route: dict, case_timeout: float, output_limit: int, real_stdout) -> dict:
+    """Send one request to the submitted app and record the response; the pool checks it"""
+    method = route.get("method", "GET").upper()
+    result = {"name": route.get("name") or f"{method} {route['path']}", "error": None, "timed_out": False}
+    request = {key: route[key] for key in ("params", "json", "headers") if key in route}
+    stdout = LimitedOutput(output_limit)
+    use_timer = hasattr(signal, "setitimer")
+    start = time.perf_counter()
+    try:
+        if use_timer:
+            signal.setitimer(signal.ITIMER_REAL, float(route.get("timeout", case_timeout)))
+        sys.stdout = stdout
+        response = client.request(method, route["path"], **request)
+    except CaseTimeout:
+        result["timed_out"] = True
+        result["error"] = "Request timed out"
+    except OutputLimitExceeded:
+        result["error"] = f"Output limit exceeded ({output_limit} characters)"
+    except BaseException as e:
+        result["error"] = _describe_error(e)
+    finally:
+        if use_timer:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        sys.stdout = real_stdout
+    result["duration"] = time.perf_counter() - start
+    result["stdout"] = stdout.getvalue()
+    if result["error"] is not None:
+        return result
+
+    result["status"] = response.status_code
+    try:
+        result["actual"] = response.json()
+    except ValueError:
+        result["actual"] = response.text
+    return result
+
+
+def run_route_checks(
+    code: str, routes: list, app_name: str, case_timeout: float, output_limit: int, send, run_check=run_route_check
+) -> int:
+    """Define the submitted app once, request every route and send the results"""
+    real_stdout = sys.stdout
+    use_timer = hasattr(signal, "setitimer")
+    if use_timer:
+        signal.signal(signal.SIGALRM, _on_case_timeout)
+    namespace = {"__name__": "__main__", "__builtins__": builtins}
+    sys.stdout = LimitedOutput(output_limit)
+    try:
+        if use_timer:
+            signal.setitimer(signal.ITIMER_REAL, case_timeout)
+        exec(compile(code, "<submission>", "exec"), namespace)
+        app = _find_app(namespace, app_name)
+        if app is None:
+            raise LookupError(f"No web app named '{app_name}' was defined")
+        from fastapi.testclient import TestClient
+        # One client (and event loop thread) for all routes; the child exits without shutting it down
+        client = TestClient(app).__enter__()
+    except CaseTimeout:
+        send({"error": "Defining the app timed out"})
+        return 1
+    except BaseException as e:
+        send({"error": _describe_error(e)})
+        return 1
+    finally:
+        if use_timer:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        sys.stdout = real_stdout
+
+    results = []
+    for route in routes:
+        result = run_check(client, route, case_timeout, output_limit, real_stdout)
+        results.append(result)
+        if result["timed_out"]:
+            # The request may still be running in the client's event loop, so don't send more
+            break
+    send({"tests": results})
+    return 0
+
+
+def _measured_call(program, spec: dict):
+    """What a measurement times: the whole program, or one function call after running the program"""
+    if not spec.get("function"):
+        return lambda: exec(program, {"__name__": "__main__", "__builtins__": builtins})
+    namespace = {"__name__": "__main__", "__builtins__": builtins}
+    exec(program, namespace)
+    function = namespace[spec["function"]]
+    args, kwargs = spec.get("args", []), spec.get("kwargs", {})
+    return lambda: function(*args, **kwargs)
+
+
+def _measure_once(
+    program,
+    spec: dict,
+    output_limit: int,
+    traced: bool,
+    real_stdout,
+    clocks=(time.process_time, time.perf_counter),
+    tracer=(tracemalloc.start, tracemalloc.get_traced_memory, tracemalloc.take_snapshot, tracemalloc.stop)
+) -> dict:
+    """
+    One run with stdout discarded; traced runs record memory, untraced runs record time
+
+    The clocks and tracer are bound when the worker starts, so a submission
+    replacing time.process_time or tracemalloc's functions doesn't change
+    what it is measured with.
+    """
+    process_time, perf_counter = clocks
+    start_tracing, traced_memory, take_snapshot, stop_tracing = tracer
+    sys.stdout = LimitedOutput(output_limit)
+    try:
+        call = _measured_call(program, spec)
+        if traced:
+            start_tracing()
+            try:
+                call()
+                _, peak = traced_memory()
+                snapshot = take_snapshot()
+            finally:
+                stop_tracing()
+            return {
+                "peak_memory_bytes": peak,
+                "retained_blocks": sum(stat.count for stat in snapshot.statistics("filename"))
+            }
+        cpu_start, wall_start = process_time(), perf_counter()
+        call()
+        return {"cpu_seconds": process_time() - cpu_start, "wall_seconds": perf_counter() - wall_start}
+    finally:
+        sys.stdout = real_stdout
+
+
+def run_measurements(programs: list, spec: dict, output_limit: int, send, measure_once=_measure_once) -> int:
+    """
+    Measure each program and send the results
+
+    Timed runs alternate between the programs, and the fastest of `repeat`
+    runs is kept. Memory is measured in
+    one more run with tracemalloc, which would distort the timings. A run
+    stopped for going over `cpu_limit` is reported as timed out.
+    """
+    real_stdout = sys.stdout
+    repeat = max(1, int(spec.get("repeat", 3)))
+    compiled, results = [], []
+    for code in programs:
+        result = {"cpu_seconds": None, "wall_seconds": None, "peak_memory_bytes": None,
+                  "retained_blocks": None, "error": None, "timed_out": False}
+        try:
+            compiled.append(compile(code, "<submission>", "exec"))
+        except SyntaxError as e:
+            compiled.append(None)
+            result["error"] = _describe_error(e)
+        results.append(result)
+
+    # A submission well over its CPU budget isn't measured further (tracing is many times slower)
+    cpu_limit = spec.get("cpu_limit")
+    over_limit = [False] * len(compiled)
+    use_timer = cpu_limit is not None and hasattr(signal, "setitimer")
+    if use_timer:
+        signal.signal(signal.SIGALRM, _on_case_timeout)
+
+    for traced in [False] * repeat + [True]:
+        for index, (program, result) in enumerate(zip(compiled, results)):
+            if result["error"] is not None or over_limit[index]:
+                continue
+            # Only timed runs are limited; the traced run is many times slower by design
+            limited = index == 0 and cpu_limit is not None and not traced
+            try:
+                if limited and use_timer:
+                    signal.setitimer(signal.ITIMER_REAL, 4 * float(cpu_limit) + 0.05)
+                for key, value in measure_once(program, spec, output_limit, traced, real_stdout).items():
+                    result[key] = value if result[key] is None else min(result[key], value)
+            except CaseTimeout:
+                result["timed_out"] = True
+                over_limit[index] = True
+            except BaseException as e:
+                result["error"] = _describe_error(e)
+            finally:
+                if limited and use_timer:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+            # Stop only when clearly over: one slow run (e.g. the first, with cold caches) can be noise
+            if limited and (result["cpu_seconds"] or 0.0) > 2 * float(cpu_limit):
+                over_limit[index] = True
+
+    send({"measurements": results})
+    return 0
+
+
+def run_job(job: dict, send=None) -> int:
+    """Run a job; test, route and measurement runs pass their results to send"""
+    output_limit = int(job.get("limits", {}).get("output_bytes") or DEFAULT_OUTPUT_LIMIT)
+    if "tests" in job:
+        return run_test_cases(job["code"], job["tests"], float(job.get("case_timeout", 2)), output_limit, send)
+    if "routes" in job:
+        return run_route_checks(
+            job["code"], job["routes"], job.get("app", "app"), float(job.get("case_timeout", 2)), output_limit, send
+        )
+    if "measure" in job:
+        return run_measurements([job["code"]], job["measure"], output_limit, send)
+    return execute_submission(job["code"])
+
+
+def has_results(job: dict) -> bool:
+    """Whether a job's child sends results (tests, routes or measurements) besides its output"""
+    return any(key in job for key in ("tests", "routes", "measure"))
+
+
+def result_sender(fd: int, nonce: str):
+    """
+    Send results on their own pipe, each line tagged with the run's nonce
+
+    Anything the submission writes to stdout (including sys.__stdout__)
+    can't pass for results, and a line on the results pipe without the nonce
+    is ignored. os.write and json.dumps are bound here, before the submission
+    runs and can replace them. The submission runs in the same process, so
+    this only raises the bar: results never say whether a case passed, and
+    the expected values they are checked against never reach the child.
+    """
+    def send(payload: dict, write=os.write, dumps=json.dumps):
+        data = f"{nonce} {dumps(payload, default=repr)}\n".encode("utf-8")
+        while data:
+            data = data[write(fd, data):]
+    return send
+
+
+def tagged_results(data: bytes, nonce: str) -> dict:
+    """The last results line carrying the run's nonce, or {} if there is none"""
+    prefix = f"{nonce} "
+    for line in reversed(data.decode("utf-8", errors="replace").splitlines()):
+        if line.startswith(prefix):
+            try:
+                return json.loads(line[len(prefix):])
+            except json.JSONDecodeError:
+                return {}
+    return {}
+
+
+def parse_test_output(job: dict, reply: dict):
+    """Move the test, route or measurement results the child sent into the reply"""
+    payload = reply.pop("results", None)
+    if not has_results(job) or payload is None:
+        return
+    if "measure" in job:
+        reply["measurements"] = payload.get("measurements")
+        return
+    reply["tests"] = payload.get("tests")
+    reply["test_error"] = payload.get("error")
+
+
+def _output_lines(text: str) -> list:
+    """Lines as compared: trailing spaces and surrounding blank lines don't matter"""
+    lines = [line.rstrip() for line in text.replace("\r\n", "\n").split("\n")]
+    while lines and not lines[-1]:
+        lines.pop()
+    while lines and not lines[0]:
+        lines.pop(0)
+    return lines
+
+
+class OutputChecker:
+    """Compares a program's stdout with the expected output chunk by chunk, as it is read"""
+
+    def __init__(self, expected: str):
+        self.expected = _output_lines(expected)
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.line = 0  # Expected lines matched so far
+        self.partial = ""  # Start of a line that hasn't ended yet
+        self.diverged = False
+
+    def feed(self, chunk: bytes) -> bool:
+        """Consume output, returning False once it can no longer match"""
+        if self.diverged:
+            return False
+        *lines, self.partial = (self.partial + self.decoder.decode(chunk)).split("\n")
+        for line in lines:
+            if not self._complete_line(line.rstrip()):
+                self.diverged = True
+                return False
+        # A line still being written must be the start of the expected one
+        partial = self.partial.rstrip()
+        if partial and (self.line >= len(self.expected) or not self.expected[self.line].startswith(partial)):
+            self.diverged = True
+        return not self.diverged
+
+    def _complete_line(self, line: str) -> bool:
+        if self.line < len(self.expected) and line == self.expected[self.line]:
+            self.line += 1
+            return True
+        # Blank lines are fine before the output starts and after it ends
+        return not line and (self.line == 0 or self.line >= len(self.expected))
+
+    def matches(self) -> bool:
+        """Whether the output read so far, taken as complete, matches"""
+        if self.diverged:
+            return False
+        last = (self.partial + self.decoder.decode(b"", final=True)).rstrip()
+        if last and not self._complete_line(last):
+            return False
+        return self.line == len(self.expected)
+
+    def result(self) -> dict:
+        matched = self.matches()
+        return {
+            "output_matches": matched,
+            # 1-based line of the first difference, for feedback
+            "output_mismatch_line": None if matched else self.line + 1
+        }
+
+
+def check_output(job: dict, reply: dict):
+    """Compare the output of a run that finished without streaming (in-process fallback)"""
+    if "expected_output" not in job or any(key in job for key in ("tests", "routes", "measure")) or "output_matches" in reply:
+        return
+    checker = OutputChecker(str(job["expected_output"]))
+    checker.feed(reply.get("stdout", "").encode("utf-8"))
+    reply.update(checker.result())
+
+
+class LineStream:
+    """Decodes one output pipe incrementally and emits each complete line as an event"""
+
+    def __init__(self, name: str, emit):
+        self.name = name
+        self.emit = emit
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.pending = ""
+
+    def feed(self, chunk: bytes):
+        *lines, self.pending = (self.pending + self.decoder.decode(chunk)).split("\n")
+        for line in lines:
+            self.emit({"event": "output", "stream": self.name, "line": line})
+
+    def close(self):
+        rest = self.pending + self.decoder.decode(b"", final=True)
+        self.pending = ""
+        if rest:
+            self.emit({"event": "output", "stream": self.name, "line": rest})
+
+
+def _read_into(fd: int, output: dict, selector: selectors.BaseSelector) -> bytes:
+    chunk = os.read(fd, READ_CHUNK)
+    if chunk:
+        output[fd] += chunk
+    else:
+        selector.unregister(fd)
+    return chunk
+
+
+def run_forked(job: dict, emit=None) -> dict:
+    """Run a job in a forked child, collecting its output until it exits or times out"""
+    timeout = float(job.get("timeout", 10))
+    output_limit = int(job.get("limits", {}).get("output_bytes") or DEFAULT_OUTPUT_LIMIT)
+    if "tests" in job or "routes" in job:
+        # Test results carry each case's (already capped) stdout, JSON-escaped
+        output_limit = 2 * output_limit * (len(job.get("tests") or job["routes"]) + 1)
+    checker = None
+    if "expected_output" in job and not has_results(job):
+        checker = OutputChecker(str(job["expected_output"]))
+        output_limit = min(output_limit, 2 * len(str(job["expected_output"]).encode("utf-8")) + EXPECTED_OUTPUT_SLACK)
+    out_read, out_write = os.pipe()
+    err_read, err_write = os.pipe()
+    # Results never share a pipe with the program's output, and carry a nonce only this run knows
+    result_read = result_write = None
+    nonce = None
+    if has_results(job):
+        result_read, result_write = os.pipe()
+        nonce = os.urandom(16).hex()
+    # Test and route runs capture each case's stdout; streamed runs also echo it on a pipe of its own
+    streams = {}
+    echo_read = echo_write = None
+    if job.get("stream") and emit is not None and "measure" not in job:
+        streams[err_read] = LineStream("stderr", emit)
+        if "tests" in job or "routes" in job:
+            echo_read, echo_write = os.pipe()
+            streams[echo_read] = LineStream("stdout", emit)
+        else:
+            streams[out_read] = LineStream("stdout", emit)
+    start = time.perf_counter()
+
+    pid = os.fork()
+    if pid == 0:
+        # Child: own process group, so a timeout also kills anything it spawns
+        os.setpgid(0, 0)
+        # Detach from the protocol pipes before running any user code
+        os.close(out_read)
+        os.close(err_read)
+        send = None
+        if result_read is not None:
+            os.close(result_read)
+            send = result_sender(result_write, nonce)
+        if echo_read is not None:
+            os.close(echo_read)
+            LimitedOutput.echo = open(echo_write, "w", buffering=1, closefd=False)
+        for fd in PROTOCOL_FDS:
+            os.close(fd)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(out_write, 1)
+        os.dup2(err_write, 2)
+        sys.stdin = open(0, "r", closefd=False)
+        sys.stdout = open(1, "w", buffering=1, closefd=False)
+        sys.stderr = open(2, "w", buffering=1, closefd=False)
+        exit_code = 1
+        try:
+            apply_limits(job.get("limits", {}), timeout)
+            exit_code = run_job(job, send)
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                if LimitedOutput.echo is not None:
+                    LimitedOutput.echo.flush()
+            finally:
+                os._exit(exit_code)
+
+    try:
+        # Also set from the parent so the group exists before any kill below
+        os.setpgid(pid, pid)
+    except (PermissionError, ProcessLookupError):
+        pass
+    if emit is not None:
+        # Lets the pool kill the child directly if the caller gives up on the job
+        emit({"event": "started", "pid": pid})
+    os.close(out_write)
+    os.close(err_write)
+    output = {out_read: bytearray(), err_read: bytearray()}
+    selector = selectors.DefaultSelector()
+    selector.register(out_read, selectors.EVENT_READ)
+    selector.register(err_read, selectors.EVENT_READ)
+    if echo_read is not None:
+        os.close(echo_write)
+        output[echo_read] = bytearray()
+        selector.register(echo_read, selectors.EVENT_READ)
+    if result_read is not None:
+        os.close(result_write)
+        output[result_read] = bytearray()
+        selector.register(result_read, selectors.EVENT_READ)
+
+    def read(fd: int):
+        chunk = _read_into(fd, output, selector)
+        if checker is not None and fd == out_read and chunk:
+            checker.feed(chunk)
+        if fd in streams and chunk:
+            streams[fd].feed(chunk)
+        if fd == echo_read:
+            # Only streamed; each case keeps its own copy in the results
+            output[fd].clear()
+
+    timed_out = False
+    output_exceeded = False
+    status = None
+    deadline = start + timeout
+    while not output_exceeded and not (checker and checker.diverged):
+        waited_pid, status = os.waitpid(pid, os.WNOHANG)
+        if waited_pid:
+            break
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            timed_out = True
+            break
+        if not selector.get_map():
+            # Output closed, the child is about to exit (or still running with closed pipes)
+            time.sleep(min(remaining, EXIT_POLL_INTERVAL))
+            continue
+        # Wake up regularly: the child may exit while something it spawned holds the pipes open
+        for key, _ in selector.select(min(remaining, POLL_INTERVAL)):
+            read(key.fd)
+        # Stop a runaway print loop instead of buffering everything it writes
+        output_exceeded = sum(len(data) for data in output.values()) > output_limit
+
+    # Kill the group either way: nothing the submission spawned may outlive it
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    stopped_early = output_exceeded or (checker is not None and checker.diverged)
+    if timed_out or stopped_early:
+        _, status = os.waitpid(pid, 0)
+
+    # Collect what is left in the pipes; give up on writers that escaped the group
+    while selector.get_map() and not stopped_early:
+        events = selector.select(DRAIN_TIMEOUT)
+        if not events:
+            break
+        for key, _ in events:
+            read(key.fd)
+    duration = time.perf_counter() - start
+
+    selector.close()
+    os.close(out_read)
+    os.close(err_read)
+    if echo_read is not None:
+        os.close(echo_read)
+    if result_read is not None:
+        os.close(result_read)
+    for stream in streams.values():
+        stream.close()
+
+    limit_exceeded = None
+    if os.WIFSIGNALED(status):
+        returncode = -os.WTERMSIG(status)
+        if returncode == -signal.SIGXCPU:
+            limit_exceeded = "cpu"
+    else:
+        returncode = os.WEXITSTATUS(status)
+    if output_exceeded:
+        limit_exceeded = "output"
+
+    reply = {
+        "returncode": returncode,
+        "stdout": output[out_read][:output_limit].decode("utf-8", errors="replace"),
+        "stderr": output[err_read][:output_limit].decode("utf-8", errors="replace"),
+        "timed_out": timed_out,
+        "limit_exceeded": limit_exceeded,
+        "duration": duration
+    }
+    if result_read is not None:
+        reply["results"] = tagged_results(bytes(output[result_read]), nonce)
+    if checker is not None:
+        reply.update(checker.result())
+    return reply
+
+
+def run_in_process(job: dict, emit=None) -> dict:
+    """Fallback for platforms without fork; the pool enforces the timeout by killing the worker"""
+    stdout, stderr = io.StringIO(), io.StringIO()
+    real_stdout, real_stderr = sys.stdout, sys.stderr
+    start = time.perf_counter()
+    results = []
+    sys.stdout, sys.stderr = stdout, stderr
+    try:
+        returncode = run_job(job, results.append)
+    finally:
+        sys.stdout, sys.stderr = real_stdout, real_stderr
+    reply = {
+        "returncode": returncode,
+        "stdout": stdout.getvalue(),
+        "stderr": stderr.getvalue(),
+        "timed_out": False,
+        "duration": time.perf_counter() - start,
+        # The submission may have changed interpreter state, don't reuse this worker
+        "recycle": True
+    }
+    if has_results(job):
+        # Passed in memory; json round trip as for a forked run
+        reply["results"] = json.loads(json.dumps(results[-1], default=repr)) if results else {}
+    return reply
+
+
+def run_measured(run, job: dict, emit=None) -> dict:
+    """
+    Measure the reference solution, then the submission, each in a child of its own
+
+    The reference runs first and apart from any user code, so a submission
+    can't change how fast the reference appears. The submission gets what
+    is left of the job's time limit; the reply carries both measurements.
+    """
+    spec = job["measure"]
+    start = time.perf_counter()
+    reference_job = {key: value for key, value in job.items() if key not in ("stream", "expected_output")}
+    reference_job["code"] = spec["reference"]
+    reference_job["measure"] = {key: value for key, value in spec.items() if key != "cpu_limit"}
+    reference = run(reference_job, emit)
+    reference_measurements = (reference.get("results") or {}).get("measurements") or [
+        {"error": "Reference solution timed out" if reference.get("timed_out") else "Reference solution could not be measured"}
+    ]
+
+    remaining = max(0.0, float(job.get("timeout", 10)) - (time.perf_counter() - start))
+    reply = run(dict(job, timeout=remaining), emit)
+    measurements = (reply.get("results") or {}).get("measurements")
+    if isinstance(measurements, list) and measurements:
+        reply["results"] = {"measurements": measurements[:1] + reference_measurements[:1]}
+    else:
+        reply["results"] = {}
+    if reference.get("recycle"):
+        reply["recycle"] = True
+    return reply
+
+
+def main():
+    for module in sys.argv[1:]:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
+    # Keep the protocol streams private so nothing else can write to them
+    protocol_in = os.fdopen(os.dup(0), "rb")
+    protocol_out = os.fdopen(os.dup(1), "wb")
+    PROTOCOL_FDS.extend([protocol_in.fileno(), protocol_out.fileno()])
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+
+    run = run_forked if hasattr(os, "fork") else run_in_process
+
+    def emit(event: dict):
+        protocol_out.write(json.dumps(event).encode("utf-8") + b"\n")
+        protocol_out.flush()
+
+    for line in protocol_in:
+        try:
+            job = json.loads(line)
+            result = run_measured(run, job, emit) if "measure" in job else run(job, emit)
+            parse_test_output(job, result)
+            check_output(job, result)
+        except Exception as e:
+            result = {"error": f"{type(e).__name__}: {e}", "recycle": True}
+        protocol_out.write(json.dumps(result).encode("utf-8") + b"\n")
+        protocol_out.flush()
+        if result.get("recycle"):
+            break
+
+
+if __name__ == "__main__":
+    main()
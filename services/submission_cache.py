@@ -0,0 +1,102 @@
+"""
+Cache of validation results for repeat submissions
+"""
+
+import ast
+import hashlib
+import io
+import os
+import threading
+import tokenize
+from collections import OrderedDict
+from dataclasses import replace
+from typing import Any, Dict, Optional
+
+
+class SubmissionCache:
+    """
+    LRU of validation results keyed by exercise and normalized code
+
+    Two submissions share a result when their syntax trees (and comments) are
+    identical, so re-indenting or reformatting code is still a hit, except for
+    fill-in-the-blank exercises, whose answers depend on formatting. An exact
+    resubmission is found by a hash of the raw text without parsing it again.
+    """
+
+    def __init__(self, max_size: Optional[int] = None):
+        self.max_size = max_size or int(os.getenv("SUBMISSION_CACHE_SIZE", "10000"))
+        self._results: "OrderedDict[str, Any]" = OrderedDict()  # normalized key -> ValidationResult
+        self._sources: "OrderedDict[str, str]" = OrderedDict()  # raw code key -> normalized key
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def source_key(exercise_key: str, code: str) -> str:
+        return hashlib.sha256(f"{exercise_key}\0{code}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def normalized_key(exercise_key: str, tree: ast.AST, code: str, exact: bool = False) -> str:
+        """
+        Key from the syntax tree without positions, plus comments (blank checks can see them)
+
+        With exact set the raw text is part of the key too, so only identical
+        code shares a result.
+        """
+        digest = hashlib.sha256(exercise_key.encode("utf-8"))
+        digest.update(ast.dump(tree, annotate_fields=False).encode("utf-8"))
+        if exact:
+            digest.update(b"\0" + code.encode("utf-8"))
+        try:
+            for token in tokenize.generate_tokens(io.StringIO(code).readline):
+                if token.type == tokenize.COMMENT:
+                    digest.update(b"\0" + token.string.encode("utf-8"))
+        except (tokenize.TokenError, SyntaxError):
+            pass
+        return digest.hexdigest()
+
+    def get_by_source(self, source_key: str):
+        """Result for an exact resubmission, or None"""
+        with self._lock:
+            key = self._sources.get(source_key)
+            if key is None or key not in self._results:
+                return None
+            self._sources.move_to_end(source_key)
+            return self._hit(key)
+
+    def get(self, key: str):
+        """Result for a normalized key, or None"""
+        with self._lock:
+            if key not in self._results:
+                self.misses += 1
+                return None
+            return self._hit(key)
+
+    def put(self, source_key: str, key: str, result):
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            self._sources[source_key] = key
+            self._sources.move_to_end(source_key)
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+            while len(self._sources) > self.max_size:
+                self._sources.popitem(last=False)
+
+    def remember_source(self, source_key: str, key: str):
+        """Point another raw spelling at an already cached result"""
+        with self._lock:
+            self._sources[source_key] = key
+            self._sources.move_to_end(source_key)
+            while len(self._sources) > self.max_size:
+                self._sources.popitem(last=False)
+
+    def _hit(self, key: str):
+        self._results.move_to_end(key)
+        self.hits += 1
+        # Callers get their own copy, so they can't change the cached result
+        return replace(self._results[key])
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._results), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
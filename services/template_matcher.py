@@ -0,0 +1,147 @@
+"""
+Extraction of fill-in-the-blank answers by aligning a submission with its template
+"""
+
+import ast
+import io
+import re
+import tokenize
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+# {{name}}; in "{{{name}}}" the outer braces are literal code around the blank
+PLACEHOLDER_PATTERN = re.compile(r"\{\{(\w+)\}\}")
+
+BRACKETS = {")": "(", "]": "[", "}": "{"}
+
+
+def _normalize_text(text: str) -> str:
+    """Ignore line ending style and trailing spaces, which editors change freely"""
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip("\n")
+
+
+@dataclass(frozen=True)
+class TemplateMatcher:
+    """A code template split into the literal text between its placeholders"""
+    literals: Tuple[str, ...]  # One more than there are placeholders
+    placeholders: Tuple[str, ...]  # In template order, e.g. ("{{name}}", "{{value}}", "{{name}}")
+
+    def extract(self, code: str) -> Optional[List[str]]:
+        """
+        The text filling each placeholder occurrence, in template order
+
+        Walks the code once, finding each literal in turn after the previous
+        one. Returns None when the code around the blanks was changed.
+        """
+        code = _normalize_text(code)
+        first = self.literals[0]
+        if not code.startswith(first):
+            return None
+
+        answers = []
+        pos = len(first)
+        last_index = len(self.placeholders) - 1
+        for index, literal in enumerate(self.literals[1:]):
+            if index == last_index:
+                # The last literal has to end the code
+                end = len(code) - len(literal)
+                if end < pos or not code.endswith(literal):
+                    return None
+            else:
+                end = self._find_literal(code, literal, pos)
+                if end < 0:
+                    return None
+            answers.append(code[pos:end].strip())
+            pos = end + len(literal)
+        return answers
+
+    @staticmethod
+    def _find_literal(code: str, literal: str, pos: int) -> int:
+        """
+        The first occurrence of literal after pos with brackets and quotes closed before it
+
+        So "f(x)" isn't cut at the first ")". Bracket and quote depth is tracked
+        in one forward pass while str.find jumps to each next occurrence, so
+        the search is O(len(code)) plus O(len(literal)) per occurrence skipped.
+        """
+        stack = []
+        quote = None
+        scanned = pos
+        end = code.find(literal, pos)
+        while end >= 0:
+            for char in code[scanned:end]:
+                if quote:
+                    if char == quote:
+                        quote = None
+                elif char in "'\"":
+                    quote = char
+                elif char in "([{":
+                    stack.append(char)
+                elif char in BRACKETS:
+                    if not stack or stack.pop() != BRACKETS[char]:
+                        # Unmatched, so no later occurrence can be balanced either
+                        return -1
+            scanned = end
+            if not stack and quote is None:
+                return end
+            end = code.find(literal, end + 1)
+        return -1
+
+
+@lru_cache(maxsize=1024)
+def compile_template(template: str) -> TemplateMatcher:
+    """Split a template once; exercises share templates, so matchers are cached by text"""
+    template = _normalize_text(template)
+    literals = []
+    placeholders = []
+    pos = 0
+    for match in PLACEHOLDER_PATTERN.finditer(template):
+        literals.append(template[pos:match.start()])
+        placeholders.append(match.group(0))
+        pos = match.end()
+    literals.append(template[pos:])
+    return TemplateMatcher(literals=tuple(literals), placeholders=tuple(placeholders))
+
+
+def _strip_quotes(answer: str) -> str:
+    if len(answer) >= 2 and answer[0] == answer[-1] and answer[0] in "'\"":
+        return answer[1:-1]
+    return answer
+
+
+def _tokens(text: str) -> Optional[List[str]]:
+    """Python tokens of an answer, so spacing between tokens doesn't matter but spacing in strings does"""
+    skipped = (tokenize.NEWLINE, tokenize.NL, tokenize.INDENT, tokenize.DEDENT, tokenize.ENDMARKER, tokenize.COMMENT)
+    try:
+        return [
+            token.string for token in tokenize.generate_tokens(io.StringIO(text).readline)
+            if token.type not in skipped
+        ]
+    except (tokenize.TokenError, SyntaxError):
+        return None
+
+
+def _expression_dump(answer: str) -> Optional[str]:
+    try:
+        return ast.dump(ast.parse(answer, mode="eval"))
+    except (SyntaxError, ValueError):
+        return None
+
+
+def answers_match(answer: str, correct_answer: str) -> bool:
+    """
+    Whether a blank's answer is equivalent to the expected one
+
+    Equal ignoring surrounding quotes, the same tokens (a+b matches a + b),
+    or the same Python expression ('John' matches "John").
+    """
+    answer, correct_answer = answer.strip(), correct_answer.strip()
+    if _strip_quotes(answer) == _strip_quotes(correct_answer):
+        return True
+    expected_tokens = _tokens(correct_answer)
+    if expected_tokens is not None and expected_tokens == _tokens(answer):
+        return True
+    expected = _expression_dump(correct_answer)
+    return expected is not None and expected == _expression_dump(answer)
@@ -0,0 +1,77 @@
+"""
+Keyword-based topic classifier for learning step text
+"""
+
+import json
+import os
+import re
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+# Default taxonomy: topic -> {keyword or phrase: weight}
+TAXONOMY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "topic_taxonomy.json")
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9_]+")
+
+
+def _stem(token: str) -> str:
+    """Very small plural stemmer so 'routes' matches 'route' and 'dictionaries' matches 'dictionary'"""
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    return [_stem(token) for token in TOKEN_PATTERN.findall(text.lower())]
+
+
+class TopicClassifier:
+    """
+    Scores text against a topic taxonomy in a single pass
+    
+    Keywords and multi-word phrases are compiled into an inverted index from
+    phrase to (topic, weight) pairs. Classifying walks the tokens once, looking
+    up every phrase of up to max_phrase_words words that starts at each token,
+    so the cost depends on the text length and not on the number of topics.
+    """
+
+    def __init__(self, taxonomy: Dict[str, Dict[str, float]]):
+        self.index: Dict[str, List[Tuple[str, float]]] = defaultdict(list)
+        # Topics listed earlier win ties, which keeps results deterministic
+        self.priority = {topic: position for position, topic in enumerate(taxonomy)}
+        self.max_phrase_words = 1
+
+        for topic, keywords in taxonomy.items():
+            for keyword, weight in keywords.items():
+                phrase = " ".join(tokenize(keyword))
+                if not phrase:
+                    continue
+                self.index[phrase].append((topic, float(weight)))
+                self.max_phrase_words = max(self.max_phrase_words, phrase.count(" ") + 1)
+
+        self.index = dict(self.index)
+
+    @classmethod
+    def from_file(cls, path: str = TAXONOMY_PATH) -> "TopicClassifier":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    @property
+    def topics(self) -> List[str]:
+        return list(self.priority)
+
+    def classify(self, text: str) -> List[Tuple[str, float]]:
+        """Return (topic, score) pairs for every matching topic, best first"""
+        tokens = tokenize(text)
+        scores: Dict[str, float] = defaultdict(float)
+
+        for start in range(len(tokens)):
+            for length in range(1, min(self.max_phrase_words, len(tokens) - start) + 1):
+                matches = self.index.get(" ".join(tokens[start:start + length]))
+                if matches:
+                    for topic, weight in matches:
+                        scores[topic] += weight
+
+        return sorted(scores.items(), key=lambda item: (-item[1], self.priority[item[0]]))
@@ -0,0 +1,273 @@
+"""
+Database-backed queue that hands code validation to separate worker processes
+"""
+
+import asyncio
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, or_, update
+
+from database.database import SessionLocal, ValidationJob
+from services.code_validator import CodeValidator, ValidationResult, code_validator
+
+# "local" validates in the API process, "queue" enqueues for `python main.py validation-worker`
+VALIDATION_BACKEND = os.getenv("VALIDATION_BACKEND", "local")
+
+
+class ValidationJobTimeout(Exception):
+    """Raised when no worker finished a job in time"""
+
+
+class ValidationJobQueue:
+    """
+    Validation jobs stored in the application database
+
+    API processes enqueue a job and await its result; worker processes on
+    any machine sharing the database claim queued jobs, validate them and
+    store the result. A job whose worker died is claimed again once its
+    lease runs out. A submission identical to a queued, running or
+    (non-transient) finished job reuses that job instead of adding one.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        poll_interval: Optional[float] = None,
+        timeout: Optional[float] = None,
+        lease_seconds: Optional[float] = None,
+        max_attempts: int = 3
+    ):
+        self.session_factory = session_factory
+        self.poll_interval = poll_interval or float(os.getenv("VALIDATION_JOB_POLL_SECONDS", "0.05"))
+        self.timeout = timeout or float(os.getenv("VALIDATION_JOB_TIMEOUT", "60"))
+        self.lease_seconds = lease_seconds or float(os.getenv("VALIDATION_JOB_LEASE", "60"))
+        self.max_attempts = max_attempts
+        # Jobs a caller may keep in flight at once (used by batch validation)
+        self.concurrency = int(os.getenv("VALIDATION_JOBS_IN_FLIGHT", "64"))
+        self._waiters: Dict[int, List[asyncio.Future]] = {}
+        self._poller: Optional[asyncio.Task] = None
+
+    # API side
+
+    async def validate_exercise_async(
+        self,
+        user_code: str,
+        exercise: Dict,
+        test_cases: List[Dict] = None
+    ) -> ValidationResult:
+        """Same as CodeValidator.validate_exercise_async, but run by a validation worker"""
+        job_id = await asyncio.to_thread(self.enqueue, user_code, exercise, test_cases)
+        return await self.wait(job_id)
+
+    def enqueue(self, user_code: str, exercise: Dict, test_cases: List[Dict] = None) -> int:
+        """Add a job (or find an identical one) and return its id"""
+        source_key = code_validator.cache.source_key(code_validator._exercise_key(exercise, test_cases), user_code)
+        db = self.session_factory()
+        try:
+            existing = db.query(ValidationJob.id).filter(
+                ValidationJob.source_key == source_key,
+                or_(
+                    ValidationJob.status.in_(("queued", "running")),
+                    (ValidationJob.status == "done") & (ValidationJob.transient == False)  # noqa: E712
+                )
+            ).order_by(ValidationJob.id.desc()).first()
+            if existing is not None:
+                return existing[0]
+
+            job = ValidationJob(
+                status="queued",
+                source_key=source_key,
+                payload={"user_code": user_code, "exercise": exercise, "test_cases": test_cases}
+            )
+            db.add(job)
+            db.commit()
+            return job.id
+        finally:
+            db.close()
+
+    async def wait(self, job_id: int, timeout: Optional[float] = None) -> ValidationResult:
+        """Wait for a job's result; all waiters in this process share one polling loop"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(job_id, []).append(future)
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll())
+        try:
+            return await asyncio.wait_for(future, timeout or self.timeout)
+        except asyncio.TimeoutError:
+            raise ValidationJobTimeout(f"Validation job {job_id} did not finish in time")
+        finally:
+            futures = self._waiters.get(job_id)
+            if futures is not None and future in futures:
+                futures.remove(future)
+                if not futures:
+                    del self._waiters[job_id]
+
+    async def _poll(self):
+        while self._waiters:
+            finished = await asyncio.to_thread(self._finished_jobs, list(self._waiters))
+            for job_id, result, error in finished:
+                for future in self._waiters.pop(job_id, []):
+                    if future.done():
+                        continue
+                    if error is not None:
+                        future.set_exception(RuntimeError(error))
+                    else:
+                        future.set_result(ValidationResult.from_dict(result))
+            await asyncio.sleep(self.poll_interval)
+
+    def _finished_jobs(self, job_ids: List[int]) -> List[Tuple[int, Optional[Dict], Optional[str]]]:
+        db = self.session_factory()
+        try:
+            rows = db.query(ValidationJob.id, ValidationJob.result, ValidationJob.error).filter(
+                ValidationJob.id.in_(job_ids),
+                ValidationJob.status.in_(("done", "failed"))
+            ).all()
+            return [(row.id, row.result, row.error) for row in rows]
+        finally:
+            db.close()
+
+    # Worker side
+
+    def claim(self, worker_id: str) -> Optional[ValidationJob]:
+        """Take the oldest queued job (or one whose worker's lease ran out), or None"""
+        db = self.session_factory()
+        try:
+            now = datetime.utcnow()
+            expired = now - timedelta(seconds=self.lease_seconds)
+            # A job that keeps killing its worker is given up on
+            db.execute(
+                update(ValidationJob)
+                .where(ValidationJob.status == "running", ValidationJob.started_at < expired,
+                       ValidationJob.attempts >= self.max_attempts)
+                .values(status="failed", error="Validation worker stopped responding", finished_at=now)
+            )
+            candidate = db.query(ValidationJob.id).filter(
+                or_(
+                    ValidationJob.status == "queued",
+                    (ValidationJob.status == "running") & (ValidationJob.started_at < expired)
+                )
+            ).order_by(ValidationJob.id).first()
+            if candidate is None:
+                db.commit()
+                return None
+            # Only one worker wins the job: the update matches nothing if another claimed it first
+            claimed = db.execute(
+                update(ValidationJob)
+                .where(
+                    ValidationJob.id == candidate[0],
+                    or_(
+                        ValidationJob.status == "queued",
+                        (ValidationJob.status == "running") & (ValidationJob.started_at < expired)
+                    )
+                )
+                .values(status="running", worker_id=worker_id, started_at=now, attempts=ValidationJob.attempts + 1)
+            )
+            db.commit()
+            if claimed.rowcount != 1:
+                return None
+            job = db.get(ValidationJob, candidate[0])
+            db.expunge(job)
+            return job
+        finally:
+            db.close()
+
+    def complete(self, job_id: int, result: ValidationResult):
+        self._finish(job_id, status="done", result=result.to_dict(), transient=result.transient)
+
+    def fail(self, job_id: int, error: str):
+        self._finish(job_id, status="failed", error=error)
+
+    def _finish(self, job_id: int, **values):
+        db = self.session_factory()
+        try:
+            db.execute(
+                update(ValidationJob).where(ValidationJob.id == job_id)
+                .values(finished_at=datetime.utcnow(), **values)
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def purge(self, older_than: timedelta) -> int:
+        """Delete finished jobs older than the given age"""
+        db = self.session_factory()
+        try:
+            deleted = db.query(ValidationJob).filter(
+                ValidationJob.status.in_(("done", "failed")),
+                ValidationJob.finished_at < datetime.utcnow() - older_than
+            ).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+    def stats(self) -> Dict[str, int]:
+        db = self.session_factory()
+        try:
+            counts = {status: 0 for status in ("queued", "running", "done", "failed")}
+            for status, count in db.query(ValidationJob.status, func.count(ValidationJob.id)).group_by(ValidationJob.status):
+                counts[status] = count
+            counts["waiting_here"] = len(self._waiters)
+            return counts
+        finally:
+            db.close()
+
+
+class ValidationWorker:
+    """Claims jobs from the queue and validates them with a local CodeValidator"""
+
+    def __init__(self, queue: ValidationJobQueue, validator: CodeValidator, concurrency: Optional[int] = None):
+        self.queue = queue
+        self.validator = validator
+        self.concurrency = concurrency or validator.sandbox.size
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.processed = 0
+        self.failed = 0
+
+    async def run(self, stop: Optional[asyncio.Event] = None, retention: timedelta = timedelta(hours=24)):
+        """Process jobs until stopped, keeping up to `concurrency` validations running"""
+        stop = stop or asyncio.Event()
+        slots = asyncio.Semaphore(self.concurrency)
+        running = set()
+        last_purge = 0.0
+        while not stop.is_set():
+            await slots.acquire()
+            job = await asyncio.to_thread(self.queue.claim, self.worker_id)
+            if job is None:
+                slots.release()
+                if time.monotonic() - last_purge > 3600:
+                    await asyncio.to_thread(self.queue.purge, retention)
+                    last_purge = time.monotonic()
+                try:
+                    await asyncio.wait_for(stop.wait(), self.queue.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.create_task(self._process(job, slots))
+            running.add(task)
+            task.add_done_callback(running.discard)
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+    async def _process(self, job: ValidationJob, slots: asyncio.Semaphore):
+        try:
+            payload = job.payload
+            result = await self.validator.validate_exercise_async(
+                payload["user_code"], payload["exercise"], payload.get("test_cases")
+            )
+            await asyncio.to_thread(self.queue.complete, job.id, result)
+            self.processed += 1
+        except Exception as e:
+            await asyncio.to_thread(self.queue.fail, job.id, f"{type(e).__name__}: {e}")
+            self.failed += 1
+        finally:
+            slots.release()
+
+
+# Global validation job queue instance
+validation_jobs = ValidationJobQueue()
@@ -0,0 +1,141 @@
+"""
+Admission control and per-user fair scheduling for code validation
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+
+class QueueFullError(Exception):
+    """Raised when a validation can't be queued; retry_after is a hint in seconds"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ValidationQueue:
+    """
+    Bounded queue that runs validations round-robin across users
+
+    At most `concurrency` validations run at once. Waiting validations are
+    kept per user and started one user at a time in turn, so a burst from one
+    user (or one class) only delays that user. When the queue is full, or a
+    user already has `per_user_depth` validations waiting, new requests are
+    rejected straight away with a retry hint instead of piling up.
+    """
+
+    def __init__(
+        self,
+        concurrency: Optional[int] = None,
+        max_depth: Optional[int] = None,
+        per_user_depth: Optional[int] = None
+    ):
+        self.concurrency = concurrency or int(os.getenv("VALIDATION_CONCURRENCY", "16"))
+        self.max_depth = max_depth or int(os.getenv("VALIDATION_QUEUE_DEPTH", "200"))
+        self.per_user_depth = per_user_depth or int(os.getenv("VALIDATION_QUEUE_PER_USER", "5"))
+        self._waiting: "OrderedDict[Hashable, Deque[asyncio.Future]]" = OrderedDict()
+        self._depth = 0
+        self._active = 0
+        self._wait_times: Deque[float] = deque(maxlen=1000)
+        self._service_time = 0.5  # Moving average of run time, seeds the Retry-After estimate
+        self.completed = 0
+        self.rejected = 0
+
+    async def run(self, user_id: Hashable, job: Callable[[], Awaitable[Any]]) -> Any:
+        """Wait for this user's turn, then run job(); raises QueueFullError when saturated"""
+        if self._active < self.concurrency and self._depth == 0:
+            # Idle slot and nobody waiting: no queueing needed
+            self._active += 1
+            self._wait_times.append(0.0)
+        else:
+            await self._wait_for_turn(user_id)
+
+        start = time.perf_counter()
+        try:
+            return await job()
+        finally:
+            elapsed = time.perf_counter() - start
+            self._service_time = 0.9 * self._service_time + 0.1 * elapsed
+            self.completed += 1
+            self._active -= 1
+            self._dispatch()
+
+    async def _wait_for_turn(self, user_id: Hashable):
+        user_queue = self._waiting.get(user_id)
+        if self._depth >= self.max_depth:
+            self.rejected += 1
+            raise QueueFullError("Validation queue is full", self.retry_after())
+        if user_queue is not None and len(user_queue) >= self.per_user_depth:
+            self.rejected += 1
+            raise QueueFullError("Too many validations waiting for this user", self.retry_after())
+
+        turn = asyncio.get_running_loop().create_future()
+        if user_queue is None:
+            user_queue = self._waiting[user_id] = deque()
+        user_queue.append(turn)
+        self._depth += 1
+        enqueued = time.perf_counter()
+        try:
+            await turn
+        except asyncio.CancelledError:
+            if turn.done() and not turn.cancelled():
+                # Our turn came as we were cancelled: hand the slot on
+                self._active -= 1
+                self._dispatch()
+            else:
+                self._discard(user_id, turn)
+            raise
+        self._wait_times.append(time.perf_counter() - enqueued)
+
+    def _discard(self, user_id: Hashable, turn: asyncio.Future):
+        user_queue = self._waiting.get(user_id)
+        if user_queue is not None and turn in user_queue:
+            user_queue.remove(turn)
+            self._depth -= 1
+            if not user_queue:
+                del self._waiting[user_id]
+
+    def _dispatch(self):
+        """Start waiting validations, taking one per user in turn"""
+        while self._active < self.concurrency and self._waiting:
+            user_id, user_queue = next(iter(self._waiting.items()))
+            turn = user_queue.popleft()
+            self._depth -= 1
+            if user_queue:
+                self._waiting.move_to_end(user_id)
+            else:
+                del self._waiting[user_id]
+            if turn.done():
+                continue
+            self._active += 1
+            turn.set_result(None)
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue has likely drained"""
+        return max(1, math.ceil((self._depth + self._active) / self.concurrency * self._service_time))
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._wait_times)
+        count = len(waits)
+        return {
+            "depth": self._depth,
+            "active": self._active,
+            "waiting_users": len(self._waiting),
+            "concurrency": self.concurrency,
+            "max_depth": self.max_depth,
+            "per_user_depth": self.per_user_depth,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "wait_seconds_p50": waits[count // 2] if count else 0.0,
+            "wait_seconds_p95": waits[math.ceil(0.95 * count) - 1] if count else 0.0,
+            "service_seconds_avg": round(self._service_time, 4)
+        }
+
+
+# Global validation queue instance
+validation_queue = ValidationQueue()
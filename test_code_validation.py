@@ -29,19 +29,14 @@ def login():
         print(f"❌ Login error: {e}")
         return None
 
-def test_code_validation(token):
-    """Test code validation endpoint"""
+def test_code_validation(token, exercise):
+    """Test code validation endpoint against a real exercise from a generated plan"""
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
     
     test_cases = [
         {
-            "name": "Valid Python Code",
-            "code": 'print("Hello, World!")',
-            "expected": True
-        },
-        {
-            "name": "Function Definition",
-            "code": 'def greet(name):\n    return f"Hello, {name}!"\n\nprint(greet("Alice"))',
+            "name": f"Reference Solution ({exercise['title']})",
+            "code": exercise["solution"],
             "expected": True
         },
         {
@@ -70,7 +65,7 @@ def test_code_validation(token):
         
         try:
             submission = {
-                "exercise_id": f"test_exercise_{i}",
+                "exercise_id": exercise["id"],
                 "user_code": test_case["code"],
                 "step_number": 1
             }
@@ -98,9 +93,15 @@ def test_code_validation(token):
             print(f"   ❌ Test error: {e}")
         
         time.sleep(0.5)  # Small delay between requests
+    
+    print(f"\n{len(test_cases) + 1}. Unknown Exercise ID (should be 404)")
+    submission = {"exercise_id": "does-not-exist", "user_code": "print(1)", "step_number": 1}
+    response = requests.post(f"{BASE_URL}/validate-code", json=submission, headers=headers)
+    status = "✅ PASS" if response.status_code == 404 else "❌ FAIL"
+    print(f"   Status: {status} ({response.status_code})")
 
 def test_learning_plan_with_exercises(token):
-    """Test learning plan generation with coding exercises"""
+    """Test learning plan generation with coding exercises, returning the first exercise"""
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
     
     print("\n🧪 Testing Learning Plan with Coding Exercises:")
@@ -155,6 +156,10 @@ def test_learning_plan_with_exercises(token):
                     if exercises_count > 0:
                         print(f"      First exercise: {step['coding_exercises'][0]['title']}")
                         print(f"      Difficulty: {step['coding_exercises'][0]['difficulty']}")
+                
+                for step in plan['learning_steps']:
+                    if step.get('coding_exercises'):
+                        return step['coding_exercises'][0]
             else:
                 print(f"❌ Plan generation failed: {result.get('error_message', 'Unknown error')}")
         else:
@@ -174,11 +179,14 @@ def main():
         print("❌ Cannot proceed without authentication")
         return
     
-    # Test code validation
-    test_code_validation(token)
-    
     # Test learning plan with exercises
-    test_learning_plan_with_exercises(token)
+    exercise = test_learning_plan_with_exercises(token)
+    
+    # Test code validation against one of the generated exercises
+    if exercise:
+        test_code_validation(token, exercise)
+    else:
+        print("❌ No coding exercise available to validate against")
     
     print("\n✅ Testing completed!")
 
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Query-count checks for the list endpoints
+
+Runs the API in-process against a throwaway SQLite database and counts the
+SQL statements each request executes, so a lazy load per row shows up as a
+failure instead of a slow page.
+"""
+
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Must be set before the database module creates its engines
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "query_counts.db")
+os.environ.pop("ASYNC_DATABASE_URL", None)
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from app import app
+from database.database import (
+    SessionLocal, async_engine, create_tables, User, Repository, LearningPlan, LearningPlanStep, StepProgress
+)
+
+create_tables()
+
+# A lazy load raises (lazy="raise"), report it as a failed request
+client = TestClient(app, raise_server_exceptions=False)
+
+
+@contextmanager
+def count_queries():
+    """Collect the SQL statements the API runs inside the block"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+
+
+def login(username):
+    client.post("/register", json={"username": username, "password": "secret"})
+    response = client.post("/login", json={"username": username, "password": "secret"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def seed(username, plans, repositories):
+    """Give a user plans (with steps and some progress) spread over new repositories"""
+    db = SessionLocal()
+    try:
+        user_id = db.query(User.id).filter(User.username == username).scalar()
+        repos = [
+            Repository(repo_url=f"https://github.com/{username}/repo{i}", name=f"repo{i}")
+            for i in range(repositories)
+        ]
+        db.add_all(repos)
+        db.flush()
+        for i in range(plans):
+            db.add(LearningPlan(
+                user_id=user_id,
+                repository_id=repos[i % repositories].id,
+                title=f"Plan {i}",
+                steps=[LearningPlanStep(step_number=n, title=f"Step {n}") for n in range(1, 4)],
+                progress=[StepProgress(step_number=1, completed=True, exercises_completed=0)]
+            ))
+        db.commit()
+    finally:
+        db.close()
+
+
+def get_counted(path, headers=None, **params):
+    with count_queries() as statements:
+        response = client.get(path, headers=headers, params=params)
+    assert response.status_code == 200, f"{path}: {response.status_code} {response.text}"
+    return response.json(), len(statements)
+
+
+def test_learning_plan_list():
+    """A page of plans runs the same number of queries for 1 plan or 20"""
+    print("\n1. Testing /learning-plans/...")
+    small_headers = login("list_few_plans")
+    large_headers = login("list_many_plans")
+    seed("list_few_plans", plans=1, repositories=1)
+    seed("list_many_plans", plans=45, repositories=12)
+
+    small_page, small_count = get_counted("/learning-plans/", small_headers)
+    large_page, large_count = get_counted("/learning-plans/", large_headers, limit=20)
+    next_page, next_count = get_counted("/learning-plans/", large_headers, limit=20, cursor=large_page["next_cursor"])
+
+    print(f"   {len(small_page['items'])} plan: {small_count} queries")
+    print(f"   {len(large_page['items'])} plans: {large_count} queries")
+    print(f"   next {len(next_page['items'])} plans: {next_count} queries")
+    assert len(large_page["items"]) == 20 and all(len(plan["learning_steps"]) == 3 for plan in large_page["items"])
+    assert small_count == large_count == next_count, "Query count grows with the number of plans"
+    print("✅ Constant number of queries per page")
+
+
+def test_learning_plan_detail():
+    """A single plan needs no more queries than a page of them"""
+    print("\n2. Testing /learning-plans/{id}...")
+    headers = login("detail_plans")
+    seed("detail_plans", plans=3, repositories=2)
+    page, page_count = get_counted("/learning-plans/", headers, limit=1)
+    plan, count = get_counted(f"/learning-plans/{page['items'][0]['id']}", headers)
+    print(f"   {count} queries")
+    assert plan["user"]["username"] == "detail_plans" and plan["repository"]["name"].startswith("repo")
+    assert count == page_count
+    print("✅ Plan loaded with its user, repository and steps")
+
+
+def test_repository_list():
+    """Repositories have no relationships in the response, one query per page"""
+    print("\n3. Testing /repositories/...")
+    seed("repository_owner", plans=0, repositories=12)
+    page, count = get_counted("/repositories/", limit=5)
+    deep, deep_count = get_counted("/repositories/", limit=5, cursor=page["next_cursor"])
+    print(f"   {count} queries, {deep_count} on the next page")
+    assert count == deep_count == 1
+    print("✅ One query per page")
+
+
+def main():
+    print("🧪 Testing Query Counts")
+    print("=" * 50)
+
+    failed = 0
+    for test in (test_learning_plan_list, test_learning_plan_detail, test_repository_list):
+        try:
+            test()
+        except AssertionError as e:
+            print(f"❌ {test.__name__} failed: {e}")
+            failed += 1
+
+    print("\n✅ Testing completed!" if not failed else f"\n❌ {failed} test(s) failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Checks that submissions can't grade themselves
+
+Runs submissions straight in a sandbox pool (the static checks that would
+reject most of them are skipped on purpose) and makes sure tampering with
+the worker from inside the submission doesn't change the verdict.
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.sandbox import SandboxPool
+
+sandbox = SandboxPool(size=1)
+
+ADD_TESTS = [
+    {"name": "small", "function": "add", "args": [1, 2], "expected": 3},
+    {"name": "negative", "function": "add", "args": [-1, -2], "expected": -3}
+]
+
+WRONG_ADD = "def add(a, b):\n    return 0\n"
+
+FORGERIES = {
+    "os.write": (
+        "import os\n"
+        "_w = os.write\n"
+        "os.write = lambda fd, d: _w(fd, d.replace(b'\"passed\": false', b'\"passed\": true'))\n"
+    ),
+    "json.dumps": (
+        "import json\n"
+        "_dumps = json.dumps\n"
+        "json.dumps = lambda value, **kw: _dumps(value, **kw).replace('\"passed\": false', '\"passed\": true')\n"
+    ),
+    "run_test_case": (
+        "import __main__\n"
+        "__main__.run_test_case = lambda *args: {'name': 'forged', 'passed': True, 'error': None, 'timed_out': False}\n"
+    )
+}
+
+
+def passed_count(code):
+    result = sandbox.run(code, timeout=5, tests=ADD_TESTS)
+    return sum(1 for test in result.tests or [] if test["passed"])
+
+
+def test_honest_results():
+    """The checks themselves still pass a right answer and fail a wrong one"""
+    print("\n1. Testing honest submissions...")
+    assert passed_count("def add(a, b):\n    return a + b\n") == 2
+    assert passed_count(WRONG_ADD) == 0
+    print("✅ Right answer passes, wrong answer fails")
+
+
+def test_forged_results():
+    """Patching what the worker uses to report results doesn't pass a wrong answer"""
+    print("\n2. Testing forged results...")
+    for name, forgery in FORGERIES.items():
+        count = passed_count(forgery + WRONG_ADD)
+        print(f"   {name}: {count}/2 passed")
+        assert count == 0, f"Forging through {name} passed {count} test(s)"
+    print("✅ Forged results are not accepted")
+
+
+def test_forged_route_results():
+    """Route checks are decided outside the child too"""
+    print("\n3. Testing forged route results...")
+    app = "from fastapi import FastAPI\napp = FastAPI()\n@app.get('/hello')\ndef hello():\n    return {'message': 'bye'}\n"
+    routes = [{"path": "/hello", "expected": {"message": "hello"}}]
+    result = sandbox.run(FORGERIES["os.write"] + app, timeout=10, routes=routes)
+    print(f"   passed: {result.tests[0]['passed'] if result.tests else None}")
+    assert result.tests and not result.tests[0]["passed"]
+    print("✅ Forged route results are not accepted")
+
+
+SLOW_TOTAL = "def total(n):\n    return sum([sum(range(i % 50)) for i in range(n)])\n"
+FAST_TOTAL = "def total(n):\n    return sum(range(n))\n"
+
+
+def test_forged_timings():
+    """A submission replacing the clock doesn't time itself or the reference as free"""
+    print("\n4. Testing forged timings...")
+    forgery = "import time\ntime.process_time = lambda: 0.0\ntime.perf_counter = lambda: 0.0\n"
+    spec = {"reference": FAST_TOTAL, "function": "total", "args": [200000], "repeat": 2}
+    submission, reference = sandbox.run(forgery + SLOW_TOTAL, timeout=10, measure=spec).measurements
+    print(f"   submission {submission['cpu_seconds']:.4f}s, reference {reference['cpu_seconds']:.4f}s")
+    assert submission["cpu_seconds"] > reference["cpu_seconds"] > 0
+    print("✅ Both programs are timed with the real clock")
+
+
+def test_cut_off_measurement():
+    """A run stopped at its CPU limit is reported as timed out, not as a measured time"""
+    print("\n5. Testing a run cut off at its CPU limit...")
+    spec = {"reference": FAST_TOTAL, "function": "total", "args": [200000], "repeat": 2, "cpu_limit": 0.0001}
+    submission, reference = sandbox.run(SLOW_TOTAL, timeout=10, measure=spec).measurements
+    print(f"   timed out: {submission['timed_out']}, reference timed out: {reference['timed_out']}")
+    assert submission["timed_out"] and not reference["timed_out"]
+    print("✅ Reported as timed out")
+
+
+def main():
+    print("🧪 Testing Sandbox Security")
+    print("=" * 50)
+
+    failed = 0
+    tests = (
+        test_honest_results, test_forged_results, test_forged_route_results, test_forged_timings, test_cut_off_measurement
+    )
+    try:
+        for test in tests:
+            try:
+                test()
+            except AssertionError as e:
+                print(f"❌ {test.__name__} failed: {e}")
+                failed += 1
+    finally:
+        sandbox.shutdown()
+
+    print("\n✅ Testing completed!" if not failed else f"\n❌ {failed} test(s) failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())